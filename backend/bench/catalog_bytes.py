@@ -0,0 +1,90 @@
+"""Bytes a customer downloads for one catalog page, before and after the image blob store.
+
+    python backend/bench/catalog_bytes.py --products 50 --side 1200
+
+"before" is the page as it used to be served: every product with its base64 image inline.
+"after" migrates those images into the blob store, waits for the WebP variants, then counts
+GET /api/catalog/products (default "card" variant) plus every image the page references.
+"""
+import asyncio
+import base64
+import io
+import json
+import logging
+import uuid
+from urllib.parse import urlparse
+
+import numpy as np
+from PIL import Image
+
+from common import Timer, api_client, connect, finish, parser, server
+
+
+def photo(side: int, seed: int) -> bytes:
+    """A smooth, photo-like JPEG (random colour field upscaled), roughly what phones upload."""
+    rng = np.random.default_rng(seed)
+    small = Image.fromarray(rng.integers(0, 255, (12, 12, 3), dtype=np.uint8))
+    out = io.BytesIO()
+    small.resize((side, side), Image.BICUBIC).save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+async def seed(db, products: int, side: int):
+    admin_id = str(uuid.uuid4())
+    docs = []
+    for i in range(products):
+        data = photo(side, i)
+        docs.append(server.Product(
+            name=f"Product {i}", description="Fresh from the farm", category="milk", price=30 + i,
+            unit="1L", image="data:image/jpeg;base64," + base64.b64encode(data).decode(),
+            image_type="base64", admin_id=admin_id
+        ).dict())
+    await db.products.insert_many(docs)
+
+
+async def main(args):
+    db = connect(args)
+    try:
+        await seed(db, args.products, args.side)
+
+        raw = await db.products.find({}, {"_id": 0}).to_list(args.products)
+        before = len(json.dumps(server.jsonable_encoder([server.Product(**p) for p in raw])).encode())
+
+        with Timer() as migration:
+            result = await server.migrate_product_images()
+            while server._background_tasks:
+                await asyncio.gather(*list(server._background_tasks))
+
+        async with api_client() as client:
+            page = await client.get("/api/catalog/products", params={"limit": args.products, "variant": args.variant})
+            page.raise_for_status()
+            image_bytes = 0
+            for product in page.json():
+                if product.get("image"):
+                    r = await client.get(urlparse(product["image"]).path)
+                    r.raise_for_status()
+                    image_bytes += len(r.content)
+
+        after = len(page.content) + image_bytes
+        print(json.dumps({
+            "products": args.products,
+            "source_side_px": args.side,
+            "variant": args.variant,
+            "migration": {**result, "seconds": round(migration.seconds, 2)},
+            "before_page_bytes": before,
+            "after_page_json_bytes": len(page.content),
+            "after_image_bytes": image_bytes,
+            "after_total_bytes": after,
+            "reduction": f"{before / max(after, 1):.1f}x",
+        }, indent=2))
+    finally:
+        await finish(args)
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    p = parser("Bytes per catalog page before and after image variants")
+    p.add_argument("--products", type=int, default=50)
+    p.add_argument("--side", type=int, default=1200, help="uploaded image size in px")
+    p.add_argument("--variant", default="card", choices=sorted(server.IMAGE_VARIANTS))
+    asyncio.run(main(p.parse_args()))
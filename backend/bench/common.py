@@ -0,0 +1,103 @@
+"""Shared setup for the benchmark scripts.
+
+Benchmarks run against the MongoDB in backend/.env (a throwaway database, dropped afterwards)
+or, with --mock, against an in-memory mongomock database for a quick smoke run.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+
+
+def parser(description: str) -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument("--mock", action="store_true", help="use in-memory mongomock instead of MONGO_URL")
+    p.add_argument("--db", default="milk_delivery_bench", help="database to create and drop")
+    p.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    return p
+
+
+class MemoryBucket:
+    """Enough of AsyncIOMotorGridFSBucket for --mock runs (mongomock has no GridFS)."""
+
+    class _Out:
+        def __init__(self, data: bytes, metadata: dict):
+            self.data, self.metadata, self.length, self.pos = data, metadata, len(data), 0
+
+        def seek(self, pos: int):
+            self.pos = pos
+
+        async def read(self, size: int = -1) -> bytes:
+            end = self.length if size is None or size < 0 else self.pos + size
+            chunk, self.pos = self.data[self.pos:end], min(end, self.length)
+            return chunk
+
+    def __init__(self, db):
+        self.db, self.blobs = db, {}
+
+    async def upload_from_stream_with_id(self, file_id, filename, data, metadata=None):
+        try:
+            await self.db["images.files"].insert_one(
+                {"_id": file_id, "filename": filename, "length": len(data), "metadata": metadata}
+            )
+        except server.DuplicateKeyError:
+            raise server.FileExists(filename)
+        self.blobs[filename] = (data, metadata)
+
+    async def open_download_stream_by_name(self, filename):
+        if filename not in self.blobs:
+            raise server.NoFile(filename)
+        return self._Out(*self.blobs[filename])
+
+
+def connect(args):
+    """Point server.db at the benchmark database and return it."""
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[args.db]
+        server.image_bucket = MemoryBucket(server.db)
+    else:
+        server.client = server.AsyncIOMotorClient(server.mongo_url)
+        server.db = server.client[args.db]
+        server.image_bucket = server.AsyncIOMotorGridFSBucket(server.db, bucket_name="images")
+    server.transactions_supported = not args.mock
+    return server.db
+
+
+async def finish(args):
+    if not args.keep:
+        await server.client.drop_database(args.db)
+
+
+def api_client() -> httpx.AsyncClient:
+    """In-process client; startup hooks (schedulers, migrations) are deliberately not run."""
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench")
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "n": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
@@ -0,0 +1,94 @@
+"""Finance/revenue report: the Mongo $match/$facet pipeline against loading orders into Python.
+
+    python backend/bench/finance.py --orders 1000000      # needs a real mongod (MONGO_URL)
+    python backend/bench/finance.py --mock --orders 20000
+
+Seeds orders across --admins dairies and --days delivery dates, builds the INDEXES, then times
+finance_report for one admin over 30 days and for every admin over the whole range, next to
+the old approach (find the delivered orders, group them in a Python loop) with its cap removed.
+Only real-mongod timings mean anything: mongomock evaluates aggregation pipelines in Python.
+"""
+import asyncio
+import json
+import random
+import uuid
+from datetime import date, timedelta
+
+from common import Timer, connect, finish, parser, server
+
+PRODUCTS = [(f"p{i}", f"Product {i}", 20.0 + 5 * i) for i in range(20)]
+STATUSES = ["delivered"] * 8 + ["assigned", "cancelled"]
+
+
+async def seed(db, orders: int, admins: int, days: int, chunk: int = 10_000):
+    rng = random.Random(1)
+    admin_ids = [str(uuid.uuid4()) for _ in range(admins)]
+    first = date(2025, 1, 1)
+    dates = [(first + timedelta(days=i)).isoformat() for i in range(days)]
+    with Timer() as t:
+        for start in range(0, orders, chunk):
+            batch = []
+            for _ in range(min(chunk, orders - start)):
+                product_id, name, price = rng.choice(PRODUCTS)
+                quantity = rng.randint(1, 3)
+                batch.append({
+                    "id": str(uuid.uuid4()), "subscription_id": str(uuid.uuid4()),
+                    "admin_id": rng.choice(admin_ids), "user_id": str(uuid.uuid4()),
+                    "status": rng.choice(STATUSES), "delivery_date": rng.choice(dates),
+                    "total_amount": price * quantity,
+                    "items": [{"product_id": product_id, "product_name": name, "quantity": quantity, "price": price}],
+                })
+            await db.orders.insert_many(batch, ordered=False)
+    return admin_ids, dates, t.seconds
+
+
+async def python_report(db, query: dict) -> dict:
+    """What get_finance_report used to do, minus the silent to_list(10000) cap."""
+    orders = await db.orders.find(query).to_list(None)
+    by_date = {}
+    for o in orders:
+        day = by_date.setdefault(o.get("delivery_date", "unknown"), {"revenue": 0, "orders": 0})
+        day["revenue"] += o.get("total_amount", 0)
+        day["orders"] += 1
+    return {"total_revenue": sum(o.get("total_amount", 0) for o in orders), "total_orders": len(orders), "by_date": by_date}
+
+
+async def timed(label: str, make, repeat: int) -> dict:
+    timings, result = [], None
+    for _ in range(repeat):
+        with Timer() as t:
+            result = await make()
+        timings.append(t.seconds)
+    return {"case": label, "best_seconds": round(min(timings), 3), "orders": result["total_orders"]}
+
+
+async def main(args):
+    db = connect(args)
+    try:
+        admin_ids, dates, seed_seconds = await seed(db, args.orders, args.admins, args.days)
+        await server.ensure_indexes()
+
+        delivered = server.OrderStatus.DELIVERED.value
+        one_admin = server.export_query(admin_ids[0], delivered, dates[-30], dates[-1])
+        everyone = server.export_query(None, delivered, dates[0], dates[-1])
+        results = [
+            await timed("admin 30 days, pipeline", lambda: server.finance_report(one_admin), args.repeat),
+            await timed("admin 30 days, python", lambda: python_report(db, one_admin), args.repeat),
+            await timed("all admins, all days, pipeline", lambda: server.finance_report(everyone), args.repeat),
+            await timed("all admins, all days, python", lambda: python_report(db, everyone), args.repeat),
+        ]
+        print(json.dumps({
+            "orders": args.orders, "admins": args.admins, "days": args.days,
+            "seed_seconds": round(seed_seconds, 1), "results": results,
+        }, indent=2))
+    finally:
+        await finish(args)
+
+
+if __name__ == "__main__":
+    p = parser("Finance report pipeline benchmark")
+    p.add_argument("--orders", type=int, default=1_000_000)
+    p.add_argument("--admins", type=int, default=50)
+    p.add_argument("--days", type=int, default=365)
+    p.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(p.parse_args()))
@@ -0,0 +1,112 @@
+"""Latency of an unrelated endpoint (GET /api/auth/me) while a burst of logins is running.
+
+    python backend/bench/login.py --logins 200 --concurrency 20
+    python backend/bench/login.py --inline      # bcrypt on the event loop, as before the pool
+
+Reports p50/p99 for /auth/me alone, for /auth/me during the login burst, and for the logins
+themselves (plus how many were shed with 503 once PASSWORD_HASH_MAX_PENDING was reached).
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from common import api_client, connect, finish, parser, percentiles, server
+
+PASSWORD = "bench-password"
+
+
+async def seed(db, users: int):
+    hashed = server.get_password_hash(PASSWORD)
+    docs = [{
+        "id": str(uuid.uuid4()), "email": f"rider{i}@bench.example.com", "name": f"Rider {i}",
+        "role": "delivery_partner", "password": hashed, "is_active": True
+    } for i in range(users)]
+    await db.users.insert_many(docs)
+    return docs
+
+
+async def probe(client, headers, stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = await client.get("/api/auth/me", headers=headers)
+        r.raise_for_status()
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0.005)
+
+
+async def loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    """How late a 10 ms timer fires: a direct measure of event-loop blocking."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def login_burst(client, emails, concurrency: int):
+    latencies, statuses = [], {}
+    queue = list(emails)
+
+    async def worker():
+        while queue:
+            email = queue.pop()
+            start = time.perf_counter()
+            r = await client.post("/api/auth/login", json={"email": email, "password": PASSWORD})
+            latencies.append(time.perf_counter() - start)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses
+
+
+async def main(args):
+    db = connect(args)
+    if args.inline:
+        async def inline(func, *a):
+            return func(*a)
+        server.run_password_job = inline
+    try:
+        users = await seed(db, max(args.users, 1))
+        headers = {"Authorization": "Bearer " + server.create_access_token({"sub": users[0]["id"]})}
+        emails = [users[i % len(users)]["email"] for i in range(args.logins)]
+        async with api_client() as client:
+            idle, stop = [], asyncio.Event()
+            task = asyncio.create_task(probe(client, headers, stop, idle))
+            await asyncio.sleep(args.idle_seconds)
+            stop.set()
+            await task
+
+            busy, lag, stop = [], [], asyncio.Event()
+            tasks = [
+                asyncio.create_task(probe(client, headers, stop, busy)),
+                asyncio.create_task(loop_lag(stop, lag)),
+            ]
+            started = time.perf_counter()
+            logins, statuses = await login_burst(client, emails, args.concurrency)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await asyncio.gather(*tasks)
+        print(json.dumps({
+            "mode": "inline" if args.inline else f"pool({server.PASSWORD_HASH_WORKERS} workers)",
+            "me_idle": percentiles(idle),
+            "me_during_logins": percentiles(busy),
+            "me_per_second_during_logins": round(len(busy) / elapsed, 1),
+            "event_loop_lag": percentiles(lag),
+            "logins": percentiles(logins),
+            "login_status_counts": statuses,
+            "logins_per_second": round(len(logins) / elapsed, 1),
+        }, indent=2))
+    finally:
+        await finish(args)
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    p = parser("Unrelated-endpoint latency during a login burst")
+    p.add_argument("--users", type=int, default=50)
+    p.add_argument("--logins", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--idle-seconds", type=float, default=2.0)
+    p.add_argument("--inline", action="store_true", help="verify bcrypt on the event loop (pre-pool behaviour)")
+    asyncio.run(main(p.parse_args()))
@@ -0,0 +1,97 @@
+"""The midnight run: generate_orders_for_date over a large subscription base.
+
+    python backend/bench/order_generation.py --subscriptions 500000       # needs a real mongod
+    python backend/bench/order_generation.py --subscriptions 500000 --workers 4
+    python backend/bench/order_generation.py --mock --subscriptions 5000  # quick smoke run
+
+Seeds daily subscriptions (one per customer) across --admins dairies, builds the INDEXES, then
+times a first run that creates every order and a second run that finds them all existing.
+The target is 500k orders in under 5 minutes (300 s) on a single mongod. --workers uses
+run_order_generation, which spawns processes with their own clients, so it needs a real mongod.
+Only real-mongod timings mean anything: mongomock applies bulk upserts one by one in Python.
+"""
+import asyncio
+import json
+import os
+import random
+import uuid
+
+from common import Timer, connect, finish, parser, server
+
+DAY = "2025-03-01"
+TARGET_SECONDS = 300
+
+
+async def seed(db, subscriptions: int, admins: int, chunk: int = 10_000):
+    rng = random.Random(11)
+    admin_docs = [{
+        "id": str(uuid.uuid4()), "email": f"admin{i}@bench.example.com", "name": f"Dairy {i}",
+        "role": "admin", "is_active": True
+    } for i in range(admins)]
+    await db.users.insert_many(admin_docs)
+    products = [{
+        "id": str(uuid.uuid4()), "name": f"Milk {i}", "price": 25.0 + i, "unit": "500ml",
+        "admin_id": admin_docs[i % admins]["id"], "is_available": True
+    } for i in range(admins * 5)]
+    await db.products.insert_many(products)
+
+    with Timer() as t:
+        for start in range(0, subscriptions, chunk):
+            users, subs = [], []
+            for i in range(start, min(start + chunk, subscriptions)):
+                user_id = str(uuid.uuid4())
+                product = rng.choice(products)
+                users.append({
+                    "id": user_id, "email": f"customer{i}@bench.example.com", "name": f"Customer {i}",
+                    "role": "customer", "is_active": True, "phone": f"9{i:09d}", "address": "Bench Street"
+                })
+                subs.append({
+                    "id": str(uuid.uuid4()), "user_id": user_id, "product_id": product["id"],
+                    "admin_id": product["admin_id"], "quantity": rng.randint(1, 3), "pattern": "daily",
+                    "start_date": "2025-01-01", "end_date": None, "is_active": True
+                })
+            await db.users.insert_many(users, ordered=False)
+            await db.subscriptions.insert_many(subs, ordered=False)
+    return t.seconds
+
+
+async def generate(args, db):
+    if args.workers > 1:
+        os.environ["DB_NAME"] = args.db
+        return await asyncio.to_thread(server.run_order_generation, DAY, args.workers)
+    return await server.generate_orders_for_date(db, DAY)
+
+
+async def main(args):
+    if args.workers > 1 and args.mock:
+        raise SystemExit("--workers needs a real mongod")
+    db = connect(args)
+    try:
+        await server.ensure_indexes()
+        seed_seconds = await seed(db, args.subscriptions, args.admins)
+
+        with Timer() as first:
+            created = await generate(args, db)
+        with Timer() as again:
+            rerun = await generate(args, db)
+
+        print(json.dumps({
+            "subscriptions": args.subscriptions, "admins": args.admins, "workers": args.workers,
+            "seed_seconds": round(seed_seconds, 1),
+            "first_run": {k: created[k] for k in ("created", "existing", "failed")},
+            "first_run_seconds": round(first.seconds, 2),
+            "orders_per_second": round(created["created"] / first.seconds) if first.seconds else None,
+            "rerun": {k: rerun[k] for k in ("created", "existing", "failed")},
+            "rerun_seconds": round(again.seconds, 2),
+            "target_seconds": TARGET_SECONDS,
+        }, indent=2))
+    finally:
+        await finish(args)
+
+
+if __name__ == "__main__":
+    p = parser("Midnight order generation benchmark")
+    p.add_argument("--subscriptions", type=int, default=500_000)
+    p.add_argument("--admins", type=int, default=50)
+    p.add_argument("--workers", type=int, default=1)
+    asyncio.run(main(p.parse_args()))
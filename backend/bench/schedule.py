@@ -0,0 +1,111 @@
+"""build_delivery_schedule at scale, against a per-subscription, per-day Python loop.
+
+    python backend/bench/schedule.py --subscriptions 100000 --days 30
+
+Pure CPU: no database is involved. The scalar reference is what preview_tomorrow_order
+used to do for a single day, run for every day; it is timed on a sample and extrapolated.
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from common import Timer, server
+
+PATTERNS = ["daily"] * 6 + ["alternate"] * 2 + ["custom", "buy_once"]
+
+
+def make_subscriptions(n: int, start: datetime, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    subs = []
+    for i in range(n):
+        pattern = rng.choice(PATTERNS)
+        first = start + timedelta(days=rng.randint(-60, 20))
+        sub = {
+            "id": f"s{i}", "user_id": f"u{i // 2}", "product_id": f"p{i % 50}",
+            "quantity": rng.randint(1, 3), "pattern": pattern,
+            "start_date": first.strftime("%Y-%m-%d"),
+            "end_date": (first + timedelta(days=90)).strftime("%Y-%m-%d") if rng.random() < 0.2 else None,
+        }
+        if pattern == "custom":
+            sub["custom_days"] = sorted(rng.sample(range(7), rng.randint(1, 5)))
+        if rng.random() < 0.1:
+            sub["modifications"] = {
+                (start + timedelta(days=rng.randint(0, 29))).strftime("%Y-%m-%d"): rng.randint(0, 4)
+                for _ in range(rng.randint(1, 3))
+            }
+        subs.append(sub)
+    return subs
+
+
+def make_vacations(subs: list, start: datetime, share: float = 0.05, seed: int = 11) -> dict:
+    rng = random.Random(seed)
+    users = sorted({s["user_id"] for s in subs})
+    vacations = {}
+    for user_id in rng.sample(users, int(len(users) * share)):
+        first = start + timedelta(days=rng.randint(0, 25))
+        vacations[user_id] = [(first.strftime("%Y-%m-%d"), (first + timedelta(days=rng.randint(1, 7))).strftime("%Y-%m-%d"))]
+    return vacations
+
+
+def scalar_quantity(sub: dict, day: datetime, vacations: dict) -> int:
+    start = datetime.strptime(sub["start_date"], "%Y-%m-%d")
+    if day < start or (sub.get("end_date") and day > datetime.strptime(sub["end_date"], "%Y-%m-%d")):
+        return 0
+    key = day.strftime("%Y-%m-%d")
+    for vac_start, vac_end in vacations.get(sub["user_id"], []):
+        if vac_start <= key <= vac_end:
+            return 0
+    offset = (day - start).days
+    pattern = sub["pattern"]
+    if pattern == "alternate" and offset % 2:
+        return 0
+    if pattern == "custom" and day.weekday() not in (sub.get("custom_days") or []):
+        return 0
+    if pattern == "buy_once" and offset:
+        return 0
+    return (sub.get("modifications") or {}).get(key, sub["quantity"])
+
+
+def main(args):
+    start = datetime(2025, 3, 1)
+    end = start + timedelta(days=args.days - 1)
+    subs = make_subscriptions(args.subscriptions, start)
+    vacations = make_vacations(subs, start)
+
+    timings = []
+    for _ in range(args.repeat):
+        with Timer() as t:
+            days, quantities = server.build_delivery_schedule(
+                subs, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), vacations
+            )
+        timings.append(t.seconds)
+
+    sample = subs[:args.sample]
+    dates = [start + timedelta(days=i) for i in range(args.days)]
+    with Timer() as scalar:
+        reference = np.array([[scalar_quantity(s, d, vacations) for d in dates] for s in sample], dtype=np.int32)
+
+    per_sub = scalar.seconds / max(len(sample), 1)
+    print(json.dumps({
+        "subscriptions": len(subs),
+        "days": len(days),
+        "deliveries": int(np.count_nonzero(quantities)),
+        "vectorized_seconds_best": round(min(timings), 3),
+        "vectorized_seconds_all": [round(t, 3) for t in timings],
+        "scalar_sample": len(sample),
+        "scalar_seconds_extrapolated": round(per_sub * len(subs), 2),
+        "speedup": f"{per_sub * len(subs) / min(timings):.1f}x",
+        "sample_matches_scalar": bool((quantities[:len(sample)] == reference).all()),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Delivery schedule engine benchmark")
+    p.add_argument("--subscriptions", type=int, default=100_000)
+    p.add_argument("--days", type=int, default=30)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--sample", type=int, default=5_000, help="subscriptions timed with the scalar loop")
+    main(p.parse_args())
@@ -0,0 +1,126 @@
+"""GET /api/search latency over a large index (the target is p99 under 20 ms at 100k customers).
+
+    python backend/bench/search.py --customers 100000 --queries 500
+    python backend/bench/search.py --mock --customers 5000     # quick smoke run
+
+Seeds customers, products and orders, builds the index with rebuild_search_index, then times
+prefix searches as an admin (scoped to their own customers) and as the superadmin (all scopes).
+Only real-mongod timings mean anything: mongomock matches the tokens array in Python.
+"""
+import asyncio
+import json
+import logging
+import random
+import uuid
+
+from common import Timer, api_client, connect, finish, parser, percentiles, server
+
+FIRST = ["ramesh", "suresh", "anita", "priya", "vikram", "meena", "arjun", "kavita", "rahul", "sunita"]
+LAST = ["kumar", "sharma", "patel", "singh", "reddy", "iyer", "gupta", "nair", "das", "joshi"]
+
+
+async def seed(db, customers: int, admins: int, orders: int, seed: int = 3):
+    rng = random.Random(seed)
+    admin_docs = [{
+        "id": str(uuid.uuid4()), "email": f"admin{i}@bench.example.com", "name": f"Dairy {i}",
+        "role": "admin", "is_active": True
+    } for i in range(admins)]
+    await db.users.insert_many(admin_docs)
+    admin_ids = [a["id"] for a in admin_docs]
+
+    users, subs = [], []
+    for i in range(customers):
+        user_id = str(uuid.uuid4())
+        users.append({
+            "id": user_id, "email": f"customer{i}@bench.example.com", "role": "customer", "is_active": True,
+            "name": f"{rng.choice(FIRST)} {rng.choice(LAST)}", "phone": f"9{rng.randint(0, 999999999):09d}",
+        })
+        subs.append({"id": str(uuid.uuid4()), "user_id": user_id, "admin_id": rng.choice(admin_ids)})
+        if len(users) >= 10000:
+            await db.users.insert_many(users)
+            await db.subscriptions.insert_many(subs)
+            users, subs = [], []
+    if users:
+        await db.users.insert_many(users)
+        await db.subscriptions.insert_many(subs)
+
+    await db.products.insert_many([{
+        "id": str(uuid.uuid4()), "name": f"{name} {i}", "category": "milk", "admin_id": rng.choice(admin_ids)
+    } for i, name in enumerate(["Cow Milk", "Buffalo Milk", "Paneer", "Curd", "Ghee"] * 20)])
+
+    batch = []
+    for i in range(orders):
+        batch.append({
+            "id": str(uuid.uuid4()), "subscription_id": str(uuid.uuid4()), "admin_id": rng.choice(admin_ids),
+            "delivery_otp": f"{rng.randint(1000, 9999)}", "delivery_date": "2025-03-01",
+            "customer_name": f"{rng.choice(FIRST)} {rng.choice(LAST)}",
+        })
+        if len(batch) >= 10000:
+            await db.orders.insert_many(batch)
+            batch = []
+    if batch:
+        await db.orders.insert_many(batch)
+    return admin_docs
+
+
+def random_query(rng: random.Random) -> str:
+    word = rng.choice(FIRST + LAST)
+    q = word[:rng.randint(2, len(word))]
+    if rng.random() < 0.3:
+        other = rng.choice(LAST)
+        q += " " + other[:rng.randint(2, len(other))]
+    return q
+
+
+async def time_queries(client, headers: dict, queries: list) -> list:
+    samples = []
+    for q in queries:
+        with Timer() as t:
+            r = await client.get("/api/search", params={"q": q}, headers=headers)
+        r.raise_for_status()
+        samples.append(t.seconds)
+    return samples
+
+
+async def main(args):
+    db = connect(args)
+    try:
+        await server.ensure_indexes()
+        admins = await seed(db, args.customers, args.admins, args.orders)
+        superadmin = {
+            "id": str(uuid.uuid4()), "email": "root@bench.example.com", "name": "Root",
+            "role": "superadmin", "is_active": True
+        }
+        await db.users.insert_one(dict(superadmin))
+
+        with Timer() as build:
+            counts = await server.rebuild_search_index()
+
+        rng = random.Random(5)
+        queries = [random_query(rng) for _ in range(args.queries)]
+        token = lambda user: {"Authorization": "Bearer " + server.create_access_token({"sub": user["id"]})}
+        async with api_client() as client:
+            await time_queries(client, token(admins[0]), queries[:20])  # warm caches and the index
+            as_admin = await time_queries(client, token(admins[0]), queries)
+            as_superadmin = await time_queries(client, token(superadmin), queries)
+
+        print(json.dumps({
+            "indexed": counts,
+            "index_documents": await db.search_index.estimated_document_count(),
+            "build_seconds": round(build.seconds, 2),
+            "search_as_admin": percentiles(as_admin),
+            "search_as_superadmin": percentiles(as_superadmin),
+            "target_p99_ms": 20,
+        }, indent=2))
+    finally:
+        await finish(args)
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    p = parser("Search latency over a large product/customer/order index")
+    p.add_argument("--customers", type=int, default=100000)
+    p.add_argument("--admins", type=int, default=20)
+    p.add_argument("--orders", type=int, default=100000)
+    p.add_argument("--queries", type=int, default=500)
+    asyncio.run(main(p.parse_args()))
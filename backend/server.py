@@ -1,13 +1,18 @@
 from itertools import product
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import FileExists, NoFile
+from pymongo import IndexModel, ASCENDING, DESCENDING, UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, model_validator, field_validator
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timedelta ,date
@@ -19,8 +24,24 @@ from fastapi import APIRouter, Depends
 from bson import ObjectId
 import pytz
 import random
+import numpy as np
 from pydantic import BaseModel
 import base64
+import io
+import csv
+import zlib
+from PIL import Image
+import json
+import hashlib
+import re
+import time
+import asyncio
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from functools import lru_cache
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 #30-jan- status all finen after updates at 318-324(add new dependency)
 
@@ -32,6 +53,22 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME', 'milk_delivery_db')]
 
+# Content-addressed image blobs (filename = sha256 of the bytes)
+image_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="images")
+# Origin used in image URLs (e.g. https://api.example.com); unset = the origin of each request
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")
+request_base_url: ContextVar[str] = ContextVar("request_base_url", default="")
+
+# Resized copies generated in the background for every uploaded image: name -> (max side px, format)
+IMAGE_VARIANTS = {
+    "thumb": (160, "WEBP"),
+    "card": (480, "WEBP"),
+}
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+# Created on startup rather than at import, with spawn workers like order generation uses: forked
+# children would inherit the event loop and Mongo client of the uvicorn worker
+image_executor: Optional[ProcessPoolExecutor] = None
+
 # Create the main app
 app = FastAPI(title="Milk Delivery App API")
 
@@ -46,11 +83,28 @@ ACCESS_TOKEN_EXPIRE_DAYS = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# bcrypt runs in its own pool so logins never block the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "64"))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 IST = pytz.timezone("Asia/Kolkata")
+
+# Cache tuning
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "30"))
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", "1000"))
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get("CATALOG_CACHE_TTL_SECONDS", "300"))
+CALENDAR_CACHE_SIZE = int(os.environ.get("CALENDAR_CACHE_SIZE", "5000"))
+CALENDAR_CACHE_TTL_SECONDS = float(os.environ.get("CALENDAR_CACHE_TTL_SECONDS", "300"))
+DASHBOARD_CACHE_SIZE = int(os.environ.get("DASHBOARD_CACHE_SIZE", "1000"))
+DASHBOARD_CACHE_TTL_SECONDS = float(os.environ.get("DASHBOARD_CACHE_TTL_SECONDS", "5"))
+DASHBOARD_TREND_DAYS = int(os.environ.get("DASHBOARD_TREND_DAYS", "30"))
+
 # ===================== ENUMS =====================
 class UserRole(str, Enum):
     CUSTOMER = "customer"
@@ -68,6 +122,7 @@ class OrderStatus(str, Enum):
     PENDING = "pending"
     ASSIGNED = "assigned"
     UNASSIGNED = "unassigned" ##
+    PICKED_UP = "picked_up"
     OUT_FOR_DELIVERY = "out_for_delivery"
     DELIVERED = "delivered"
     SKIPPED = "skipped"
@@ -137,7 +192,7 @@ class ProductBase(BaseModel):
     price: float
     unit: str
     image: Optional[str] = None  # base64 OR URL
-    image_type: Optional[str] = "base64"  # "base64" | "url"
+    image_type: Optional[str] = "base64"  # "base64" | "url" | "blob"
     nutritional_info: Optional[Dict[str, Any]] = None
     stock: int = 100
     is_available: bool = True
@@ -145,12 +200,35 @@ class ProductBase(BaseModel):
 class ProductCreate(ProductBase):
     pass
 
-class Product(ProductBase):
+class BlobImageRef(BaseModel):
+    image_id: Optional[str] = None  # sha256 of the stored blob when image_type == "blob"
+    image_variants: Optional[Dict[str, str]] = None  # variant name -> image_id
+
+    @model_validator(mode="after")
+    def resolve_image_url(self):
+        if self.image_type == "blob" and self.image_id:
+            self.image = image_url(self.image_id)
+        return self
+
+class Product(ProductBase, BlobImageRef):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     admin_id: str 
     admin_name: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Lightweight product for catalog grids (fields=card)
+class ProductCard(BlobImageRef):
+    id: str
+    name: str
+    category: ProductCategory
+    price: float
+    unit: str
+    image: Optional[str] = None
+    image_type: Optional[str] = None
+    stock: int = 100
+    is_available: bool = True
+    admin_id: str
+
 # Subscription Models
 class SubscriptionBase(BaseModel):
     product_id: str
@@ -168,15 +246,33 @@ class SubscriptionModification(BaseModel):
     date: str  # YYYY-MM-DD
     quantity: int
 
+class SubscriptionUpdate(BaseModel):
+    quantity: Optional[int] = Field(None, ge=1)
+    pattern: Optional[SubscriptionPattern] = None
+    custom_days: Optional[List[int]] = None  # 0=Mon, 6=Sun
+    is_active: Optional[bool] = None
+
+    @field_validator("custom_days")
+    @classmethod
+    def weekdays_only(cls, value):
+        if value is not None and any(d < 0 or d > 6 for d in value):
+            raise ValueError("custom_days must be weekdays 0 (Mon) to 6 (Sun)")
+        return sorted(set(value)) if value is not None else None
+
 class Subscription(SubscriptionBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
     is_active: bool = True
     admin_id: Optional[str] = None
     admin_name: Optional[str] = None
-    modifications: List[Dict[str, Any]] = Field(default_factory=list)  # Date-specific quantity changes
+    modifications: Dict[str, int] = Field(default_factory=dict)  # YYYY-MM-DD -> quantity for that date
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+    @field_validator("modifications", mode="before")
+    @classmethod
+    def modifications_by_date(cls, value):
+        return subscription_modifications({"modifications": value})
+
 class SubscriptionResponse(Subscription):
     product: Optional[Product] = None
 
@@ -206,7 +302,6 @@ class WalletRecharge(BaseModel):
 class Wallet(BaseModel):
     user_id: str
     balance: float = 0.0
-    transactions: List[WalletTransaction] = Field(default_factory=list)
 
 # Order Models
 class OrderItem(BaseModel):
@@ -239,6 +334,19 @@ class Order(BaseModel):
     delivered_at: Optional[datetime] = None
     created_at: datetime
 
+# Lightweight order for list screens (fields=card)
+class OrderCard(BaseModel):
+    id: str
+    status: str
+    delivery_date: str
+    delivery_slot: Optional[str] = None
+    items: List[OrderItem]
+    total_amount: float
+    customer_name: Optional[str] = None
+    admin_name: Optional[str] = None
+    delivery_partner_name: Optional[str] = None
+    created_at: datetime
+
 
 # Delivery Partner Models
 class DeliveryCheckin(BaseModel):
@@ -250,7 +358,7 @@ class DeliveryCheckin(BaseModel):
 
 class DeliveryComplete(BaseModel):
     order_id: str
-    proof_image: Optional[str] = None  # base64
+    proof_image: Optional[str] = None  # base64, stored as proof_image_id on the order
 
 # Admin Models
 class ZoneAssignment(BaseModel):
@@ -292,7 +400,307 @@ class CreateRiderRequest(BaseModel):
 
 class StatusUpdateRequest(BaseModel):
     order_id: str
-    status: str
+    status: OrderStatus
+
+# ===================== CACHES =====================
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def discard_where(self, predicate):
+        for key in [k for k in self._data if predicate(k)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+# User documents (without password) keyed by user id, read by get_current_user. Per process, but
+# invalidate_user is published to every worker (see CACHE SYNC below), so a block or delete is
+# enforced everywhere within CACHE_SYNC_INTERVAL_SECONDS without a query per request.
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+# Serialized public catalog responses: ("products", admin_id, category) and ("admins",).
+# Per process; invalidate_catalog is published to every worker (see CACHE SYNC below).
+catalog_cache = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL_SECONDS)
+
+async def invalidate_user(user_id: str):
+    """Drop cached state for a user in every worker; call after every write to db.users."""
+    await publish_invalidation("user", user_id)
+
+# Projected delivery calendars keyed by (user_id, from, to); wallet figures are added per request.
+# Per process like catalog_cache, with invalidations published to every worker.
+calendar_cache = TTLCache(maxsize=CALENDAR_CACHE_SIZE, ttl=CALENDAR_CACHE_TTL_SECONDS)
+
+# Admin dashboard stats keyed by admin id; short-lived so auto-refresh reads memory, not Mongo
+dashboard_cache = TTLCache(maxsize=DASHBOARD_CACHE_SIZE, ttl=DASHBOARD_CACHE_TTL_SECONDS)
+
+async def invalidate_calendar(user_id: str):
+    """Drop a customer's cached calendars in every worker; call after subscription or vacation writes."""
+    await publish_invalidation("calendar", user_id)
+
+# Product fields copied into calendar items
+CALENDAR_PRODUCT_FIELDS = {"name", "price", "unit"}
+
+async def invalidate_product_calendars():
+    """Drop every cached calendar in every worker; call after a product's name, price or unit
+    changes or it is deleted.
+
+    Cheaper than looking up the product's subscribers, and product edits are rare.
+    """
+    await publish_invalidation("calendar_all")
+
+async def invalidate_catalog(admin_id: Optional[str]):
+    """Drop cached catalog pages for an admin and the all-admins listing in every worker."""
+    await publish_invalidation("catalog", admin_id)
+
+async def invalidate_all_catalogs():
+    """Drop every cached catalog response in every worker; for bulk product rewrites."""
+    await publish_invalidation("catalog_all")
+
+# ===================== CACHE SYNC =====================
+# The caches above live in each worker. An invalidation is applied to the local caches at once and
+# recorded in db.cache_invalidations; every worker polls that collection and applies what the
+# others recorded, so cross-worker staleness is bounded by the poll interval, not the cache TTLs.
+CACHE_SYNC_INTERVAL_SECONDS = float(os.environ.get("CACHE_SYNC_INTERVAL_SECONDS", "1"))
+# Each poll re-reads this much history before the previous one, which absorbs clock skew between
+# workers and events whose insert lands after a poll has started
+CACHE_SYNC_OVERLAP_SECONDS = 10
+CACHE_INVALIDATION_RETENTION_SECONDS = 3600
+
+_cache_sync_since: Optional[datetime] = None
+_applied_invalidations: Dict[Any, datetime] = {}  # event _id -> at, pruned as the window moves
+
+def apply_invalidation(kind: str, key=None):
+    """Apply one invalidation event to this worker's caches."""
+    if kind == "user":
+        user_cache.pop(key)
+        catalog_cache.pop(("admins",))
+    elif kind == "catalog":
+        catalog_cache.discard_where(lambda k: k[0] == "products" and k[1] in (key, None))
+    elif kind == "catalog_all":
+        catalog_cache.clear()
+    elif kind == "calendar":
+        calendar_cache.discard_where(lambda k: k[0] == key)
+    elif kind == "calendar_all":
+        calendar_cache.clear()
+    else:
+        logger.warning(f"⚠️ Unknown cache invalidation kind {kind!r}")
+
+async def publish_invalidation(kind: str, key=None):
+    """Apply an invalidation locally and record it for the other workers.
+
+    The caller's write has already succeeded, so a failed insert is logged rather than raised;
+    the other workers then fall back to the cache TTL.
+    """
+    apply_invalidation(kind, key)
+    at = datetime.utcnow()
+    try:
+        result = await db.cache_invalidations.insert_one({"kind": kind, "key": key, "at": at})
+        _applied_invalidations[result.inserted_id] = at
+    except Exception:
+        logger.exception(f"❌ Could not publish {kind} cache invalidation")
+
+async def sync_caches() -> int:
+    """Apply invalidations recorded by other workers since the last poll; returns how many."""
+    global _cache_sync_since
+    started = datetime.utcnow()
+    since = _cache_sync_since or started - timedelta(seconds=CACHE_SYNC_OVERLAP_SECONDS)
+    applied = 0
+    async for event in db.cache_invalidations.find({"at": {"$gte": since}}, {"kind": 1, "key": 1, "at": 1}):
+        if event["_id"] in _applied_invalidations:
+            continue
+        apply_invalidation(event["kind"], event.get("key"))
+        _applied_invalidations[event["_id"]] = event["at"]
+        applied += 1
+    _cache_sync_since = started - timedelta(seconds=CACHE_SYNC_OVERLAP_SECONDS)
+    for event_id in [i for i, at in _applied_invalidations.items() if at < _cache_sync_since]:
+        del _applied_invalidations[event_id]
+    return applied
+
+async def cache_sync_loop():
+    while True:
+        try:
+            await sync_caches()
+        except Exception:
+            logger.exception("❌ Cache sync failed")
+        await asyncio.sleep(CACHE_SYNC_INTERVAL_SECONDS)
+
+def json_body(payload) -> tuple:
+    """Serialize a payload once and return (body, strong ETag)."""
+    body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_response(request: Request, body: bytes, etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ===================== TRANSACTIONS =====================
+
+# Multi-document transactions need a replica set; a standalone mongod answers code 20
+transactions_supported = True
+
+async def run_in_transaction(callback):
+    """Run `await callback(session)` atomically, or with session=None where transactions are unavailable."""
+    global transactions_supported
+    if transactions_supported:
+        async with await client.start_session() as session:
+            try:
+                return await session.with_transaction(callback)
+            except OperationFailure as e:
+                if e.code != 20:
+                    raise
+                transactions_supported = False
+                logger.warning("⚠️ MongoDB transactions unavailable (standalone server); writing without them")
+    return await callback(None)
+
+# ===================== PAGINATION =====================
+
+# List endpoints page on (created_at desc, id desc); the next page's cursor is sent in X-Next-Cursor
+MAX_PAGE_SIZE = 1000
+PAGE_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+def encode_cursor(doc: dict) -> str:
+    created_at = doc.get("created_at")
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = json.dumps({"c": created_at, "i": doc.get("id")}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """Turn an opaque cursor back into the Mongo filter for the rows after it."""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        created_at = datetime.fromisoformat(raw["c"]) if raw["c"] else None
+        last_id = raw["i"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if created_at is None:
+        return {"created_at": None, "id": {"$lt": last_id}}
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": last_id}},
+        {"created_at": None},
+    ]}
+
+async def fetch_page(collection, query: dict, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None) -> tuple:
+    """Return (docs, next_cursor) for one keyset page of `query`."""
+    if cursor:
+        query = {"$and": [query, decode_cursor(cursor)]}
+    docs = await collection.find(query, projection).sort(PAGE_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+def page_response(items: list, next_cursor: Optional[str]) -> JSONResponse:
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(content=jsonable_encoder(items), headers=headers)
+
+def page_responses(*item_models, description: str = "One page of results, newest first") -> Dict[int, dict]:
+    """OpenAPI `responses=` for an endpoint returning page_response: an array plus X-Next-Cursor."""
+    return {200: {
+        "model": List[Union[item_models]] if len(item_models) > 1 else List[item_models[0]],
+        "description": description,
+        "headers": {"X-Next-Cursor": {
+            "description": "Pass as `cursor` to fetch the next page; absent on the last page",
+            "schema": {"type": "string"},
+        }},
+    }}
+
+# ===================== SPARSE FIELDSETS =====================
+
+# `fields=` on list endpoints: "full" (default), "card", or a comma separated list of field names
+def resolve_fields(fields: Optional[str], card_model, full_model) -> Optional[List[str]]:
+    """Return the requested field names, or None for the full document."""
+    if not fields or fields == "full":
+        return None
+    if fields == "card":
+        return list(card_model.model_fields)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in full_model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+def fields_projection(selected: Optional[List[str]], extra: tuple = ()) -> Optional[dict]:
+    if selected is None:
+        return None
+    projection = {f: 1 for f in selected}
+    # keyset cursors need the sort key, blob images need their reference
+    projection.update({f: 1 for f in ("id", "created_at", *extra)})
+    if "image" in selected:
+        projection.update({"image_type": 1, "image_id": 1, "image_variants": 1})
+    return projection
+
+def render_product(p: dict, fields: Optional[str], selected: Optional[List[str]], variant: Optional[str] = None):
+    if selected is None:
+        return use_image_variant(Product(**p), variant)
+    if fields == "card":
+        return use_image_variant(ProductCard(**p), variant)
+    out = {k: p.get(k) for k in selected}
+    if "image" in out:
+        image_id = (p.get("image_variants") or {}).get(variant)
+        if not image_id and p.get("image_type") == "blob":
+            image_id = p.get("image_id")
+        if image_id:
+            out["image"] = image_url(image_id)
+    return out
+
+def render_order(o: dict, fields: Optional[str], selected: Optional[List[str]], full=None):
+    if selected is None:
+        return full(o) if full else Order(**o)
+    if fields == "card":
+        return OrderCard(**o)
+    return {k: o.get(k) for k in selected}
+
+def use_image_variant(product, variant: Optional[str]):
+    """Point product.image at a resized variant when one has been generated."""
+    if variant and product.image_variants and variant in product.image_variants:
+        product.image = image_url(product.image_variants[variant])
+    return product
 
 # ===================== AUTH HELPERS =====================
 
@@ -358,6 +766,30 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+_password_jobs_pending = 0
+
+async def run_password_job(func, *args):
+    """Run a bcrypt call in password_executor, shedding load once the queue is full."""
+    global _password_jobs_pending
+    if _password_jobs_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"}
+        )
+    _password_jobs_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, func, *args)
+    finally:
+        _password_jobs_pending -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await run_password_job(get_password_hash, password)
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
@@ -372,9 +804,12 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user_data = await db.users.find_one({"id": user_id})
+        user_data = user_cache.get(user_id)
         if user_data is None:
-            raise HTTPException(status_code=401, detail="User not found")        
+            user_data = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+            if user_data is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user_id, user_data)
         # 🔥 THIS IS THE IMPORTANT FIX
         if not user_data.get("is_active", True):
             raise HTTPException(
@@ -408,7 +843,7 @@ async def create_superadmin():
             "id": str(uuid.uuid4()),
             "email": "superadmin@milkapp.com",
             "name": "Super Admin",
-            "password": get_password_hash("superadmin123"),
+            "password": await get_password_hash_async("superadmin123"),
             "role": UserRole.SUPERADMIN.value,  # ✅ FIXED
             "is_active": True,
             "created_at": datetime.utcnow()
@@ -416,6 +851,165 @@ async def create_superadmin():
         await db.users.insert_one(superadmin)
         logger.info("✅ Superadmin created")
 
+# ===================== INDEXES =====================
+
+# Every collection filter used by the endpoints below should be covered here
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("role", ASCENDING), ("is_active", ASCENDING)], name="role_is_active"),
+        IndexModel([("role", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="role_page"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="page"),
+        IndexModel([("role", ASCENDING), ("assigned_admin_ids", ASCENDING)], name="role_admins"),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("admin_id", ASCENDING), ("category", ASCENDING)], name="admin_category"),
+        IndexModel([("image_id", ASCENDING)], name="image", sparse=True),
+        IndexModel([("admin_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="admin_page"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="page"),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id"),
+        IndexModel([("admin_id", ASCENDING), ("status", ASCENDING), ("delivery_date", ASCENDING)], name="admin_status_date"),
+        IndexModel([("admin_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="admin_page"),
+        IndexModel([("admin_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="admin_status_page"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_page"),
+        IndexModel([("delivery_partner_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="partner_page"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="page"),
+        IndexModel([("subscription_id", ASCENDING), ("delivery_date", DESCENDING), ("created_at", DESCENDING)], name="subscription_latest"),
+        # one order per subscription per day; the nightly run relies on this for idempotency
+        IndexModel(
+            [("subscription_id", ASCENDING), ("delivery_date", ASCENDING)],
+            name="subscription_date_unique",
+            unique=True,
+            partialFilterExpression={"subscription_id": {"$type": "string"}}
+        ),
+        IndexModel([("delivery_partner_id", ASCENDING), ("delivery_date", ASCENDING)], name="partner_date"),
+        IndexModel([("status", ASCENDING), ("delivery_date", ASCENDING)], name="status_date"),
+        IndexModel([("admin_id", ASCENDING), ("delivery_date", ASCENDING), ("status", ASCENDING)], name="admin_date_status"),
+    ],
+    "subscriptions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("is_active", ASCENDING), ("created_at", DESCENDING)], name="user_active_created"),
+        IndexModel([("admin_id", ASCENDING), ("is_active", ASCENDING), ("start_date", ASCENDING)], name="admin_active_start"),
+    ],
+    "vacations": [
+        IndexModel([("user_id", ASCENDING), ("start_date", ASCENDING)], name="user_start"),
+    ],
+    "vacation_intervals": [
+        IndexModel([("user_id", ASCENDING)], name="user_unique", unique=True),
+        IndexModel([("intervals.start_date", ASCENDING), ("intervals.end_date", ASCENDING)], name="range"),
+    ],
+    "wallets": [
+        IndexModel([("user_id", ASCENDING)], name="user_unique", unique=True),
+    ],
+    "wallet_transactions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_page"),
+        IndexModel([("batch_id", ASCENDING)], name="settlement_batch", sparse=True),
+        IndexModel(
+            [("order_id", ASCENDING)], name="order_debit_unique", unique=True,
+            partialFilterExpression={"type": "debit", "order_id": {"$exists": True}}
+        ),
+    ],
+    "wallet_daily": [
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date_unique", unique=True),
+    ],
+    "settlement_batches": [
+        IndexModel([("batch_id", ASCENDING), ("admin_id", ASCENDING)], name="batch_admin_unique", unique=True),
+        IndexModel([("settled_at", ASCENDING)], name="settled_at"),
+    ],
+    "settlement_buffer": [
+        IndexModel([("order_id", ASCENDING)], name="order_unique", unique=True),
+        IndexModel([("batch_id", ASCENDING), ("admin_id", ASCENDING)], name="batch_admin"),
+        IndexModel([("admin_id", ASCENDING), ("settled_at", ASCENDING)], name="admin_pending"),
+    ],
+    "checkins": [
+        IndexModel([("partner_id", ASCENDING), ("date", ASCENDING), ("checkin_time", DESCENDING)], name="partner_date_checkin"),
+    ],
+    "rider_rejections": [
+        IndexModel([("delivery_partner_id", ASCENDING), ("admin_id", ASCENDING)], name="partner_admin_unique", unique=True),
+    ],
+    "image_variants": [
+        IndexModel([("image_id", ASCENDING)], name="image_unique", unique=True),
+    ],
+    "images.files": [
+        IndexModel([("filename", ASCENDING)], name="filename_unique", unique=True),
+    ],
+    "search_index": [
+        IndexModel([("tokens", ASCENDING), ("kind", ASCENDING)], name="tokens_kind"),
+    ],
+    "order_rollups": [
+        IndexModel([("admin_id", ASCENDING), ("date", ASCENDING)], name="admin_date_unique", unique=True),
+        IndexModel([("date", ASCENDING)], name="date"),
+    ],
+    "job_leases": [
+        IndexModel([("job", ASCENDING), ("date", ASCENDING)], name="job_date_unique", unique=True),
+    ],
+    "cache_invalidations": [
+        IndexModel([("at", ASCENDING)], name="at_ttl", expireAfterSeconds=int(CACHE_INVALIDATION_RETENTION_SECONDS)),
+    ],
+}
+
+# (name, collection, filter, sort) for the queries that run on every screen load
+HOT_QUERIES = [
+    ("current_user", "users", {"id": "x"}, None),
+    ("login", "users", {"email": "x"}, None),
+    ("catalog", "products", {"admin_id": "x", "category": "milk"}, None),
+    ("customer_orders", "orders", {"user_id": "x"}, [("created_at", -1)]),
+    ("admin_orders", "orders", {"admin_id": "x", "status": "delivered", "delivery_date": "2025-01-01"}, None),
+    ("admin_order_board", "orders", {"admin_id": "x"}, [("created_at", -1)]),
+    ("subscription_orders", "orders", {"subscription_id": "x"}, None),
+    ("rider_today", "orders", {"delivery_partner_id": "x", "delivery_date": "2025-01-01"}, None),
+    ("finance", "orders", {"admin_id": "x", "status": "delivered", "delivery_date": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, None),
+    ("revenue", "orders", {"status": "delivered", "delivery_date": {"$gte": "2025-01-01", "$lte": "2025-01-31"}}, None),
+    ("customer_subscriptions", "subscriptions", {"user_id": "x", "is_active": True}, [("created_at", -1)]),
+    ("wallet", "wallets", {"user_id": "x"}, None),
+    ("wallet_history", "wallet_transactions", {"user_id": "x"}, [("created_at", -1), ("id", -1)]),
+    ("vacations", "vacations", {"user_id": "x"}, None),
+    ("away_on", "vacation_intervals", {"intervals": {"$elemMatch": {"start_date": {"$lte": "2025-01-01"}, "end_date": {"$gte": "2025-01-01"}}}}, None),
+    ("rider_checkin", "checkins", {"partner_id": "x", "date": "2025-01-01"}, [("checkin_time", -1)]),
+    ("rider_rejections", "rider_rejections", {"delivery_partner_id": "x", "admin_id": "x"}, None),
+]
+
+@app.on_event("startup")
+async def ensure_indexes():
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = set((await collection.index_information()).keys())
+        for model in models:
+            name = model.document["name"]
+            if name in existing:
+                continue
+            try:
+                await collection.create_indexes([model])
+                logger.info(f"✅ Created index {collection_name}.{name}")
+            except OperationFailure as e:
+                # e.g. duplicate emails in old data; keep serving and let the report flag it
+                logger.error(f"❌ Could not create index {collection_name}.{name}: {e}")
+
+@app.on_event("startup")
+async def start_cache_sync():
+    spawn_background(cache_sync_loop(), "cache sync")
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage")]
+    if "inputStage" in plan:
+        stages += _plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return [s for s in stages if s]
+
+def _plan_index_names(plan: dict) -> List[str]:
+    names = [plan["indexName"]] if "indexName" in plan else []
+    if "inputStage" in plan:
+        names += _plan_index_names(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        names += _plan_index_names(child)
+    return names
+
 async def get_delivery_partner(user: User = Depends(get_current_user)) -> User:
     if user.role != UserRole.DELIVERY_PARTNER:
         raise HTTPException(status_code=403, detail="Delivery partner access required")
@@ -439,16 +1033,18 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")   
     # Create user
     user_dict = user_data.dict()
-    user_dict["password"] = get_password_hash(user_data.password)
+    user_dict["password"] = await get_password_hash_async(user_data.password)
     user_dict["id"] = str(uuid.uuid4())
     user_dict["is_active"] = True
     user_dict["created_at"] = datetime.utcnow()
     
     await db.users.insert_one(user_dict)
+    await invalidate_user(user_dict["id"])
     # Create wallet for customers
     if user_data.role == UserRole.CUSTOMER:
-        wallet = {"user_id": user_dict["id"], "balance": 0.0, "transactions": []}
+        wallet = {"user_id": user_dict["id"], "balance": 0.0}
         await db.wallets.insert_one(wallet)
+        await index_customer(user_dict)
     # Create token
     access_token = create_access_token({"sub": user_dict["id"]})
     
@@ -468,7 +1064,7 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=Token)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user or not await verify_password_async(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     if not user.get("is_active", True):
         raise HTTPException(
@@ -511,50 +1107,247 @@ async def update_profile(
     
     if update_dict:
         await db.users.update_one({"id": user.id}, {"$set": update_dict})
+        await invalidate_user(user.id)
     
     updated_user = await db.users.find_one({"id": user.id})
+    if update_dict and user.role == UserRole.CUSTOMER:
+        await index_customer(updated_user)
+    if "name" in update_dict or "phone" in update_dict:
+        await refresh_order_snapshots(updated_user)
     return UserResponse(**updated_user)
 
 def is_valid_image_url(url: str) -> bool:
     return url.startswith("http://") or url.startswith("https://")
 
-# ===================== PRODUCT ENDPOINTS =====================
+def image_base_url() -> str:
+    return PUBLIC_BASE_URL or request_base_url.get()
 
-@api_router.get("/catalog/admins")
-async def get_admin_catalog():
-    admins = await db.users.find(
-        {"role": "admin"},
-        {"password": 0}
-    ).to_list(100)
+def image_url(image_id: str) -> str:
+    # Absolute: the mobile client cannot load a relative uri
+    return f"{image_base_url()}/api/images/{image_id}"
+
+@app.middleware("http")
+async def remember_base_url(request: Request, call_next):
+    request_base_url.set(str(request.base_url).rstrip("/"))
+    return await call_next(request)
+
+# PIL format -> content type for images we accept and serve; anything else is rejected
+IMAGE_CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+def detect_image_type(data: bytes) -> Optional[str]:
+    """Content type of `data` sniffed from its header, or None if it is not an allowed image."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return IMAGE_CONTENT_TYPES.get(img.format)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+def decode_base64_image(value: str) -> tuple:
+    """Decode a data URL (or bare base64) into (bytes, content_type).
+
+    The data URL header is client-controlled and ignored: the content type is detected from the
+    bytes, since get_image serves it publicly from the API origin.
+    """
+    if value.startswith("data:"):
+        value = value.partition(",")[2]
+    try:
+        data = base64.b64decode(value, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+    content_type = detect_image_type(data)
+    if content_type is None:
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+    return data, content_type
+
+async def store_blob(data: bytes, content_type: str) -> str:
+    """Store bytes once in the image bucket and return their sha256 id."""
+    digest = hashlib.sha256(data).hexdigest()
+    exists = await db["images.files"].find_one({"filename": digest}, {"_id": 1})
+    if not exists:
+        file_id = ObjectId()
+        try:
+            await image_bucket.upload_from_stream_with_id(
+                file_id, digest, data, metadata={"content_type": content_type}
+            )
+        except FileExists:
+            # Same bytes uploaded concurrently; filename_unique kept the other copy
+            await db["images.chunks"].delete_many({"files_id": file_id})
+    return digest
+
+async def product_image_fields(image: Optional[str], image_type: Optional[str]) -> Dict[str, Any]:
+    """Turn an uploaded image into the fields stored on the product document."""
+    if not image:
+        return {"image": None, "image_type": image_type, "image_id": None, "image_variants": None}
+    # image_type defaults to "base64", so clients send URLs under either type
+    if is_valid_image_url(image):
+        return {"image": image, "image_type": "url", "image_id": None, "image_variants": None}
+    if image_type == "url" and not image.startswith("data:"):
+        raise HTTPException(status_code=400, detail="Invalid image URL")
+    data, content_type = decode_base64_image(image)
+    image_id = await store_blob(data, content_type)
+    known = await db.image_variants.find_one({"image_id": image_id}, {"variants": 1})
+    if not known:
+        enqueue_image_variants(image_id)
+    return {
+        "image": None,
+        "image_type": "blob",
+        "image_id": image_id,
+        "image_variants": known["variants"] if known else None
+    }
+
+def render_image_variants(data: bytes) -> Dict[str, tuple]:
+    """Decode an image once and encode every IMAGE_VARIANTS size (runs in image_executor)."""
+    source = Image.open(io.BytesIO(data))
+    source.load()
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA" if "transparency" in source.info else "RGB")
+    variants = {}
+    for name, (max_side, fmt) in IMAGE_VARIANTS.items():
+        copy = source.copy()
+        copy.thumbnail((max_side, max_side))
+        out = io.BytesIO()
+        copy.save(out, format=fmt, quality=80, method=4)
+        variants[name] = (out.getvalue(), f"image/{fmt.lower()}")
+    return variants
+
+def get_image_executor() -> ProcessPoolExecutor:
+    global image_executor
+    if image_executor is None:
+        image_executor = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return image_executor
+
+@app.on_event("startup")
+async def start_image_executor():
+    get_image_executor()
+
+def shutdown_image_executor():
+    global image_executor
+    if image_executor is not None:
+        image_executor.shutdown(wait=False)
+        image_executor = None
+
+async def generate_image_variants(image_id: str):
+    grid_out = await image_bucket.open_download_stream_by_name(image_id)
+    data = await grid_out.read()
+    loop = asyncio.get_running_loop()
+    rendered = await loop.run_in_executor(get_image_executor(), render_image_variants, data)
+
+    variants = {}
+    for name, (variant_data, content_type) in rendered.items():
+        variants[name] = await store_blob(variant_data, content_type)
+    await db.image_variants.update_one(
+        {"image_id": image_id},
+        {"$set": {"variants": variants, "created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    result = await db.products.update_many(
+        {"image_id": image_id}, {"$set": {"image_variants": variants}}
+    )
+    await db.orders.update_many(
+        {"proof_image_id": image_id}, {"$set": {"proof_image_variants": variants}}
+    )
+    if result.modified_count:
+        await invalidate_all_catalogs()
+
+_background_tasks = set()
+
+def spawn_background(coro, label: str):
+    """Run a coroutine after the response is sent, logging instead of raising on failure."""
+    async def runner():
+        try:
+            await coro
+        except Exception:
+            logger.exception(f"❌ Background task failed: {label}")
+
+    task = asyncio.create_task(runner())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def enqueue_image_variants(image_id: str):
+    spawn_background(generate_image_variants(image_id), f"image variants {image_id}")
+
+async def attach_delivery_proof(order_id: str, proof_image: str):
+    """Store a rider's proof photo on a delivered order; a bad photo never blocks the delivery."""
+    try:
+        data, content_type = decode_base64_image(proof_image)
+    except HTTPException:
+        logger.warning(f"⚠️ Ignoring invalid proof image for order {order_id}")
+        return
+    image_id = await store_blob(data, content_type)
+    await db.orders.update_one({"id": order_id}, {"$set": {"proof_image_id": image_id}})
+    enqueue_image_variants(image_id)
 
-    return [ {"id": a["id"],"name": a["name"] }
-        for a in admins ]
+# ===================== PRODUCT ENDPOINTS =====================
 
-@api_router.get("/products", response_model=List[Product])
+@api_router.get("/catalog/admins")
+async def get_admin_catalog(request: Request):
+    cached = catalog_cache.get(("admins",))
+    if cached is None:
+        admins = await db.users.find(
+            {"role": "admin"},
+            {"_id": 0, "id": 1, "name": 1}
+        ).to_list(100)
+
+        cached = json_body([ {"id": a["id"],"name": a["name"] }
+            for a in admins ])
+        catalog_cache.set(("admins",), cached)
+    return etag_response(request, *cached)
+
+@api_router.get("/products", response_class=JSONResponse, responses=page_responses(Product, ProductCard, Dict[str, Any]))
 async def get_products(
     category: Optional[ProductCategory] = None,
     admin_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     admin: User = Depends(get_admin_user)  # add dependency
 ):
+    selected = resolve_fields(fields, ProductCard, Product)
     query = {}
     if category:
         query["category"] = category.value
     # If admin_id not provided, default to current admin
     query["admin_id"] = admin_id or admin.id
 
-    products = await db.products.find(query).to_list(100)
-    return [Product(**p) for p in products]
-
-@api_router.get("/catalog/products", response_model=List[Product])
-async def public_catalog(admin_id: Optional[str] = None, category: Optional[ProductCategory] = None):
-    query = {}
-    if admin_id:
-        query["admin_id"] = admin_id
-    if category:
-        query["category"] = category.value
+    products, next_cursor = await fetch_page(db.products, query, limit, cursor, fields_projection(selected))
+    return page_response([render_product(p, fields, selected) for p in products], next_cursor)
 
-    products = await db.products.find(query).to_list(100)
-    return [Product(**p) for p in products]
+@api_router.get("/catalog/products", response_class=JSONResponse, responses=page_responses(Product, ProductCard, Dict[str, Any]))
+async def public_catalog(
+    request: Request,
+    admin_id: Optional[str] = None,
+    category: Optional[ProductCategory] = None,
+    variant: Optional[str] = "card",
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    if variant and variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=400, detail="Unknown image variant")
+    selected = resolve_fields(fields, ProductCard, Product)
+    cache_key = ("products", admin_id, category.value if category else None, variant, limit, cursor, fields, image_base_url())
+    cached = catalog_cache.get(cache_key)
+    if cached is None:
+        query = {}
+        if admin_id:
+            query["admin_id"] = admin_id
+        if category:
+            query["category"] = category.value
+
+        products, next_cursor = await fetch_page(db.products, query, limit, cursor, fields_projection(selected))
+        cached = (
+            *json_body([render_product(p, fields, selected, variant) for p in products]),
+            {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        )
+        catalog_cache.set(cache_key, cached)
+    return etag_response(request, *cached)
 
 
 @api_router.post("/products", response_model=Product)
@@ -569,10 +1362,10 @@ async def create_product(product: ProductCreate, admin: User = Depends(get_admin
     if product_dict.get("image") and not product_dict.get("image_type"):
         product_dict["image_type"] = "base64"  # frontend sending base64
 
-    # ✅ OPTIONAL URL validation (only if image_type = url)
-    if product_dict.get("image_type") == "url":
-        if not is_valid_image_url(product_dict["image"]):
-            raise HTTPException(status_code=400, detail="Invalid image URL")
+    # base64 uploads go to the blob store, the document keeps only image_id
+    product_dict.update(
+        await product_image_fields(product_dict.get("image"), product_dict.get("image_type"))
+    )
 
     # ✅ ADD REQUIRED FIELDS
     product_dict["id"] = str(uuid.uuid4())
@@ -580,6 +1373,8 @@ async def create_product(product: ProductCreate, admin: User = Depends(get_admin
 
     # ✅ THIS LINE ACTUALLY SAVES TO MONGO
     await db.products.insert_one(product_dict)
+    await invalidate_catalog(admin.id)
+    await index_search_entry(product_search_entry(product_dict))
 
     return Product(**product_dict)
 
@@ -590,28 +1385,133 @@ async def update_product(product_id: str, update_data: Dict[str, Any], admin: Us
     if "image" in update_data and "image_type" not in update_data:
         update_data["image_type"] = "url"
 
-    if "image" in update_data and update_data.get("image_type") == "url":
-        if not is_valid_image_url(update_data["image"]):
-            raise HTTPException(status_code=400, detail="Invalid image URL")
+    if "image" in update_data:
+        update_data.update(
+            await product_image_fields(update_data["image"], update_data.get("image_type"))
+        )
 
     await db.products.update_one({"id": product_id}, {"$set": update_data})
 
     product = await db.products.find_one({"id": product_id})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidate_catalog(product["admin_id"])
+    if CALENDAR_PRODUCT_FIELDS & update_data.keys():
+        await invalidate_product_calendars()
+    await index_search_entry(product_search_entry(product))
 
     return Product(**product)
 
 @api_router.delete("/products/{product_id}")
 async def delete_product(product_id: str, admin: User = Depends(get_admin_user)):
-    result = await db.products.delete_one({"id": product_id})
-    if result.deleted_count == 0:
+    product = await db.products.find_one_and_delete({"id": product_id}, {"admin_id": 1})
+    if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidate_catalog(product.get("admin_id"))
+    await invalidate_product_calendars()
+    await remove_search_entry("product", product_id)
     return {"message": "Product deleted"}
 
+CATEGORIES_BODY = json_body(
+    [{"value": c.value, "label": c.value.replace("_", " ").title()} for c in ProductCategory]
+)
+
 @api_router.get("/categories")
-async def get_categories():
-    return [{"value": c.value, "label": c.value.replace("_", " ").title()} for c in ProductCategory]
+async def get_categories(request: Request):
+    return etag_response(request, *CATEGORIES_BODY)
+
+# ===================== IMAGE ENDPOINTS =====================
+
+IMAGE_STREAM_CHUNK = 256 * 1024
+
+def parse_range(header: str, length: int) -> Optional[tuple]:
+    """Parse a single `bytes=` range into inclusive (start, end), or None if unusable."""
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition("-")
+    try:
+        if start_s:
+            start = int(start_s)
+            end = min(int(end_s), length - 1) if end_s else length - 1
+        else:
+            start = max(length - int(end_s), 0)
+            end = length - 1
+    except ValueError:
+        return None
+    if start > end or start >= length:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{length}"}
+        )
+    return start, end
+
+@api_router.get("/images/{image_id}")
+async def get_image(image_id: str, request: Request):
+    if len(image_id) != 64 or any(c not in "0123456789abcdef" for c in image_id):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        grid_out = await image_bucket.open_download_stream_by_name(image_id)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    etag = f'"{image_id}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    length = grid_out.length
+    content_type = (grid_out.metadata or {}).get("content_type")
+    if content_type not in IMAGE_CONTENT_TYPES.values():
+        # blobs stored before content types were sniffed
+        content_type = "application/octet-stream"
+    byte_range = parse_range(request.headers.get("range", ""), length) if length else None
+    start, end = byte_range or (0, length - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+
+    async def body():
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(IMAGE_STREAM_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    return StreamingResponse(
+        body(),
+        status_code=206 if byte_range else 200,
+        media_type=content_type,
+        headers=headers
+    )
+
+async def migrate_product_images() -> Dict[str, int]:
+    """Move inline base64 product images into the blob store."""
+    migrated = failed = 0
+    cursor = db.products.find(
+        {"image": {"$nin": [None, ""]}, "image_type": {"$in": ["base64", None]}},
+        {"id": 1, "image": 1}
+    )
+    async for product in cursor:
+        if is_valid_image_url(product["image"]):
+            continue
+        try:
+            fields = await product_image_fields(product["image"], "base64")
+        except HTTPException:
+            failed += 1
+            continue
+        await db.products.update_one({"id": product["id"]}, {"$set": fields})
+        migrated += 1
+    await invalidate_all_catalogs()
+    return {"migrated": migrated, "failed": failed}
 
 # ===================== SUBSCRIPTION ENDPOINTS =====================
 
@@ -621,10 +1521,29 @@ async def get_subscriptions(user: User = Depends(get_current_user)):
         {"user_id": user.id, "is_active": True}
     ).sort("created_at", -1).to_list(100)
 
+    # One $in read for the products and one aggregation for each subscription's latest order
+    products = await db.products.find(
+        {"id": {"$in": list({s["product_id"] for s in subs})}},
+        {"_id": 0, "id": 1, "name": 1, "price": 1, "unit": 1}
+    ).to_list(None)
+    products_by_id = {p["id"]: p for p in products}
+
+    latest_orders = await db.orders.aggregate([
+        {"$match": {"subscription_id": {"$in": [s["id"] for s in subs]}}},
+        {"$sort": {"subscription_id": 1, "delivery_date": -1, "created_at": -1}},
+        {"$group": {
+            "_id": "$subscription_id",
+            "order_id": {"$first": "$_id"},
+            "status": {"$first": "$status"},
+            "delivery_otp": {"$first": "$delivery_otp"},
+        }},
+    ]).to_list(None)
+    orders_by_sub = {o["_id"]: o for o in latest_orders}
+
     result = []
 
     for sub in subs:
-        product = await db.products.find_one({"id": sub["product_id"]})
+        product = products_by_id.get(sub["product_id"])
 
         sub["product"] = {
             "name": product["name"],
@@ -632,12 +1551,12 @@ async def get_subscriptions(user: User = Depends(get_current_user)):
             "unit": product.get("unit"),
         } if product else None
 
-        # ✅ Fetch linked order status
-        order = await db.orders.find_one({"subscription_id": sub["id"]})
+        # ✅ Latest linked order by delivery_date
+        order = orders_by_sub.get(sub["id"])
         if order:
-            sub["status"] = order.get("status", "unassigned")
+            sub["status"] = order.get("status") or "unassigned"
             sub["delivery_otp"] = order.get("delivery_otp")
-            sub["order_id"] = str(order.get("_id", ""))
+            sub["order_id"] = str(order.get("order_id", ""))
         else:
             sub["status"] = "no_order"
 
@@ -646,6 +1565,70 @@ async def get_subscriptions(user: User = Depends(get_current_user)):
 
     return result
 
+DELIVERY_SLOT = "5:00 AM - 7:00 AM"
+
+def build_order(
+    subscription_id: str,
+    customer: dict,
+    product: dict,
+    admin: Optional[dict],
+    delivery_date: str,
+    quantity: int,
+    delivery_otp: Optional[str] = None,
+    admin_otp: Optional[str] = None
+) -> dict:
+    """Order document for one subscription delivery, with frozen customer/admin snapshots."""
+    return {
+        "id": str(uuid.uuid4()),
+        "subscription_id": subscription_id,
+
+        # 👤 CUSTOMER INFO (Freeze snapshot)
+        "user_id": customer["id"],
+        "customer_name": customer.get("name"),
+        "customer_phone": customer.get("phone"),
+        "delivery_address": customer.get("address") or {},
+
+        # 🏪 ADMIN INFO (Freeze snapshot)
+        "admin_id": product["admin_id"],
+        "admin_name": admin["name"] if admin else None,
+        "admin_phone": admin.get("phone") if admin else None,
+        "pickup_address": admin.get("address") if admin else {},
+
+        "items": [{
+            "product_id": product["id"],
+            "product_name": product["name"],
+            "quantity": quantity,
+            "price": product["price"],
+            "subscription_id": subscription_id
+        }],
+
+        "delivery_otp": delivery_otp or generate_otp(),
+        "admin_otp": admin_otp or generate_otp(),
+
+        "total_amount": quantity * product["price"],
+        "status": OrderStatus.UNASSIGNED.value,
+        "delivery_date": delivery_date,
+        "delivery_slot": DELIVERY_SLOT,
+
+        "delivery_partner_id": None,
+        "created_at": datetime.utcnow()
+    }
+
+def build_subscription(subscription: SubscriptionCreate, user: User, product: dict, delivery_otp: str) -> dict:
+    sub_dict = subscription.dict()
+    sub_dict["id"] = str(uuid.uuid4())
+    sub_dict["user_id"] = user.id
+    sub_dict["is_active"] = True
+    sub_dict["modifications"] = {}
+    sub_dict["created_at"] = datetime.utcnow()
+    sub_dict["admin_id"] = product["admin_id"]
+    sub_dict["admin_name"] = product.get("admin_name")
+    sub_dict["delivery_otp"] = delivery_otp
+
+    if subscription.pattern == SubscriptionPattern.BUY_ONCE:
+        sub_dict["end_date"] = subscription.start_date
+    return sub_dict
+
 @api_router.post("/subscriptions", response_model=Subscription)
 async def create_subscription(subscription: SubscriptionCreate, user: User = Depends(get_current_user)):
 
@@ -663,76 +1646,151 @@ async def create_subscription(subscription: SubscriptionCreate, user: User = Dep
     admin_otp = generate_otp()
     
     # ---------------- SUBSCRIPTION ----------------
-    sub_dict = subscription.dict()
-    sub_dict["id"] = str(uuid.uuid4())
-    sub_dict["user_id"] = user.id
-    sub_dict["is_active"] = True
-    sub_dict["modifications"] = []
-    sub_dict["created_at"] = datetime.utcnow()
-    sub_dict["admin_id"] = product["admin_id"]
-    sub_dict["admin_name"] = product.get("admin_name")
-    sub_dict["delivery_otp"] = user_otp
-
-    if subscription.pattern == SubscriptionPattern.BUY_ONCE:
-        sub_dict["end_date"] = subscription.start_date
-
+    sub_dict = build_subscription(subscription, user, product, user_otp)
     await db.subscriptions.insert_one(sub_dict)
+    await invalidate_calendar(user.id)
 
     # ---------------- ORDER (🔥 NEW) ----------------
     delivery_date = (
         datetime.strptime(subscription.start_date, "%Y-%m-%d").strftime("%Y-%m-%d")
     )
 
-    order = {
-    "id": str(uuid.uuid4()),
-    "subscription_id": sub_dict["id"],
-
-    # 👤 CUSTOMER INFO (Freeze snapshot)
-    "user_id": user.id,
-    "customer_name": user.name,
-    "customer_phone": user.phone,
-    "delivery_address": user.address or {},
-
-    # 🏪 ADMIN INFO (Freeze snapshot)
-    "admin_id": product["admin_id"],
-    "admin_name": admin["name"] if admin else None,
-    "admin_phone": admin.get("phone") if admin else None,
-    "pickup_address": admin.get("address") if admin else {},
-
-    "items": [{
-        "product_id": product["id"],
-        "product_name": product["name"],
-        "quantity": subscription.quantity,
-        "price": product["price"],
-        "subscription_id": sub_dict["id"]
-    }],
-
-    "delivery_otp": user_otp,
-    "admin_otp": admin_otp,
-
-    "total_amount": subscription.quantity * product["price"],
-    "status": OrderStatus.UNASSIGNED.value,
-    "delivery_date": delivery_date,
-    "delivery_slot": "5:00 AM - 7:00 AM",
-
-    "delivery_partner_id": None,
-    "created_at": datetime.utcnow()
-}
+    order = build_order(
+        sub_dict["id"], user.dict(), product, admin, delivery_date,
+        subscription.quantity, delivery_otp=user_otp, admin_otp=admin_otp
+    )
     await db.orders.insert_one(order)
+    await rollup_orders(db, [order])
+    await index_search_entry(order_search_entry(order))
+    await link_customer_to_admin(user, product["admin_id"])
 
     return Subscription(**sub_dict)
-    
+
+MAX_BULK_SUBSCRIPTIONS = 50
+
+def written_before_failure(docs: List[dict], error: Exception) -> List[dict]:
+    """The documents an ordered insert_many wrote before raising `error`.
+
+    A BulkWriteError says how many went in; after any other error (a dropped connection, say)
+    any of them may have, so all are returned.
+    """
+    if isinstance(error, BulkWriteError):
+        return docs[:error.details.get("nInserted", 0)]
+    return docs
+
+@api_router.post("/subscriptions/bulk")
+async def create_subscriptions_bulk(
+    subscriptions: List[SubscriptionCreate],
+    user: User = Depends(get_current_user)):
+    """Checkout a basket: every valid line's subscription and first order are written in one transaction"""
+    if not subscriptions:
+        raise HTTPException(status_code=400, detail="No subscriptions given")
+    if len(subscriptions) > MAX_BULK_SUBSCRIPTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_SUBSCRIPTIONS} subscriptions per checkout")
+
+    products = {
+        p["id"]: p
+        async for p in db.products.find({"id": {"$in": list({s.product_id for s in subscriptions})}}, {"_id": 0})
+    }
+    admins = {
+        a["id"]: a
+        async for a in db.users.find(
+            {"id": {"$in": list({p["admin_id"] for p in products.values()})}},
+            {"_id": 0, "id": 1, "name": 1, "phone": 1, "address": 1}
+        )
+    }
+
+    results: List[Dict[str, Any]] = []
+    new_subscriptions, new_orders = [], []
+    seen_lines: Dict[str, int] = {}
+    customer = user.dict()
+    for index, subscription in enumerate(subscriptions):
+        line = {"index": index, "product_id": subscription.product_id}
+        results.append(line)
+        # an identical line is a double tap, not a second subscription; quantity is the way to get more
+        line_key = subscription.model_dump_json(exclude={"quantity", "status"})
+        if line_key in seen_lines:
+            line.update(status="error", detail=f"Duplicate of line {seen_lines[line_key]}")
+            continue
+        product = products.get(subscription.product_id)
+        try:
+            delivery_date = datetime.strptime(subscription.start_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            line.update(status="error", detail="start_date must be YYYY-MM-DD")
+            continue
+        if not product:
+            line.update(status="error", detail="Product not found")
+            continue
+        if not product.get("is_available", True):
+            line.update(status="error", detail="Product unavailable")
+            continue
+        if subscription.quantity < 1:
+            line.update(status="error", detail="Quantity must be at least 1")
+            continue
+
+        user_otp = generate_otp()
+        sub_dict = build_subscription(subscription, user, product, user_otp)
+        order = build_order(
+            sub_dict["id"], customer, product, admins.get(product["admin_id"]), delivery_date,
+            subscription.quantity, delivery_otp=user_otp
+        )
+        new_subscriptions.append(sub_dict)
+        new_orders.append(order)
+        seen_lines[line_key] = index
+        line.update(status="created", subscription_id=sub_dict["id"], order_id=order["id"])
+
+    if new_subscriptions:
+        async def write(session):
+            written = {"subscriptions": [], "orders": []}
+            try:
+                for name, docs in (("subscriptions", new_subscriptions), ("orders", new_orders)):
+                    try:
+                        await db[name].insert_many(docs, session=session)
+                    except Exception as e:
+                        written[name] = written_before_failure(docs, e)
+                        raise
+                    written[name] = docs
+                # undoes its own partial increments when it fails without a session
+                await rollup_orders(db, new_orders, session=session)
+            except Exception:
+                if session is None:
+                    # no transaction to abort on a standalone server: undo the partial checkout by hand
+                    for name in ("orders", "subscriptions"):
+                        if written[name]:
+                            await db[name].delete_many({"id": {"$in": [d["id"] for d in written[name]]}})
+                raise
+
+        await run_in_transaction(write)
+        await invalidate_calendar(user.id)
+        await index_search_entries([order_search_entry(o) for o in new_orders])
+        for admin_id in {s["admin_id"] for s in new_subscriptions}:
+            await link_customer_to_admin(user, admin_id)
+
+    created = {s["id"]: s for s in new_subscriptions}
+    for line in results:
+        if line["status"] == "created":
+            line["subscription"] = Subscription(**created[line["subscription_id"]])
+    return {
+        "created": len(new_subscriptions),
+        "failed": len(subscriptions) - len(new_subscriptions),
+        "results": results
+    }
 
 @api_router.put("/subscriptions/{subscription_id}")
-async def update_subscription(subscription_id: str, update_data: Dict[str, Any], user: User = Depends(get_current_user)):
+async def update_subscription(subscription_id: str, update_data: SubscriptionUpdate, user: User = Depends(get_current_user)):
     sub = await db.subscriptions.find_one({"id": subscription_id, "user_id": user.id})
     if not sub:
         raise HTTPException(status_code=404, detail="Subscription not found")
     
-    allowed_fields = ["quantity", "pattern", "custom_days", "is_active"]
-    update_dict = {k: v for k, v in update_data.items() if k in allowed_fields}
+    update_dict = {k: v for k, v in update_data.dict(exclude_unset=True).items() if v is not None}
+    pattern = update_dict.get("pattern", sub.get("pattern"))
+    if pattern == SubscriptionPattern.CUSTOM and not update_dict.get("custom_days", sub.get("custom_days")):
+        raise HTTPException(status_code=400, detail="custom pattern needs custom_days")
+    if not update_dict:
+        return Subscription(**sub)
     
     await db.subscriptions.update_one({"id": subscription_id}, {"$set": update_dict})
+    await invalidate_calendar(user.id)
     updated = await db.subscriptions.find_one({"id": subscription_id})
     return Subscription(**updated)
 
@@ -742,21 +1800,26 @@ async def modify_subscription_date(
     modification: SubscriptionModification,
     user: User = Depends(get_current_user)):
     """Modify quantity for a specific date"""
-    sub = await db.subscriptions.find_one({"id": subscription_id, "user_id": user.id})
+    try:
+        day = datetime.strptime(modification.date, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+    if day < now_ist().strftime("%Y-%m-%d"):
+        raise HTTPException(status_code=400, detail="Cannot modify a past date")
+    if modification.quantity < 0:
+        raise HTTPException(status_code=400, detail="Quantity cannot be negative")
+
+    # Single-key $set: concurrent edits of different dates never overwrite each other
+    sub = await db.subscriptions.find_one_and_update(
+        {"id": subscription_id, "user_id": user.id},
+        {"$set": {f"modifications.{day}": modification.quantity}},
+        projection={"_id": 0, "modifications": 1},
+        return_document=ReturnDocument.AFTER
+    )
     if not sub:
         raise HTTPException(status_code=404, detail="Subscription not found")
-
-    # Update or add modification
-    modifications = sub.get("modifications", [])
-    existing_idx = next((i for i, m in enumerate(modifications) if m["date"] == modification.date), None)
-    
-    if existing_idx is not None:
-        modifications[existing_idx]["quantity"] = modification.quantity
-    else:
-        modifications.append({"date": modification.date, "quantity": modification.quantity})
-    
-    await db.subscriptions.update_one({"id": subscription_id}, {"$set": {"modifications": modifications}})
-    return {"message": "Modification saved", "modifications": modifications}
+    await invalidate_calendar(user.id)
+    return {"message": "Modification saved", "modifications": sub.get("modifications", {})}
 
 @api_router.delete("/subscriptions/{subscription_id}")
 async def cancel_subscription(
@@ -780,14 +1843,16 @@ async def cancel_subscription(
             status_code=404,
             detail="Active subscription not found",
         )
+    await invalidate_calendar(user.id)
 
     # 2️⃣ DELETE related orders
-    await db.orders.delete_many(
-        {
-            "subscription_id": subscription_id,
-            "user_id": user.id,
-        }
-    )
+    related = {"subscription_id": subscription_id, "user_id": user.id}
+    removed = await db.orders.find(
+        related, {"_id": 0, "id": 1, "admin_id": 1, "delivery_date": 1, "status": 1, "total_amount": 1}
+    ).to_list(None)
+    await db.orders.delete_many(related)
+    await rollup_orders(db, removed, sign=-1)
+    await remove_search_entries("order", [o["id"] for o in removed if o.get("id")])
 
     return {
         "success": True,
@@ -803,12 +1868,118 @@ async def get_all_products_superadmin(
     for p in products:
         if "_id" in p:
             p["_id"] = str(p["_id"])
+        if p.get("image_type") == "blob" and p.get("image_id"):
+            p["image"] = image_url(p["image_id"])
 
     return products
 
 
 # ===================== VACATION ENDPOINTS =====================
 
+# vacations keeps what the customer entered; vacation_intervals holds one document per user
+# with those ranges merged and sorted, which is what schedule expansion reads
+
+def vacation_range(start, end) -> Optional[tuple]:
+    """A stored (start, end) as YYYY-MM-DD strings, or None when either is not a date or end < start."""
+    try:
+        start_day = datetime.strptime(start, "%Y-%m-%d")
+        end_day = datetime.strptime(end, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+    if end_day < start_day:
+        return None
+    return start_day.strftime("%Y-%m-%d"), end_day.strftime("%Y-%m-%d")
+
+def merge_intervals(intervals) -> List[dict]:
+    """Sort and merge (start, end) date ranges; overlapping or touching ranges become one.
+
+    Malformed ranges (legacy rows with missing or non-date values) are logged and skipped.
+    """
+    valid = []
+    for start, end in intervals:
+        normalized = vacation_range(start, end)
+        if normalized is None:
+            logger.warning(f"⚠️ Skipping malformed vacation range {start!r} .. {end!r}")
+            continue
+        valid.append(normalized)
+    merged = []
+    for start, end in sorted(valid):
+        if merged:
+            last = merged[-1]
+            day_after = (datetime.strptime(last["end_date"], "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            if start <= day_after:
+                last["end_date"] = max(last["end_date"], end)
+                continue
+        merged.append({"start_date": start, "end_date": end})
+    return merged
+
+VACATION_REFRESH_ATTEMPTS = 10
+
+async def refresh_vacation_intervals(database, user_id: str) -> List[dict]:
+    """Re-merge a user's vacations into their vacation_intervals document.
+
+    Two refreshes for the same user can interleave (read, merge, replace), so the document
+    carries a version: the replace only applies if nobody wrote since this refresh read it,
+    otherwise the refresh starts over and merges the vacations the other one saw as well.
+    """
+    for _ in range(VACATION_REFRESH_ATTEMPTS):
+        current = await database.vacation_intervals.find_one({"user_id": user_id}, {"_id": 0, "version": 1})
+        version = (current or {}).get("version", 0)
+        vacations = await database.vacations.find(
+            {"user_id": user_id}, {"_id": 0, "start_date": 1, "end_date": 1}
+        ).to_list(None)
+        intervals = merge_intervals((v.get("start_date"), v.get("end_date")) for v in vacations)
+        # An empty list is kept rather than deleted so the version survives
+        doc = {"user_id": user_id, "intervals": intervals, "version": version + 1, "updated_at": datetime.utcnow()}
+        try:
+            if current is None:
+                await database.vacation_intervals.insert_one(doc)
+                return intervals
+            result = await database.vacation_intervals.replace_one(
+                {"user_id": user_id, "version": current.get("version", {"$exists": False})}, doc
+            )
+        except DuplicateKeyError:
+            continue  # another refresh created the document first
+        if result.matched_count:
+            return intervals
+    raise RuntimeError(f"Vacation intervals for {user_id} kept changing; gave up after {VACATION_REFRESH_ATTEMPTS} attempts")
+
+async def vacations_between(database, user_ids, start_date: str, end_date: str) -> Dict[str, List[tuple]]:
+    """{user_id: [(start, end), ...]} for the given users' vacations overlapping [start_date, end_date]."""
+    away = {}
+    cursor = database.vacation_intervals.find(
+        {
+            "user_id": {"$in": list(user_ids)},
+            "intervals": {"$elemMatch": {"start_date": {"$lte": end_date}, "end_date": {"$gte": start_date}}}
+        },
+        {"_id": 0, "user_id": 1, "intervals": 1}
+    )
+    async for doc in cursor:
+        away[doc["user_id"]] = [
+            (i["start_date"], i["end_date"]) for i in doc["intervals"]
+            if i["start_date"] <= end_date and i["end_date"] >= start_date
+        ]
+    return away
+
+async def users_away_on(database, user_ids, day: str) -> set:
+    """Which of user_ids are on vacation on day."""
+    return set(await vacations_between(database, user_ids, day, day))
+
+async def rebuild_vacation_intervals(database) -> int:
+    user_ids = await database.vacations.distinct("user_id")
+    await database.vacation_intervals.delete_many({"user_id": {"$nin": user_ids}})
+    for user_id in user_ids:
+        await refresh_vacation_intervals(database, user_id)
+    return len(user_ids)
+
+@app.on_event("startup")
+async def build_vacation_intervals():
+    try:
+        if await db.vacation_intervals.estimated_document_count() == 0 and await db.vacations.find_one({}, {"_id": 1}):
+            spawn_background(rebuild_vacation_intervals(db), "vacation interval build")
+    except Exception:
+        logger.exception("❌ Could not start vacation interval build")
+
 @api_router.get("/vacations", response_model=List[Vacation])
 async def get_vacations(user: User = Depends(get_current_user)):
     vacations = await db.vacations.find({"user_id": user.id}).to_list(100)
@@ -816,11 +1987,23 @@ async def get_vacations(user: User = Depends(get_current_user)):
 
 @api_router.post("/vacations", response_model=Vacation)
 async def create_vacation(vacation: VacationCreate, user: User = Depends(get_current_user)):
+    try:
+        start = datetime.strptime(vacation.start_date, "%Y-%m-%d")
+        end = datetime.strptime(vacation.end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+
     vacation_dict = vacation.dict()
+    vacation_dict["start_date"] = start.strftime("%Y-%m-%d")
+    vacation_dict["end_date"] = end.strftime("%Y-%m-%d")
     vacation_dict["id"] = str(uuid.uuid4())
     vacation_dict["user_id"] = user.id
     vacation_dict["created_at"] = datetime.utcnow()
     await db.vacations.insert_one(vacation_dict)
+    await refresh_vacation_intervals(db, user.id)
+    await invalidate_calendar(user.id)
     return Vacation(**vacation_dict)
 
 @api_router.delete("/vacations/{vacation_id}")
@@ -828,70 +2011,967 @@ async def delete_vacation(vacation_id: str, user: User = Depends(get_current_use
     result = await db.vacations.delete_one({"id": vacation_id, "user_id": user.id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Vacation not found")
+    await refresh_vacation_intervals(db, user.id)
+    await invalidate_calendar(user.id)
     return {"message": "Vacation deleted"}
 
 # ===================== WALLET ENDPOINTS =====================
 
+# wallets holds only the balance; every movement is appended to wallet_transactions
+def wallet_transaction(user_id: str, amount: float, tx_type: str, description: str, balance_after: float) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "amount": amount,
+        "type": tx_type,
+        "description": description,
+        "balance_after": balance_after,
+        "created_at": datetime.utcnow()
+    }
+
+async def apply_wallet_change(
+    user_id: str,
+    delta: float,
+    tx_type: str,
+    description: str,
+    session=None,
+    extra: Optional[dict] = None
+) -> dict:
+    """Add delta to a wallet with one $inc (creating the wallet if needed) and append its ledger entry."""
+    wallet = await db.wallets.find_one_and_update(
+        {"user_id": user_id},
+        {"$inc": {"balance": delta, "movement_seq": 1}},
+        projection={"_id": 0, "balance": 1, "movement_seq": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    entry = wallet_transaction(user_id, abs(delta), tx_type, description, wallet["balance"])
+    entry.update(extra or {})
+    await db.wallet_transactions.insert_one(entry, session=session)
+    await record_wallet_day(user_id, delta, wallet["balance"], wallet["movement_seq"], session)
+    return entry
+
+async def migrate_wallet_transactions() -> Dict[str, int]:
+    """Move embedded wallets.transactions arrays into the wallet_transactions collection."""
+    wallets = moved = 0
+    cursor = db.wallets.find({"transactions.0": {"$exists": True}}, {"user_id": 1, "transactions": 1})
+    async for wallet in cursor:
+        entries = []
+        for tx in wallet["transactions"]:
+            entry = {**tx, "user_id": tx.get("user_id") or wallet["user_id"], "id": tx.get("id") or str(uuid.uuid4())}
+            if isinstance(entry.get("created_at"), str):
+                entry["created_at"] = datetime.fromisoformat(entry["created_at"])
+            entries.append(entry)
+        # Upserting on id keeps a re-run (or a run interrupted before the $unset) from duplicating entries
+        result = await db.wallet_transactions.bulk_write([
+            UpdateOne({"id": e["id"]}, {"$setOnInsert": e}, upsert=True) for e in entries
+        ], ordered=False)
+        await db.wallets.update_one({"_id": wallet["_id"]}, {"$unset": {"transactions": ""}})
+        wallets += 1
+        moved += result.upserted_count
+    return {"wallets": wallets, "transactions": moved}
+
+@app.on_event("startup")
+async def start_wallet_transaction_migration():
+    if await db.wallets.find_one({"transactions.0": {"$exists": True}}, {"_id": 1}):
+        spawn_background(migrate_wallet_transactions(), "wallet transaction migration")
+
 @api_router.get("/wallet")
 async def get_wallet(user: User = Depends(get_current_user)):
-    wallet = await db.wallets.find_one({"user_id": user.id})
-    if not wallet:
-        wallet = {"user_id": user.id, "balance": 0.0, "transactions": []}
-        await db.wallets.insert_one(wallet)
-    return {"balance": wallet.get("balance", 0.0)}
-
-@api_router.get("/wallet/transactions")
-async def get_wallet_transactions(user: User = Depends(get_current_user)):
-    wallet = await db.wallets.find_one({"user_id": user.id})
-    if not wallet:
-        return []
-    return wallet.get("transactions", [])[-50:]  # Last 50 transactions
+    wallet = await db.wallets.find_one_and_update(
+        {"user_id": user.id},
+        {"$setOnInsert": {"balance": 0.0}},
+        projection={"_id": 0, "balance": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    response = {"balance": wallet.get("balance", 0.0)}
+    if user.role == UserRole.ADMIN:
+        response["pending_settlement"] = await pending_settlement_amount(user.id)
+    return response
+
+@api_router.get("/wallet/transactions", response_class=JSONResponse, responses=page_responses(
+    WalletTransaction, description="One page of transactions, oldest first; X-Next-Cursor pages further back"
+))
+async def get_wallet_transactions(
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user: User = Depends(get_current_user)):
+    """Latest `limit` transactions, oldest first; X-Next-Cursor pages further back"""
+    transactions, next_cursor = await fetch_page(
+        db.wallet_transactions, {"user_id": user.id}, limit, cursor, {"_id": 0}
+    )
+    return page_response(transactions[::-1], next_cursor)
 
 @api_router.post("/wallet/recharge")
 async def recharge_wallet(recharge: WalletRecharge, user: User = Depends(get_current_user)):
     if recharge.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    wallet = await db.wallets.find_one({"user_id": user.id})
-    if not wallet:
-        wallet = {"user_id": user.id, "balance": 0.0, "transactions": []}
-        await db.wallets.insert_one(wallet)
-    
-    new_balance = wallet.get("balance", 0.0) + recharge.amount
-    
-    transaction = {
-        "id": str(uuid.uuid4()),
-        "user_id": user.id,
-        "amount": recharge.amount,
-        "type": "credit",
-        "description": "Wallet recharge",
-        "balance_after": new_balance,
-        "created_at": datetime.utcnow().isoformat()
-    }
-    
-    await db.wallets.update_one(
-        {"user_id": user.id},
-        {
-            "$set": {"balance": new_balance},
-            "$push": {"transactions": transaction}
-        }
+    entry = await run_in_transaction(
+        lambda session: apply_wallet_change(user.id, recharge.amount, "credit", "Wallet recharge", session)
     )
-    
-    return {"message": "Recharge successful", "new_balance": new_balance}
+    return {"message": "Recharge successful", "new_balance": entry["balance_after"]}
+
+# ===================== ADMIN SETTLEMENT =====================
+
+# Delivered orders debit the customer immediately, but the admin's credit is written to
+# settlement_buffer and applied in batches, so riders of one dairy don't all contend on its wallet
+SETTLEMENT_ENABLED = os.environ.get("SETTLEMENT_ENABLED", "true").lower() == "true"
+SETTLEMENT_INTERVAL_SECONDS = float(os.environ.get("SETTLEMENT_INTERVAL_SECONDS", "60"))
+
+async def charge_delivery(order: dict, session=None) -> Optional[dict]:
+    """Debit the customer for a delivered order and queue the admin's credit, at most once per order.
+
+    Returns None when the order was already charged. A debit left without its buffer row
+    (a standalone server failing half-way) is completed rather than repeated.
+    """
+    order_id = order.get("id") or str(order["_id"])
+    if await db.settlement_buffer.find_one({"order_id": order_id}, {"_id": 1}, session=session):
+        return None
+    amount = order["total_amount"]
+    description = f"Order delivered - {', '.join([i['product_name'] for i in order.get('items', [])])}"
+    debit = await db.wallet_transactions.find_one(
+        {"order_id": order_id, "type": "debit"}, {"_id": 0}, session=session
+    )
+    if debit is None:
+        debit = await apply_wallet_change(
+            order["user_id"], -amount, "debit", description, session, {"order_id": order_id}
+        )
+    try:
+        await db.settlement_buffer.insert_one({
+            "id": str(uuid.uuid4()),
+            "admin_id": order["admin_id"],
+            "order_id": order_id,
+            "customer_id": order["user_id"],
+            "amount": amount,
+            "batch_id": None,
+            "settled_at": None,
+            "created_at": datetime.utcnow()
+        }, session=session)
+    except DuplicateKeyError:
+        if session is not None:
+            raise
+        return None  # a concurrent request queued this order first
+    return debit
+
+async def deliver_order(order: dict, order_filter: dict) -> Optional[dict]:
+    """Flip an order to delivered and charge for it in one transaction.
+
+    Returns the pre-update status document, or None when the order was already delivered.
+    """
+    delivered = {"status": OrderStatus.DELIVERED.value, "delivered_at": now_ist().isoformat()}
+    chargeable = order.get("total_amount", 0) > 0 and order.get("user_id") and order.get("admin_id")
+    charged = None
+
+    async def apply(session):
+        nonlocal charged
+        # Only the request that actually flips the order to delivered moves money
+        before = await db.orders.find_one_and_update(
+            {**order_filter, "status": {"$ne": OrderStatus.DELIVERED.value}},
+            {"$set": delivered},
+            projection={"status": 1},
+            session=session
+        )
+        if before is None or not chargeable:
+            return before
+        try:
+            charged = await charge_delivery(order, session)
+        except Exception:
+            if session is None:
+                # No transaction to abort: put the status back so a retry resumes the charge
+                await db.orders.update_one(
+                    {"_id": before["_id"], "status": OrderStatus.DELIVERED.value},
+                    {"$set": {"status": before.get("status")}, "$unset": {"delivered_at": ""}}
+                )
+            raise
+        return before
+
+    before = await run_in_transaction(apply)
+    if before is not None:
+        await rollup_status_change(order, before.get("status"), OrderStatus.DELIVERED.value)
+        if charged:
+            logger.info(f"✅ Wallet debit: ₹{order['total_amount']} from customer {order['user_id']}, queued for admin {order['admin_id']}")
+    return before
+
+async def apply_settlement_batch(batch_id: str, admin_id: str) -> Optional[dict]:
+    """Credit one admin with a claimed batch, exactly once however often it is replayed.
+
+    The settlement_batches marker (unique on batch_id, admin_id) is written in the same
+    transaction as the credit. Returns None when the batch was already applied.
+    """
+    entries = await db.settlement_buffer.find(
+        {"batch_id": batch_id, "admin_id": admin_id}, {"_id": 0, "order_id": 1, "amount": 1}
+    ).to_list(None)
+    if not entries:
+        return None
+    total = sum(e["amount"] for e in entries)
+    order_ids = [e["order_id"] for e in entries]
+    entry_id = f"settlement-{batch_id}-{admin_id}"
+
+    async def apply(session):
+        marker = {"batch_id": batch_id, "admin_id": admin_id}
+        if await db.settlement_batches.find_one(marker, {"_id": 1}, session=session):
+            return None
+        try:
+            await db.settlement_batches.insert_one({
+                **marker, "amount": total, "orders": len(order_ids),
+                "created_at": datetime.utcnow(), "settled_at": None
+            }, session=session)
+        except DuplicateKeyError:
+            if session is not None:
+                raise
+            return None  # another worker's settlement run claimed this batch first
+
+        try:
+            await db.wallets.update_one(
+                {"user_id": admin_id}, {"$setOnInsert": {"balance": 0.0}}, upsert=True, session=session
+            )
+            wallet = await db.wallets.find_one_and_update(
+                {"user_id": admin_id},
+                {"$inc": {"balance": total, "movement_seq": 1}},
+                projection={"_id": 0, "balance": 1, "movement_seq": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+        except Exception:
+            if session is None:
+                # No transaction to abort: release the claim so the next run retries the credit
+                await db.settlement_batches.delete_one(marker)
+            raise
+        await record_wallet_day(admin_id, total, wallet["balance"], wallet["movement_seq"], session)
+
+        entry = wallet_transaction(
+            admin_id, total, "credit", f"Settlement of {len(order_ids)} delivered orders", wallet["balance"]
+        )
+        entry.update(id=entry_id, batch_id=batch_id, order_ids=order_ids)
+        await db.wallet_transactions.update_one(
+            {"id": entry_id}, {"$setOnInsert": entry}, upsert=True, session=session
+        )
+        settled_at = datetime.utcnow()
+        await db.settlement_buffer.update_many(
+            {"batch_id": batch_id, "admin_id": admin_id}, {"$set": {"settled_at": settled_at}}, session=session
+        )
+        await db.settlement_batches.update_one(marker, {"$set": {"settled_at": settled_at}}, session=session)
+        return entry
+    return await run_in_transaction(apply)
+
+async def migrate_settlement_markers() -> int:
+    """Move batch ids from the old capped wallets.settled_batches arrays into settlement_batches."""
+    moved = 0
+    async for wallet in db.wallets.find({"settled_batches.0": {"$exists": True}}, {"user_id": 1, "settled_batches": 1}):
+        admin_id = wallet["user_id"]
+        now = datetime.utcnow()
+        await db.settlement_batches.bulk_write([
+            UpdateOne(
+                {"batch_id": batch_id, "admin_id": admin_id},
+                {"$setOnInsert": {"batch_id": batch_id, "admin_id": admin_id, "created_at": now, "settled_at": now}},
+                upsert=True
+            ) for batch_id in wallet["settled_batches"]
+        ], ordered=False)
+        # these were credited already; a run interrupted before settling the buffer must not stay pending
+        await db.settlement_buffer.update_many(
+            {"admin_id": admin_id, "batch_id": {"$in": wallet["settled_batches"]}, "settled_at": None},
+            {"$set": {"settled_at": now}}
+        )
+        await db.wallets.update_one({"_id": wallet["_id"]}, {"$unset": {"settled_batches": ""}})
+        moved += len(wallet["settled_batches"])
+    return moved
 
-# ===================== ORDER ENDPOINTS =====================
+@app.on_event("startup")
+async def start_settlement_marker_migration():
+    if await db.wallets.find_one({"settled_batches.0": {"$exists": True}}, {"_id": 1}):
+        spawn_background(migrate_settlement_markers(), "settlement marker migration")
+
+async def settle_admin_credits() -> Dict[str, Any]:
+    """Claim every unbatched credit into a new batch, then apply all claimed but unsettled batches."""
+    batch_id = str(uuid.uuid4())
+    await db.settlement_buffer.update_many({"batch_id": None}, {"$set": {"batch_id": batch_id}})
+
+    pending = await db.settlement_buffer.aggregate([
+        {"$match": {"settled_at": None, "batch_id": {"$ne": None}}},
+        {"$group": {"_id": {"batch_id": "$batch_id", "admin_id": "$admin_id"}}}
+    ]).to_list(None)
+
+    settlements = []
+    for group in pending:
+        entry = await apply_settlement_batch(group["_id"]["batch_id"], group["_id"]["admin_id"])
+        if entry:
+            settlements.append({
+                "admin_id": entry["user_id"],
+                "batch_id": entry["batch_id"],
+                "orders": len(entry["order_ids"]),
+                "amount": entry["amount"]
+            })
+    return {
+        "batches": len(settlements),
+        "orders": sum(s["orders"] for s in settlements),
+        "amount": sum(s["amount"] for s in settlements),
+        "settlements": settlements
+    }
 
-@api_router.get("/orders", response_model=List[Order])
-async def get_orders(user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": user.id}).sort("created_at", -1).to_list(100)
-    return [Order(**o) for o in orders]
+async def pending_settlement_amount(admin_id: str) -> float:
+    result = await db.settlement_buffer.aggregate([
+        {"$match": {"admin_id": admin_id, "settled_at": None}},
+        {"$group": {"_id": None, "amount": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    return result[0]["amount"] if result else 0.0
+
+async def reconcile_settlements() -> Dict[str, Any]:
+    """Check customer debits == buffered credits, and per admin settled credits == settlement ledger entries."""
+    buffered = {
+        row["_id"]: row
+        async for row in db.settlement_buffer.aggregate([
+            {"$group": {
+                "_id": "$admin_id",
+                "orders": {"$sum": 1},
+                "buffered": {"$sum": "$amount"},
+                "pending": {"$sum": {"$cond": [{"$eq": ["$settled_at", None]}, "$amount", 0]}}
+            }}
+        ])
+    }
+    credited = {
+        row["_id"]: row
+        async for row in db.wallet_transactions.aggregate([
+            {"$match": {"batch_id": {"$exists": True}}},
+            {"$group": {
+                "_id": "$user_id",
+                "credited": {"$sum": "$amount"},
+                "orders": {"$sum": {"$size": "$order_ids"}}
+            }}
+        ])
+    }
+    debits = await db.wallet_transactions.aggregate([
+        {"$match": {"type": "debit", "order_id": {"$exists": True}}},
+        {"$group": {"_id": None, "amount": {"$sum": "$amount"}, "orders": {"$sum": 1}}}
+    ]).to_list(1)
+
+    admins = []
+    for admin_id in sorted(buffered.keys() | credited.keys()):
+        b = buffered.get(admin_id, {})
+        c = credited.get(admin_id, {})
+        settled = round(b.get("buffered", 0.0) - b.get("pending", 0.0), 2)
+        admins.append({
+            "admin_id": admin_id,
+            "buffered": round(b.get("buffered", 0.0), 2),
+            "pending": round(b.get("pending", 0.0), 2),
+            "settled": settled,
+            "credited": round(c.get("credited", 0.0), 2),
+            "credited_orders": c.get("orders", 0),
+            "balanced": settled == round(c.get("credited", 0.0), 2)
+        })
 
-@api_router.get("/orders/{order_id}", response_model=Order)
-async def get_order(order_id: str, user: User = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id, "user_id": user.id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    return Order(**order)
+    customer_debits = round(debits[0]["amount"], 2) if debits else 0.0
+    total_buffered = round(sum(a["buffered"] for a in admins), 2)
+    return {
+        "balanced": customer_debits == total_buffered and all(a["balanced"] for a in admins),
+        "customer_debits": customer_debits,
+        "buffered": total_buffered,
+        "admins": admins,
+        # claimed but never finished: only possible without transactions, if a run died mid-batch
+        "unfinished_batches": await db.settlement_batches.count_documents({"settled_at": None})
+    }
+
+async def settlement_loop():
+    while True:
+        await asyncio.sleep(SETTLEMENT_INTERVAL_SECONDS)
+        try:
+            result = await settle_admin_credits()
+            if result["batches"]:
+                logger.info(f"✅ Settled {result['orders']} orders (₹{result['amount']}) in {result['batches']} batches")
+        except Exception:
+            logger.exception("❌ Admin settlement failed")
+
+@app.on_event("startup")
+async def start_settlement_loop():
+    if SETTLEMENT_ENABLED:
+        spawn_background(settlement_loop(), "admin settlement")
+
+# ===================== WALLET STATEMENTS =====================
+
+# wallet_daily: one document per user per IST day with the opening balance and that day's
+# credits, debits, net and count, folded in as each movement happens; closing = opening + net
+MAX_STATEMENT_DAYS = 366
+
+async def record_wallet_day(user_id: str, delta: float, balance_after: float, seq: int, session=None):
+    """Fold one wallet movement into today's snapshot.
+
+    seq is the wallet's movement_seq from the same $inc that produced balance_after. Without a
+    session, concurrent movements can reach this upsert out of order, so the opening balance is
+    owned by the day's lowest seq rather than by whichever upsert inserted the document.
+    """
+    day = {"user_id": user_id, "date": now_ist().strftime("%Y-%m-%d")}
+    opening = {"opening_balance": balance_after - delta, "opening_seq": seq}
+    result = await db.wallet_daily.update_one(
+        day,
+        {
+            "$inc": {"credits": max(delta, 0.0), "debits": max(-delta, 0.0), "net": delta, "count": 1},
+            "$setOnInsert": opening
+        },
+        upsert=True,
+        session=session
+    )
+    if result.upserted_id is None:
+        await db.wallet_daily.update_one({**day, "opening_seq": {"$gt": seq}}, {"$set": opening}, session=session)
+
+def statement_day(snapshot: dict) -> dict:
+    return {
+        "date": snapshot["date"],
+        "opening_balance": round(snapshot["opening_balance"], 2),
+        "closing_balance": round(snapshot["opening_balance"] + snapshot["net"], 2),
+        "credits": round(snapshot["credits"], 2),
+        "debits": round(snapshot["debits"], 2),
+        "count": snapshot["count"]
+    }
+
+def statement_range(from_date: Optional[str], to_date: Optional[str]) -> tuple:
+    """Validate ?from=&to= (default: this month so far, IST)."""
+    today = now_ist().replace(tzinfo=None)
+    try:
+        start = datetime.strptime(from_date, "%Y-%m-%d") if from_date else today.replace(day=1)
+        end = datetime.strptime(to_date, "%Y-%m-%d") if to_date else today
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from and to must be YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="to must not be before from")
+    if (end - start).days + 1 > MAX_STATEMENT_DAYS:
+        raise HTTPException(status_code=400, detail=f"Statement range is limited to {MAX_STATEMENT_DAYS} days")
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+async def wallet_statement(user_id: str, from_date: str, to_date: str) -> Dict[str, Any]:
+    """Totals for [from_date, to_date] from at most one snapshot per day."""
+    snapshots = await db.wallet_daily.find(
+        {"user_id": user_id, "date": {"$gte": from_date, "$lte": to_date}}, {"_id": 0}
+    ).sort("date", 1).to_list(MAX_STATEMENT_DAYS)
+    days = [statement_day(s) for s in snapshots]
+
+    if days:
+        opening = days[0]["opening_balance"]
+    else:
+        previous = await db.wallet_daily.find_one(
+            {"user_id": user_id, "date": {"$lt": from_date}}, {"_id": 0}, sort=[("date", -1)]
+        )
+        opening = statement_day(previous)["closing_balance"] if previous else 0.0
+
+    return {
+        "from": from_date,
+        "to": to_date,
+        "opening_balance": opening,
+        "closing_balance": days[-1]["closing_balance"] if days else opening,
+        "credits": round(sum(d["credits"] for d in days), 2),
+        "debits": round(sum(d["debits"] for d in days), 2),
+        "count": sum(d["count"] for d in days),
+        "days": days
+    }
+
+async def rebuild_wallet_snapshots(user_id: Optional[str] = None) -> Dict[str, int]:
+    """Recompute wallet_daily from the ledger, e.g. for history written before snapshots existed."""
+    signed = {"$cond": [{"$eq": ["$type", "credit"]}, "$amount", {"$multiply": ["$amount", -1]}]}
+    pipeline = [
+        {"$match": {"user_id": user_id} if user_id else {}},
+        {"$sort": {"user_id": 1, "created_at": 1}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at", "timezone": "Asia/Kolkata"}}
+            },
+            "opening_balance": {"$first": {"$subtract": ["$balance_after", signed]}},
+            "credits": {"$sum": {"$cond": [{"$eq": ["$type", "credit"]}, "$amount", 0]}},
+            "debits": {"$sum": {"$cond": [{"$eq": ["$type", "credit"]}, 0, "$amount"]}},
+            "net": {"$sum": signed},
+            "count": {"$sum": 1}
+        }}
+    ]
+    written = 0
+    batch = []
+    async for row in db.wallet_transactions.aggregate(pipeline, allowDiskUse=True):
+        key = row.pop("_id")
+        batch.append(ReplaceOne(key, {**key, **row}, upsert=True))
+        if len(batch) >= ORDER_WRITE_CHUNK:
+            written += (await db.wallet_daily.bulk_write(batch, ordered=False)).upserted_count
+            batch = []
+    if batch:
+        written += (await db.wallet_daily.bulk_write(batch, ordered=False)).upserted_count
+    return {"snapshots_created": written}
+
+@api_router.get("/wallet/statement")
+async def get_wallet_statement(
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    user: User = Depends(get_current_user)):
+    """Spend / earnings for a date range (default: this month)"""
+    from_date, to_date = statement_range(from_date, to_date)
+    return await wallet_statement(user.id, from_date, to_date)
+
+# ===================== DELIVERY SCHEDULE =====================
+
+PATTERN_CODES = {
+    SubscriptionPattern.DAILY.value: 0,
+    SubscriptionPattern.ALTERNATE.value: 1,
+    SubscriptionPattern.CUSTOM.value: 2,
+    SubscriptionPattern.BUY_ONCE.value: 3,
+}
+NO_END_DATE = np.iinfo(np.int64).max
+
+# Subscription fields the schedule engine reads
+SUBSCRIPTION_SCHEDULE_FIELDS = {
+    "_id": 0, "id": 1, "user_id": 1, "admin_id": 1, "product_id": 1, "quantity": 1,
+    "pattern": 1, "custom_days": 1, "start_date": 1, "end_date": 1, "modifications": 1
+}
+
+def subscription_modifications(sub: dict) -> Dict[str, int]:
+    """Date -> quantity overrides of a subscription (older documents stored a list)."""
+    modifications = sub.get("modifications") or {}
+    if isinstance(modifications, list):
+        return {m["date"]: m.get("quantity") for m in modifications if isinstance(m, dict) and "date" in m}
+    return modifications if isinstance(modifications, dict) else {}
+
+@lru_cache(maxsize=4096)
+def _day_number(value: str) -> Optional[int]:
+    try:
+        day = np.datetime64(value, "D")
+    except ValueError:
+        return None
+    return None if np.isnat(day) else int(day.astype(np.int64))
+
+def schedule_day(value) -> Optional[int]:
+    """Days since 1970-01-01 of a stored YYYY-MM-DD value, or None when it is not a date."""
+    return _day_number(value) if isinstance(value, str) else None
+
+def schedule_quantity(value) -> Optional[int]:
+    """A stored quantity as a non-negative int32, or None when it cannot be one."""
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return quantity if 0 <= quantity <= np.iinfo(np.int32).max else None
+
+async def convert_modification_lists(database) -> int:
+    """Rewrite legacy [{date, quantity}] modification lists as date-keyed maps."""
+    result = await database.subscriptions.update_many(
+        {"modifications": {"$type": "array"}},
+        [{"$set": {"modifications": {"$arrayToObject": {"$map": {
+            "input": "$modifications",
+            "in": {"k": "$$this.date", "v": "$$this.quantity"}
+        }}}}}]
+    )
+    return result.modified_count
+
+async def prune_expired_modifications(database, before_date: str) -> int:
+    """Drop modification dates earlier than before_date."""
+    result = await database.subscriptions.update_many(
+        {"modifications": {"$type": "object", "$ne": {}}},
+        [{"$set": {"modifications": {"$arrayToObject": {"$filter": {
+            "input": {"$objectToArray": "$modifications"},
+            "cond": {"$gte": ["$$this.k", before_date]}
+        }}}}}]
+    )
+    return result.modified_count
+
+@app.on_event("startup")
+async def migrate_subscription_modifications():
+    try:
+        converted = await convert_modification_lists(db)
+        if converted:
+            logger.info(f"✅ Converted modifications of {converted} subscriptions to date maps")
+    except Exception:
+        logger.exception("❌ Could not convert subscription modifications")
+
+def build_delivery_schedule(
+    subscriptions: List[dict],
+    start_date: str,
+    end_date: str,
+    vacations: Optional[Dict[str, List[tuple]]] = None
+) -> tuple:
+    """Expand subscriptions over [start_date, end_date].
+
+    Returns (days, quantities) where days are YYYY-MM-DD strings and quantities is an
+    int matrix of shape (len(subscriptions), len(days)). Patterns, date-specific
+    modifications and the owners' vacations ({user_id: [(start, end), ...]}) are applied.
+    """
+    day_values = np.arange(
+        np.datetime64(start_date, "D"), np.datetime64(end_date, "D") + 1
+    )
+    days = day_values.astype(np.int64)
+    n_subs = len(subscriptions)
+    if n_subs == 0 or len(days) == 0:
+        return [str(d) for d in day_values], np.zeros((n_subs, len(days)), dtype=np.int32)
+
+    # Rows are read defensively: a malformed stored subscription never delivers, but must
+    # not take down the preview, calendar or nightly run for everyone else in the batch
+    starts = np.zeros(n_subs, dtype=np.int64)
+    ends = np.zeros(n_subs, dtype=np.int64)
+    codes = np.full((n_subs, 1), -1, dtype=np.int8)
+    base_quantity = np.zeros(n_subs, dtype=np.int32)
+    custom_days = np.zeros((n_subs, 7), dtype=bool)
+    for row, s in enumerate(subscriptions):
+        start = schedule_day(s.get("start_date"))
+        end = schedule_day(s.get("end_date")) if s.get("end_date") else NO_END_DATE
+        quantity = schedule_quantity(s.get("quantity", 0))
+        pattern = s.get("pattern")
+        code = PATTERN_CODES.get(pattern, -1) if isinstance(pattern, str) else -1
+        if start is None or end is None or quantity is None or code == -1:
+            continue
+        starts[row], ends[row], codes[row, 0], base_quantity[row] = start, end, code, quantity
+        if code == 2 and isinstance(s.get("custom_days"), (list, tuple)):
+            for d in s["custom_days"]:
+                d = schedule_quantity(d)
+                if d is not None and d <= 6:
+                    custom_days[row, d] = True
+
+    weekday = (days + 3) % 7  # 1970-01-01 was a Thursday; 0 = Monday
+    offset = days[None, :] - starts[:, None]
+    active = (offset >= 0) & (days[None, :] <= ends[:, None])
+    deliver = active & (
+        (codes == 0)
+        | ((codes == 1) & (offset % 2 == 0))
+        | ((codes == 2) & custom_days[:, weekday])
+        | ((codes == 3) & (offset == 0))
+    )
+    quantities = np.where(deliver, base_quantity[:, None], 0).astype(np.int32)
+
+    # Sparse per-date overrides only apply on days the pattern delivers
+    rows, cols, values = [], [], []
+    for row, sub in enumerate(subscriptions):
+        if sub.get("modifications"):
+            for day, quantity in subscription_modifications(sub).items():
+                day, quantity = schedule_day(day), schedule_quantity(quantity)
+                if day is not None and quantity is not None and days[0] <= day <= days[-1]:
+                    rows.append(row)
+                    cols.append(day - days[0])
+                    values.append(quantity)
+    if rows:
+        rows = np.array(rows)
+        cols = np.array(cols)
+        values = np.array(values, dtype=np.int32)
+        applies = deliver[rows, cols]
+        quantities[rows[applies], cols[applies]] = values[applies]
+
+    if vacations:
+        rows_by_user: Dict[str, List[int]] = {}
+        for row, sub in enumerate(subscriptions):
+            rows_by_user.setdefault(sub.get("user_id"), []).append(row)
+        for user_id, intervals in vacations.items():
+            user_rows = rows_by_user.get(user_id)
+            if not user_rows:
+                continue
+            for vac_start, vac_end in intervals:
+                lo = np.searchsorted(days, np.datetime64(vac_start, "D").astype(np.int64), side="left")
+                hi = np.searchsorted(days, np.datetime64(vac_end, "D").astype(np.int64), side="right")
+                if lo < hi:
+                    quantities[np.array(user_rows)[:, None], np.arange(lo, hi)] = 0
+
+    return [str(d) for d in day_values], quantities
+
+# ===================== ORDER ROLLUPS =====================
+
+# order_rollups: one document per (admin_id, delivery_date) with order count and booked amount,
+# split by status ({"status": {"<status>": {"count", "amount"}}}), kept current with $inc on
+# every order create / delete / status change. Dashboards read these instead of raw orders.
+# order_totals holds one document, ALL_TIME_TOTALS, with the same fields summed over every
+# rollup, updated by the same hooks so all-time figures are one read rather than a full scan.
+ALL_TIME_TOTALS = "all"
+
+def rollup_key(order: dict) -> tuple:
+    return order.get("admin_id"), order.get("delivery_date") or "unknown"
+
+async def rollup_orders(database, orders: List[dict], sign: int = 1, session=None):
+    """Count orders being created (sign=1) or deleted (sign=-1) into their rollups."""
+    incs: Dict[tuple, Dict[str, float]] = {}
+    total: Dict[str, float] = {}
+    for o in orders:
+        inc = incs.setdefault(rollup_key(o), {})
+        status = o.get("status") or OrderStatus.UNASSIGNED.value
+        amount = sign * (o.get("total_amount") or 0)
+        for field, value in (
+            ("orders", sign), ("amount", amount),
+            (f"status.{status}.count", sign), (f"status.{status}.amount", amount)
+        ):
+            inc[field] = inc.get(field, 0) + value
+            total[field] = total.get(field, 0) + value
+    if not incs:
+        return
+    keys = list(incs)
+    try:
+        await database.order_rollups.bulk_write([
+            UpdateOne(
+                {"admin_id": admin_id, "date": day},
+                {"$inc": incs[(admin_id, day)], "$setOnInsert": {"admin_id": admin_id, "date": day}},
+                upsert=True
+            )
+            for admin_id, day in keys
+        ], ordered=False, session=session)
+    except BulkWriteError as e:
+        if session is None:
+            # No transaction to abort: take back the increments that did apply before re-raising
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            await _undo_rollup_incs(database, {k: incs[k] for i, k in enumerate(keys) if i not in failed})
+        raise
+    try:
+        await database.order_totals.update_one(
+            {"_id": ALL_TIME_TOTALS}, {"$inc": total}, upsert=True, session=session
+        )
+    except Exception:
+        if session is None:
+            await _undo_rollup_incs(database, incs)
+        raise
+
+async def _undo_rollup_incs(database, incs: Dict[tuple, Dict[str, float]]):
+    if incs:
+        await database.order_rollups.bulk_write([
+            UpdateOne({"admin_id": admin_id, "date": day}, {"$inc": {f: -v for f, v in inc.items()}})
+            for (admin_id, day), inc in incs.items()
+        ], ordered=False)
+
+async def rollup_status_change(order: dict, old_status: Optional[str], new_status: str):
+    """Move one order between status buckets of its rollup."""
+    old_status = old_status or OrderStatus.UNASSIGNED.value
+    if old_status == new_status:
+        return
+    admin_id, day = rollup_key(order)
+    amount = order.get("total_amount") or 0
+    inc = {
+        f"status.{old_status}.count": -1, f"status.{old_status}.amount": -amount,
+        f"status.{new_status}.count": 1, f"status.{new_status}.amount": amount
+    }
+    await db.order_rollups.update_one(
+        {"admin_id": admin_id, "date": day},
+        {"$inc": inc, "$setOnInsert": {"admin_id": admin_id, "date": day}},
+        upsert=True
+    )
+    await db.order_totals.update_one({"_id": ALL_TIME_TOTALS}, {"$inc": inc}, upsert=True)
+
+async def rebuild_order_rollups(database) -> Dict[str, int]:
+    """Recompute every rollup from the orders collection."""
+    rollups: Dict[tuple, dict] = {}
+    cursor = database.orders.aggregate([
+        {"$group": {
+            "_id": {"admin_id": "$admin_id", "date": "$delivery_date", "status": "$status"},
+            "count": {"$sum": 1},
+            "amount": {"$sum": "$total_amount"}
+        }}
+    ], allowDiskUse=True)
+    async for row in cursor:
+        key = (row["_id"].get("admin_id"), row["_id"].get("date") or "unknown")
+        status = row["_id"].get("status") or OrderStatus.UNASSIGNED.value
+        doc = rollups.setdefault(key, {"admin_id": key[0], "date": key[1], "orders": 0, "amount": 0, "status": {}})
+        doc["orders"] += row["count"]
+        doc["amount"] += row["amount"] or 0
+        bucket = doc["status"].setdefault(status, {"count": 0, "amount": 0})
+        bucket["count"] += row["count"]
+        bucket["amount"] += row["amount"] or 0
+
+    requests = [ReplaceOne({"admin_id": a, "date": d}, doc, upsert=True) for (a, d), doc in rollups.items()]
+    for i in range(0, len(requests), ORDER_WRITE_CHUNK):
+        await database.order_rollups.bulk_write(requests[i:i + ORDER_WRITE_CHUNK], ordered=False)
+    stale = await database.order_rollups.find({}, {"admin_id": 1, "date": 1}).to_list(None)
+    stale_ids = [r["_id"] for r in stale if (r.get("admin_id"), r.get("date")) not in rollups]
+    if stale_ids:
+        await database.order_rollups.delete_many({"_id": {"$in": stale_ids}})
+
+    totals = {"orders": 0, "amount": 0, "status": {}}
+    for doc in rollups.values():
+        totals["orders"] += doc["orders"]
+        totals["amount"] += doc["amount"]
+        for status, bucket in doc["status"].items():
+            total_bucket = totals["status"].setdefault(status, {"count": 0, "amount": 0})
+            total_bucket["count"] += bucket["count"]
+            total_bucket["amount"] += bucket["amount"]
+    await database.order_totals.replace_one({"_id": ALL_TIME_TOTALS}, totals, upsert=True)
+    return {"rollups": len(rollups), "removed": len(stale_ids)}
+
+@app.on_event("startup")
+async def build_order_rollups():
+    try:
+        missing = (
+            await db.order_rollups.estimated_document_count() == 0
+            or await db.order_totals.estimated_document_count() == 0
+        )
+        if missing and await db.orders.find_one({}, {"_id": 1}):
+            spawn_background(rebuild_order_rollups(db), "order rollup build")
+    except Exception:
+        logger.exception("❌ Could not start order rollup build")
+
+# ===================== ORDER ENDPOINTS =====================
+
+# Orders carry a snapshot of their customer's and rider's name/phone, written at creation or
+# assignment and refreshed on profile edits, so order lists don't need a users join
+ORDER_PEOPLE_FIELDS = (
+    ("user_id", "customer_name", "customer_phone"),
+    ("delivery_partner_id", "delivery_partner_name", "delivery_partner_phone"),
+)
+ORDER_SNAPSHOT_FIELDS = tuple(f for fields in ORDER_PEOPLE_FIELDS for f in fields)
+OPEN_ORDER_STATUSES = [
+    OrderStatus.UNASSIGNED.value, OrderStatus.PENDING.value, OrderStatus.ASSIGNED.value,
+    OrderStatus.PICKED_UP.value, OrderStatus.OUT_FOR_DELIVERY.value
+]
+
+def rider_snapshot(partner: dict) -> dict:
+    return {"delivery_partner_name": partner.get("name"), "delivery_partner_phone": partner.get("phone")}
+
+async def fill_order_snapshots(orders: List[dict]) -> List[dict]:
+    """Fill missing customer/rider snapshots from one batched users read and save them for next time."""
+    missing = {
+        o[id_field]
+        for o in orders
+        for id_field, name_field, _ in ORDER_PEOPLE_FIELDS
+        if o.get(id_field) and name_field not in o
+    }
+    if not missing:
+        return orders
+
+    people = {
+        u["id"]: u
+        async for u in db.users.find({"id": {"$in": list(missing)}}, {"_id": 0, "id": 1, "name": 1, "phone": 1})
+    }
+    backfill = []
+    for o in orders:
+        patch = {}
+        for id_field, name_field, phone_field in ORDER_PEOPLE_FIELDS:
+            person = people.get(o.get(id_field))
+            if person and name_field not in o:
+                patch[name_field] = person.get("name")
+                patch[phone_field] = person.get("phone")
+        if patch:
+            o.update(patch)
+            if "_id" in o:
+                backfill.append(UpdateOne({"_id": o["_id"]}, {"$set": patch}))
+    if backfill:
+        spawn_background(db.orders.bulk_write(backfill, ordered=False), "order snapshot backfill")
+    return orders
+
+async def refresh_order_snapshots(user: dict):
+    """Rewrite a user's name/phone on their open orders after a profile edit."""
+    for id_field, name_field, phone_field in ORDER_PEOPLE_FIELDS:
+        await db.orders.update_many(
+            {id_field: user["id"], "status": {"$in": OPEN_ORDER_STATUSES}},
+            {"$set": {name_field: user.get("name"), phone_field: user.get("phone")}}
+        )
+
+@api_router.get("/orders", response_class=JSONResponse, responses=page_responses(Order, OrderCard, Dict[str, Any]))
+async def get_orders(
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    user: User = Depends(get_current_user)
+):
+    selected = resolve_fields(fields, OrderCard, Order)
+    orders, next_cursor = await fetch_page(
+        db.orders, {"user_id": user.id}, limit, cursor, fields_projection(selected)
+    )
+    return page_response([render_order(o, fields, selected) for o in orders], next_cursor)
+
+CALENDAR_MAX_DAYS = int(os.environ.get("CALENDAR_MAX_DAYS", "62"))
+
+async def build_calendar(user_id: str, from_date: str, to_date: str) -> List[dict]:
+    """Per-day projected items for a customer, from one read each of subscriptions, vacations and products."""
+    subscriptions = await db.subscriptions.find(
+        {
+            "user_id": user_id,
+            "is_active": True,
+            "start_date": {"$lte": to_date},
+            "$or": [{"end_date": None}, {"end_date": {"$gte": from_date}}]
+        },
+        SUBSCRIPTION_SCHEDULE_FIELDS
+    ).to_list(None)
+    intervals = (await vacations_between(db, [user_id], from_date, to_date)).get(user_id, [])
+
+    days, quantities = build_delivery_schedule(subscriptions, from_date, to_date, {user_id: intervals})
+    products = {
+        p["id"]: p
+        async for p in db.products.find(
+            {"id": {"$in": list({s["product_id"] for s in subscriptions})}},
+            {"_id": 0, "id": 1, "name": 1, "price": 1, "unit": 1}
+        )
+    }
+
+    calendar = []
+    for col, day in enumerate(days):
+        items = []
+        for row in np.flatnonzero(quantities[:, col]):
+            sub = subscriptions[row]
+            product = products.get(sub["product_id"])
+            if not product:
+                continue
+            quantity = int(quantities[row, col])
+            items.append({
+                "subscription_id": sub["id"],
+                "product_id": product["id"],
+                "product_name": product["name"],
+                "unit": product.get("unit"),
+                "quantity": quantity,
+                "price": product["price"],
+                "total": product["price"] * quantity,
+                "modified": day in subscription_modifications(sub)
+            })
+        calendar.append({
+            "date": day,
+            "on_vacation": any(start <= day <= end for start, end in intervals),
+            "items": items,
+            "total": sum((item["total"] for item in items), 0.0)
+        })
+    return calendar
+
+@api_router.get("/orders/calendar")
+async def get_order_calendar(
+    request: Request,
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    user: User = Depends(get_current_user)):
+    """Projected deliveries per day with vacation flags and wallet shortfall"""
+    try:
+        start = (
+            datetime.strptime(from_date, "%Y-%m-%d") if from_date
+            else (now_ist() + timedelta(days=1)).replace(tzinfo=None)
+        )
+        end = datetime.strptime(to_date, "%Y-%m-%d") if to_date else start + timedelta(days=13)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from and to must be YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="to must not be before from")
+    if (end - start).days + 1 > CALENDAR_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Calendar range is limited to {CALENDAR_MAX_DAYS} days")
+    from_date, to_date = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+    key = (user.id, from_date, to_date)
+    calendar = calendar_cache.get(key)
+    if calendar is None:
+        calendar = await build_calendar(user.id, from_date, to_date)
+        calendar_cache.set(key, calendar)
+
+    wallet = await db.wallets.find_one({"user_id": user.id}, {"_id": 0, "balance": 1})
+    balance = wallet.get("balance", 0.0) if wallet else 0.0
+
+    # Running wallet projection: how much is missing by the end of each day
+    days = []
+    remaining = balance
+    first_shortfall_date = None
+    for day in calendar:
+        remaining -= day["total"]
+        shortfall = round(max(0.0, -remaining), 2)
+        if shortfall and first_shortfall_date is None:
+            first_shortfall_date = day["date"]
+        days.append({**day, "balance_after": round(remaining, 2), "shortfall": shortfall})
+
+    total = sum(day["total"] for day in calendar)
+    body, etag = json_body({
+        "from": from_date,
+        "to": to_date,
+        "days": days,
+        "total": total,
+        "wallet_balance": balance,
+        "shortfall": round(max(0.0, total - balance), 2),
+        "first_shortfall_date": first_shortfall_date
+    })
+    return etag_response(request, body, etag)
+
+@api_router.get("/orders/{order_id}", response_model=Order)
+async def get_order(order_id: str, user: User = Depends(get_current_user)):
+    order = await db.orders.find_one({"id": order_id, "user_id": user.id})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return Order(**order)
 
 @api_router.get("/orders/tomorrow/preview")
 async def preview_tomorrow_order(user: User = Depends(get_current_user)):
@@ -902,57 +2982,32 @@ async def preview_tomorrow_order(user: User = Depends(get_current_user)):
     subscriptions = await db.subscriptions.find({"user_id": user.id, "is_active": True}).to_list(100)
     
     # Check vacation dates
-    vacations = await db.vacations.find({"user_id": user.id}).to_list(100)
-    is_vacation = any(v["start_date"] <= tomorrow <= v["end_date"] for v in vacations)
-    
-    if is_vacation:
+    if await users_away_on(db, [user.id], tomorrow):
         return {"message": "You're on vacation tomorrow", "items": [], "total": 0}
     
     items = []
     total = 0.0
-    tomorrow_date = datetime.strptime(tomorrow, "%Y-%m-%d")
-    day_of_week = tomorrow_date.weekday()  # 0=Monday, 6=Sunday
-    
-    for sub in subscriptions:
-        # Check if subscription is valid for tomorrow
-        if sub.get("end_date") and sub["end_date"] < tomorrow:
-            continue
-        if sub["start_date"] > tomorrow:
-            continue
-            
-        # Check pattern
-        should_deliver = False
-        if sub["pattern"] == "daily":
-            should_deliver = True
-        elif sub["pattern"] == "alternate":
-            start = datetime.strptime(sub["start_date"], "%Y-%m-%d")
-            days_diff = (tomorrow_date - start).days
-            should_deliver = days_diff % 2 == 0
-        elif sub["pattern"] == "custom":
-            should_deliver = day_of_week in (sub.get("custom_days") or [])
-        elif sub["pattern"] == "buy_once":
-            should_deliver = sub["start_date"] == tomorrow
-        
-        if should_deliver:
-            product = await db.products.find_one({"id": sub["product_id"]})
-            if product:
-                # Check for date-specific modifications
-                quantity = sub["quantity"]
-                for mod in sub.get("modifications", []):
-                    if mod["date"] == tomorrow:
-                        quantity = mod["quantity"]
-                        break
-                
-                if quantity > 0:
-                    item_total = product["price"] * quantity
-                    items.append({
-                        "product_id": product["id"],
-                        "product_name": product["name"],
-                        "quantity": quantity,
-                        "price": product["price"],
-                        "total": item_total
-                    })
-                    total += item_total
+    _, quantities = build_delivery_schedule(subscriptions, tomorrow, tomorrow)
+    delivering = [(sub, int(q)) for sub, q in zip(subscriptions, quantities[:, 0]) if q > 0]
+
+    products = await db.products.find(
+        {"id": {"$in": list({sub["product_id"] for sub, _ in delivering})}},
+        {"_id": 0, "id": 1, "name": 1, "price": 1}
+    ).to_list(None)
+    products_by_id = {p["id"]: p for p in products}
+
+    for sub, quantity in delivering:
+        product = products_by_id.get(sub["product_id"])
+        if product:
+            item_total = product["price"] * quantity
+            items.append({
+                "product_id": product["id"],
+                "product_name": product["name"],
+                "quantity": quantity,
+                "price": product["price"],
+                "total": item_total
+            })
+            total += item_total
     
     # Check wallet balance
     wallet = await db.wallets.find_one({"user_id": user.id})
@@ -1026,18 +3081,18 @@ async def get_today_deliveries(partner: User = Depends(get_delivery_partner)):
         "delivery_partner_id": partner.id,
         "delivery_date": today,
         "admin_id": {"$in": assigned_admins},
-        "status": {"$in": ["pending", "assigned", "out_for_delivery"]}
+        "status": {"$in": ["pending", "assigned", "picked_up", "out_for_delivery"]}
     }).to_list(100)
     
-    # Get customer details for each order
+    # Customer details come from the order's snapshot (batched users read only for old orders)
+    await fill_order_snapshots(orders)
     result = []
     for order in orders:
-        customer = await db.users.find_one({"id": order["user_id"]})
-        result.append({
+        result.append(serialize_doc({
             **order,
-            "customer_name": customer["name"] if customer else "Unknown",
-            "customer_phone": customer.get("phone", "N/A") if customer else "N/A"
-        })
+            "customer_name": order.get("customer_name") or "Unknown",
+            "customer_phone": order.get("customer_phone") or "N/A"
+        }))
     
     return result
 
@@ -1047,62 +3102,11 @@ async def complete_delivery(delivery: DeliveryComplete, partner: User = Depends(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found or not assigned to you")
 
-    await db.orders.update_one(
-        {"id": delivery.order_id},
-        {"$set": {"status": OrderStatus.DELIVERED.value, "delivered_at": now_ist().isoformat()}}
-    )
-
-    # ── AUTO WALLET TRANSFER ──
-    amount = order.get("total_amount", 0)
-    user_id = order.get("user_id")
-    admin_id = order.get("admin_id")
-
-    if amount > 0 and user_id and admin_id:
-        # Deduct from customer
-        customer_wallet = await db.wallets.find_one({"user_id": user_id})
-        if not customer_wallet:
-            customer_wallet = {"user_id": user_id, "balance": 0.0, "transactions": []}
-            await db.wallets.insert_one(customer_wallet)
-
-        customer_new_balance = customer_wallet.get("balance", 0.0) - amount
-        await db.wallets.update_one(
-            {"user_id": user_id},
-            {
-                "$set": {"balance": customer_new_balance},
-                "$push": {"transactions": {
-                    "id": str(uuid.uuid4()),
-                    "user_id": user_id,
-                    "amount": amount,
-                    "type": "debit",
-                    "description": f"Order delivered - {', '.join([i['product_name'] for i in order.get('items', [])])}",
-                    "balance_after": customer_new_balance,
-                    "created_at": datetime.utcnow().isoformat()
-                }}
-            }
-        )
-
-        # Credit to admin
-        admin_wallet = await db.wallets.find_one({"user_id": admin_id})
-        if not admin_wallet:
-            admin_wallet = {"user_id": admin_id, "balance": 0.0, "transactions": []}
-            await db.wallets.insert_one(admin_wallet)
-
-        admin_new_balance = admin_wallet.get("balance", 0.0) + amount
-        await db.wallets.update_one(
-            {"user_id": admin_id},
-            {
-                "$set": {"balance": admin_new_balance},
-                "$push": {"transactions": {
-                    "id": str(uuid.uuid4()),
-                    "user_id": admin_id,
-                    "amount": amount,
-                    "type": "credit",
-                    "description": f"Order delivered to {order.get('customer_name', 'Customer')}",
-                    "balance_after": admin_new_balance,
-                    "created_at": datetime.utcnow().isoformat()
-                }}
-            }
-        )
+    # ── AUTO WALLET TRANSFER ── (same transaction as the status flip)
+    if await deliver_order(order, {"id": delivery.order_id}) is None:
+        return {"message": "Delivery already completed"}
+    if delivery.proof_image:
+        await attach_delivery_proof(delivery.order_id, delivery.proof_image)
 
     return {"message": "Delivery marked as complete"}
 
@@ -1141,76 +3145,20 @@ async def update_delivery_status(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    await db.orders.update_one(
-        {"_id": ObjectId(data.order_id)},
-        {"$set": {"status": data.status, "delivered_at": now_ist().isoformat()}}
-    )
-
-    # ── AUTO WALLET TRANSFER ON DELIVERY ──
-    if data.status == "delivered":
-        user_id = order.get("user_id")
-        admin_id = order.get("admin_id")
-        amount = order.get("total_amount", 0)
-
-        if amount > 0 and user_id and admin_id:
-
-            # ── 1. DEDUCT FROM CUSTOMER WALLET ──
-            customer_wallet = await db.wallets.find_one({"user_id": user_id})
-
-            if not customer_wallet:
-                customer_wallet = {"user_id": user_id, "balance": 0.0, "transactions": []}
-                await db.wallets.insert_one(customer_wallet)
-
-            customer_old_balance = customer_wallet.get("balance", 0.0)
-            customer_new_balance = customer_old_balance - amount
-
-            customer_tx = {
-                "id": str(uuid.uuid4()),
-                "user_id": user_id,
-                "amount": amount,
-                "type": "debit",
-                "description": f"Order delivered - {', '.join([i['product_name'] for i in order.get('items', [])])}",
-                "balance_after": customer_new_balance,
-                "created_at": datetime.utcnow().isoformat()
-            }
-
-            await db.wallets.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {"balance": customer_new_balance},
-                    "$push": {"transactions": customer_tx}
-                }
-            )
-
-            # ── 2. CREDIT TO ADMIN WALLET ──
-            admin_wallet = await db.wallets.find_one({"user_id": admin_id})
-
-            if not admin_wallet:
-                admin_wallet = {"user_id": admin_id, "balance": 0.0, "transactions": []}
-                await db.wallets.insert_one(admin_wallet)
+    # ── AUTO WALLET TRANSFER ON DELIVERY ── (a repeated "delivered" update charges nothing)
+    if data.status == OrderStatus.DELIVERED:
+        await deliver_order(order, {"_id": order["_id"]})
+        return {"message": "Status updated successfully"}
 
-            admin_old_balance = admin_wallet.get("balance", 0.0)
-            admin_new_balance = admin_old_balance + amount
-
-            admin_tx = {
-                "id": str(uuid.uuid4()),
-                "user_id": admin_id,
-                "amount": amount,
-                "type": "credit",
-                "description": f"Order delivered to {order.get('customer_name', 'Customer')} - {', '.join([i['product_name'] for i in order.get('items', [])])}",
-                "balance_after": admin_new_balance,
-                "created_at": datetime.utcnow().isoformat()
-            }
-
-            await db.wallets.update_one(
-                {"user_id": admin_id},
-                {
-                    "$set": {"balance": admin_new_balance},
-                    "$push": {"transactions": admin_tx}
-                }
-            )
-
-            logger.info(f"✅ Wallet transfer: ₹{amount} from customer {user_id} → admin {admin_id}")
+    # A delivered order has been charged; it cannot go back to an earlier status
+    before = await db.orders.find_one_and_update(
+        {"_id": order["_id"], "status": {"$ne": OrderStatus.DELIVERED.value}},
+        {"$set": {"status": data.status.value, "delivered_at": now_ist().isoformat()}},
+        projection={"status": 1}
+    )
+    if before is None:
+        raise HTTPException(status_code=400, detail="Order is already delivered")
+    await rollup_status_change(order, before.get("status"), data.status.value)
 
     return {"message": "Status updated successfully"}
 
@@ -1229,7 +3177,8 @@ async def accept_order(
             "$set": {
                 "delivery_partner_id": partner.id,
                 "status": OrderStatus.ASSIGNED.value,
-                "accepted_at": now_ist().isoformat()
+                "accepted_at": now_ist().isoformat(),
+                **rider_snapshot(partner.dict())
             }
         }
     )
@@ -1239,6 +3188,7 @@ async def accept_order(
             status_code=400,
             detail="Order already accepted or not available for you"
         )
+    await rollup_status_change(result, OrderStatus.UNASSIGNED.value, OrderStatus.ASSIGNED.value)
 
     return {"message": "Order accepted"}
 
@@ -1272,27 +3222,35 @@ async def reject_order(
 
     return {"message": "Order hidden from rider"}
 
-@api_router.get("/delivery/available")
-async def get_available_orders(partner: User = Depends(get_delivery_partner)):
+@api_router.get("/delivery/available", response_class=JSONResponse, responses=page_responses(Dict[str, Any]))
+async def get_available_orders(
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    partner: User = Depends(get_delivery_partner)
+):
 
     assigned_admins = getattr(partner, "assigned_admin_ids", [])
 
     if not assigned_admins:
         return []
 
-    orders = await db.orders.find({
+    orders, next_cursor = await fetch_page(db.orders, {
         "admin_id": {"$in": assigned_admins},
         "status": OrderStatus.UNASSIGNED.value
-    }).to_list(100)
+    }, limit, cursor)
 
-    return [serialize_order_public(o) for o in orders]
+    return page_response([serialize_order_public(o) for o in orders], next_cursor)
 
-@api_router.get("/delivery/my-orders")
-async def get_my_orders(partner: User = Depends(get_delivery_partner)):
+@api_router.get("/delivery/my-orders", response_class=JSONResponse, responses=page_responses(Dict[str, Any]))
+async def get_my_orders(
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    partner: User = Depends(get_delivery_partner)
+):
 
-    orders = await db.orders.find({
+    orders, next_cursor = await fetch_page(db.orders, {
         "delivery_partner_id": partner.id
-    }).to_list(100)
+    }, limit, cursor)
 
     result = []
 
@@ -1318,24 +3276,432 @@ async def get_my_orders(partner: User = Depends(get_delivery_partner)):
 
         result.append(serialize_order_public(o))
 
-    return result
+    return page_response(result, next_cursor)
+
+# ===================== SEARCH =====================
+
+# One search_index document per product / customer / order. Every search term is stored once per
+# scope ("<admin_id>|term" and "*|term" for superadmins), so a lookup is a single index probe.
+SEARCH_MAX_PREFIX = 20
+SEARCH_KINDS = ("product", "customer", "order")
+
+def search_words(*values) -> List[str]:
+    words = []
+    for value in values:
+        if value:
+            words += re.findall(r"[a-z0-9]+", str(value).lower())
+    return words
+
+def search_prefixes(words: List[str], min_length: int = 1) -> set:
+    terms = set()
+    for word in words:
+        for n in range(min_length, min(len(word), SEARCH_MAX_PREFIX) + 1):
+            terms.add(word[:n])
+    return terms
+
+def search_entry(kind: str, ref_id: str, admin_ids: List[str], terms: set, label: str, subtitle: Optional[str]) -> dict:
+    scopes = [a for a in admin_ids if a] + ["*"]
+    return {
+        "_id": f"{kind}:{ref_id}",
+        "kind": kind,
+        "ref_id": ref_id,
+        "admin_ids": [a for a in admin_ids if a],
+        "label": label,
+        "subtitle": subtitle,
+        "tokens": sorted(f"{scope}|{term}" for scope in scopes for term in terms),
+    }
+
+def product_search_entry(product: dict) -> dict:
+    terms = search_prefixes(search_words(product.get("name")))
+    return search_entry(
+        "product", product["id"], [product.get("admin_id")], terms,
+        product.get("name", ""), product.get("category")
+    )
+
+def customer_search_entry(user: dict, admin_ids: List[str]) -> dict:
+    terms = search_prefixes(search_words(user.get("name"), user.get("email"), user.get("phone")))
+    return search_entry(
+        "customer", user["id"], admin_ids, terms,
+        user.get("name", ""), user.get("email")
+    )
+
+def order_search_entry(order: dict) -> dict:
+    # ids are only searched from their 4th character on to keep the index small
+    terms = search_prefixes(search_words(order["id"].split("-")[0]), min_length=4)
+    terms.update(search_words(order["id"], order.get("_id"), order.get("delivery_otp")))
+    return search_entry(
+        "order", order["id"], [order.get("admin_id")], terms,
+        f"Order {order['id'][:8]}", f"{order.get('customer_name') or ''} · {order.get('delivery_date')}"
+    )
+
+async def index_search_entry(entry: dict):
+    await db.search_index.replace_one({"_id": entry["_id"]}, entry, upsert=True)
+
+async def index_search_entries(entries: List[dict]):
+    if entries:
+        await db.search_index.bulk_write(
+            [ReplaceOne({"_id": e["_id"]}, e, upsert=True) for e in entries], ordered=False
+        )
+
+async def remove_search_entry(kind: str, ref_id: str):
+    await db.search_index.delete_one({"_id": f"{kind}:{ref_id}"})
+
+async def remove_search_entries(kind: str, ref_ids: List[str]):
+    if ref_ids:
+        await db.search_index.delete_many({"_id": {"$in": [f"{kind}:{r}" for r in ref_ids]}})
+
+async def index_customer(user: dict, admin_id: Optional[str] = None):
+    """(Re)index a customer, keeping the admins they already buy from."""
+    existing = await db.search_index.find_one({"_id": f"customer:{user['id']}"}, {"admin_ids": 1})
+    admin_ids = existing["admin_ids"] if existing else []
+    if admin_id and admin_id not in admin_ids:
+        admin_ids = admin_ids + [admin_id]
+    await index_search_entry(customer_search_entry(user, admin_ids))
+
+async def link_customer_to_admin(user: User, admin_id: str):
+    linked = await db.search_index.find_one(
+        {"_id": f"customer:{user.id}", "admin_ids": admin_id}, {"_id": 1}
+    )
+    if not linked:
+        await index_customer(user.dict(), admin_id)
+
+async def rebuild_search_index() -> Dict[str, int]:
+    counts = {kind: 0 for kind in SEARCH_KINDS}
+    await db.search_index.delete_many({})
+
+    async def flush(batch):
+        # upserts, so writes indexed while the rebuild runs are not duplicate-key errors
+        if batch:
+            await db.search_index.bulk_write(
+                [ReplaceOne({"_id": entry["_id"]}, entry, upsert=True) for entry in batch], ordered=False
+            )
+        return []
+
+    batch = []
+    async for product in db.products.find({}, {"id": 1, "name": 1, "admin_id": 1, "category": 1}):
+        batch.append(product_search_entry(product))
+        counts["product"] += 1
+        if len(batch) >= 1000:
+            batch = await flush(batch)
+
+    customer_admins = {
+        row["_id"]: row["admin_ids"]
+        async for row in db.subscriptions.aggregate([
+            {"$group": {"_id": "$user_id", "admin_ids": {"$addToSet": "$admin_id"}}}
+        ])
+    }
+    async for user in db.users.find({"role": UserRole.CUSTOMER.value}, {"id": 1, "name": 1, "email": 1, "phone": 1}):
+        batch.append(customer_search_entry(user, customer_admins.get(user["id"], [])))
+        counts["customer"] += 1
+        if len(batch) >= 1000:
+            batch = await flush(batch)
+
+    async for order in db.orders.find({}, {"id": 1, "admin_id": 1, "delivery_otp": 1, "customer_name": 1, "delivery_date": 1}):
+        batch.append(order_search_entry(order))
+        counts["order"] += 1
+        if len(batch) >= 1000:
+            batch = await flush(batch)
+
+    await flush(batch)
+    return counts
+
+@app.on_event("startup")
+async def build_search_index():
+    try:
+        if await db.search_index.estimated_document_count() == 0 and (
+            await db.products.find_one({}, {"_id": 1}) or await db.users.find_one({"role": UserRole.CUSTOMER.value}, {"_id": 1})
+        ):
+            spawn_background(rebuild_search_index(), "search index build")
+    except Exception:
+        logger.exception("❌ Could not start search index build")
+
+@api_router.get("/search")
+async def search(
+    q: str,
+    kind: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    user: User = Depends(get_admin_or_superadmin_user)
+):
+    if kind and kind not in SEARCH_KINDS:
+        raise HTTPException(status_code=400, detail="Unknown search kind")
+    words = [w[:SEARCH_MAX_PREFIX] for w in search_words(q)]
+    if not words:
+        return []
+
+    scope = "*" if user.role == UserRole.SUPERADMIN else user.id
+    query = {"tokens": {"$all": [f"{scope}|{w}" for w in words]}}
+    if kind:
+        query["kind"] = kind
+
+    hits = await db.search_index.find(
+        query, {"_id": 0, "kind": 1, "ref_id": 1, "label": 1, "subtitle": 1}
+    ).limit(limit).to_list(limit)
+    return [
+        {"kind": h["kind"], "id": h["ref_id"], "label": h["label"], "subtitle": h.get("subtitle")}
+        for h in hits
+    ]
+
+# ===================== EXPORTS =====================
+
+# Order exports stream straight from a Mongo cursor through a gzip compressor; memory use is
+# one cursor batch plus one output chunk, whatever the number of rows
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_COLUMNS = [
+    "id", "delivery_date", "status", "admin_id", "admin_name", "user_id", "customer_name", "customer_phone",
+    "delivery_partner_id", "delivery_partner_name", "subscription_id", "items", "total_amount",
+    "created_at", "delivered_at"
+]
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def export_query(
+    admin_id: Optional[str],
+    status: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str]
+) -> dict:
+    query = {}
+    if admin_id:
+        query["admin_id"] = admin_id
+    if status:
+        query["status"] = status.lower()
+    for op, value in (("$gte", start_date), ("$lte", end_date)):
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="start_date and end_date must be YYYY-MM-DD")
+            query.setdefault("delivery_date", {})[op] = value
+    return query
+
+def export_csv_row(order: dict) -> dict:
+    row = {c: order.get(c) for c in EXPORT_COLUMNS}
+    row["items"] = "; ".join(f"{i.get('product_name')} x {i.get('quantity')}" for i in order.get("items") or [])
+    return row
+
+async def stream_orders_export(query: dict, fmt: str):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip framing
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    if fmt == "csv":
+        writer.writeheader()
+
+    projection = {"_id": 0, **{c: 1 for c in EXPORT_COLUMNS}}
+    async for order in db.orders.find(query, projection).batch_size(EXPORT_BATCH_SIZE):
+        if fmt == "csv":
+            writer.writerow(export_csv_row(order))
+        else:
+            buffer.write(json.dumps(jsonable_encoder(order), separators=(",", ":")) + "\n")
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            chunk = compressor.compress(buffer.getvalue().encode())
+            buffer.seek(0)
+            buffer.truncate()
+            if chunk:
+                yield chunk
+    yield compressor.compress(buffer.getvalue().encode()) + compressor.flush()
+
+def export_response(query: dict, fmt: str, name: str) -> StreamingResponse:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    filename = f"{name}-{now_ist().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return StreamingResponse(
+        stream_orders_export(query, fmt),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={
+            "Content-Encoding": "gzip",
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store"
+        }
+    )
+
+# ===================== FINANCE REPORTS =====================
+
+async def finance_report(query: dict) -> dict:
+    """Revenue totals plus per-day and per-product breakdowns, grouped inside Mongo."""
+    facets = await db.orders.aggregate([
+        {"$match": query},
+        {"$facet": {
+            "totals": [
+                {"$group": {"_id": None, "revenue": {"$sum": "$total_amount"}, "orders": {"$sum": 1}}}
+            ],
+            "by_date": [
+                {"$group": {
+                    "_id": {"$ifNull": ["$delivery_date", "unknown"]},
+                    "revenue": {"$sum": "$total_amount"},
+                    "orders": {"$sum": 1}
+                }},
+                {"$sort": {"_id": 1}}
+            ],
+            "by_product": [
+                {"$unwind": "$items"},
+                # one row per (order, product) first, so an order with several lines of the same
+                # product counts once in "orders"
+                {"$group": {
+                    "_id": {"order": "$_id", "product": "$items.product_id"},
+                    "product_name": {"$first": "$items.product_name"},
+                    "quantity": {"$sum": "$items.quantity"},
+                    "revenue": {"$sum": {"$multiply": ["$items.price", "$items.quantity"]}}
+                }},
+                {"$group": {
+                    "_id": "$_id.product",
+                    "product_name": {"$first": "$product_name"},
+                    "quantity": {"$sum": "$quantity"},
+                    "revenue": {"$sum": "$revenue"},
+                    "orders": {"$sum": 1}
+                }},
+                {"$sort": {"revenue": -1}}
+            ]
+        }}
+    ], allowDiskUse=True).to_list(1)
+    facets = facets[0] if facets else {"totals": [], "by_date": [], "by_product": []}
+    totals = facets["totals"][0] if facets["totals"] else {"revenue": 0, "orders": 0}
+    return {
+        "total_revenue": totals["revenue"],
+        "total_orders": totals["orders"],
+        "by_date": {row["_id"]: {"revenue": row["revenue"], "orders": row["orders"]} for row in facets["by_date"]},
+        "by_product": [
+            {
+                "product_id": row["_id"],
+                "product_name": row.get("product_name"),
+                "quantity": row["quantity"],
+                "revenue": row["revenue"],
+                "orders": row["orders"]
+            }
+            for row in facets["by_product"]
+        ]
+    }
 
 # ===================== SUPERADMIN ENDPOINTS =====================
 
-@api_router.get("/superadmin/users")
+@api_router.get("/superadmin/users", response_class=JSONResponse, responses=page_responses(UserResponse))
 async def get_users_for_superadmin(
     role: Optional[UserRole] = None,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
     superadmin: User = Depends(get_superadmin_user)
 ):
     query = {}
     if role:
         query["role"] = role.value
 
-    users = await db.users.find(query, {"password": 0}).to_list(1000)
-    return [
+    users, next_cursor = await fetch_page(db.users, query, limit, cursor, {"password": 0})
+    return page_response([
         UserResponse(**u)
         for u in users
-    ]
+    ], next_cursor)
+
+@api_router.get("/superadmin/cache-stats")
+async def get_cache_stats(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    return {
+        "users": user_cache.stats(),
+        "catalog": catalog_cache.stats(),
+        "calendar": calendar_cache.stats(),
+        "dashboard": dashboard_cache.stats()
+    }
+
+@api_router.post("/superadmin/migrations/product-images")
+async def run_product_image_migration(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    result = await migrate_product_images()
+    logger.info(f"✅ Product image migration: {result}")
+    return result
+
+@api_router.get("/superadmin/wallets/{user_id}/statement")
+async def get_wallet_statement_for_superadmin(
+    user_id: str,
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    superadmin: User = Depends(get_superadmin_user)
+):
+    from_date, to_date = statement_range(from_date, to_date)
+    return await wallet_statement(user_id, from_date, to_date)
+
+@api_router.post("/superadmin/wallet-snapshots/rebuild")
+async def run_wallet_snapshot_rebuild(
+    user_id: Optional[str] = None,
+    superadmin: User = Depends(get_superadmin_user)
+):
+    result = await rebuild_wallet_snapshots(user_id)
+    logger.info(f"✅ Wallet snapshot rebuild: {result}")
+    return result
+
+@api_router.post("/superadmin/rollups/rebuild")
+async def run_order_rollup_rebuild(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    result = await rebuild_order_rollups(db)
+    logger.info(f"✅ Order rollup rebuild: {result}")
+    return result
+
+@api_router.post("/superadmin/settlements/run")
+async def run_settlement(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    return await settle_admin_credits()
+
+@api_router.get("/superadmin/settlements/reconcile")
+async def get_settlement_reconciliation(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    return await reconcile_settlements()
+
+@api_router.post("/superadmin/migrations/wallet-transactions")
+async def run_wallet_transaction_migration(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    result = await migrate_wallet_transactions()
+    logger.info(f"✅ Wallet transaction migration: {result}")
+    return result
+
+@api_router.post("/superadmin/search/rebuild")
+async def run_search_rebuild(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    result = await rebuild_search_index()
+    logger.info(f"✅ Search index rebuilt: {result}")
+    return result
+
+@api_router.get("/superadmin/indexes/report")
+async def get_index_report(
+    superadmin: User = Depends(get_superadmin_user)
+):
+    usage = {}
+    for collection_name in INDEXES:
+        stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        usage[collection_name] = [
+            {
+                "name": s["name"],
+                "ops": s.get("accesses", {}).get("ops", 0),
+                "since": s.get("accesses", {}).get("since")
+            }
+            for s in stats
+        ]
+
+    queries = []
+    for name, collection_name, query, sort in HOT_QUERIES:
+        find_cmd = {"find": collection_name, "filter": query}
+        if sort:
+            find_cmd["sort"] = dict(sort)
+        explain = await db.command("explain", find_cmd, verbosity="queryPlanner")
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning_plan)
+        queries.append({
+            "query": name,
+            "collection": collection_name,
+            "stages": stages,
+            "indexes": _plan_index_names(winning_plan),
+            "collection_scan": "COLLSCAN" in stages,
+            "in_memory_sort": "SORT" in stages
+        })
+
+    return {
+        "index_usage": usage,
+        "queries": queries,
+        "regressions": [q["query"] for q in queries if q["collection_scan"] or q["in_memory_sort"]]
+    }
 
 @api_router.get("/superadmin/dashboard")
 async def superadmin_dashboard(
@@ -1345,24 +3711,55 @@ async def superadmin_dashboard(
     total_admins = await db.users.count_documents({"role": "admin" })
     total_delivery_partners = await db.users.count_documents({"role": "delivery_partner" })
     active_delivery_partners = await db.users.count_documents({"role": "delivery_partner","is_active": True })
-    total_orders = await db.orders.count_documents({})
+
+    # Order figures come from order_rollups: a few hundred small docs instead of every order
+    today = now_ist().date()
+    trend_start = today - timedelta(days=DASHBOARD_TREND_DAYS - 1)
+    week_start = (today - timedelta(days=6)).isoformat()
+    month_start = today.replace(day=1).isoformat()
+    since = min(trend_start.isoformat(), month_start)
+    totals = await db.order_totals.find_one({"_id": ALL_TIME_TOTALS}) or {}
+    recent = await db.order_rollups.find(
+        {"date": {"$gte": since, "$lte": today.isoformat()}},
+        {"_id": 0, "date": 1, "orders": 1, "status": 1}
+    ).to_list(None)
+
+    by_status = {status: row for status, row in (totals.get("status") or {}).items() if row.get("count")}
+    delivered = OrderStatus.DELIVERED.value
+    days: Dict[str, Dict[str, float]] = {}
+    for r in recent:
+        day = days.setdefault(r["date"], {"orders": 0, "open": 0, "delivered": 0, "revenue": 0.0})
+        statuses = r.get("status") or {}
+        day["orders"] += r.get("orders", 0)
+        day["open"] += sum(statuses.get(s, {}).get("count", 0) for s in OPEN_ORDER_STATUSES)
+        day["delivered"] += statuses.get(delivered, {}).get("count", 0)
+        day["revenue"] += statuses.get(delivered, {}).get("amount", 0)
+    empty = {"orders": 0, "open": 0, "delivered": 0, "revenue": 0.0}
+    today_stats = days.get(today.isoformat(), empty)
 
     return {
         "total_customers": total_customers,
         "total_admins": total_admins,
         "total_delivery_partners": total_delivery_partners,
         "active_delivery_partners": active_delivery_partners,
-        "total_orders": total_orders,
-        # frontend safety
-        "today_orders": 0,
-        "pending_orders": 0,
-        "delivered_today": 0,
-        "total_revenue": 0,
-        "today_revenue": 0,
-        "week_revenue": 0,
-        "month_revenue": 0,
-        "revenue_trend": [],
-        "orders_by_status": []
+        "total_orders": sum(row["count"] for row in by_status.values()),
+        "today_orders": today_stats["orders"],
+        "pending_orders": today_stats["open"],
+        "delivered_today": today_stats["delivered"],
+        "total_revenue": by_status.get(delivered, {}).get("amount", 0),
+        "today_revenue": today_stats["revenue"],
+        "week_revenue": sum((d["revenue"] for k, d in days.items() if k >= week_start), 0.0),
+        "month_revenue": sum((d["revenue"] for k, d in days.items() if k >= month_start), 0.0),
+        "revenue_trend": [
+            {"date": day, "orders": days.get(day, empty)["orders"], "revenue": days.get(day, empty)["revenue"]}
+            for day in (
+                (trend_start + timedelta(days=i)).isoformat() for i in range(DASHBOARD_TREND_DAYS)
+            )
+        ],
+        "orders_by_status": sorted(
+            ({"status": s, "count": row["count"], "amount": row["amount"]} for s, row in by_status.items()),
+            key=lambda row: -row["count"]
+        )
     }
 
 @api_router.put("/superadmin/products/{product_id}/status")
@@ -1379,6 +3776,7 @@ async def update_product_status(
         raise HTTPException(404, "Product not found")
 
     product = await db.products.find_one({"id": product_id})
+    await invalidate_catalog(product.get("admin_id"))
     return serialize_product(product)
 
 @api_router.put("/superadmin/users/{user_id}/status")
@@ -1390,6 +3788,7 @@ async def toggle_user_status(
     result = await db.users.update_one(
         {"id": user_id},
         {"$set": {"is_active": body.is_active}} )
+    await invalidate_user(user_id)
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1407,18 +3806,23 @@ async def update_user_role(
     result = await db.users.update_one(
         {"id": user_id},
         {"$set": {"role": role.value}})
+    await invalidate_user(user_id)
 
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
 
     return {"message": "User role updated"}
 
-@api_router.get("/superadmin/orders")
+@api_router.get("/superadmin/orders", response_class=JSONResponse, responses=page_responses(OrderCard, Dict[str, Any]))
 async def get_all_orders_for_superadmin(
     admin_id: Optional[str] = None,
     status: Optional[str] = None,
     date: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     superadmin: User = Depends(get_superadmin_user)):
+    selected = resolve_fields(fields, OrderCard, Order)
     query = {}
 
     # ✅ Filter by Admin
@@ -1431,39 +3835,46 @@ async def get_all_orders_for_superadmin(
     if date:
         query["delivery_date"] = date
 
-    orders = await db.orders.find(query).to_list(1000)
+    orders, next_cursor = await fetch_page(db.orders, query, limit, cursor, fields_projection(selected))
+
+    return page_response(
+        [render_order(serialize_order(o), fields, selected, full=dict) for o in orders],
+        next_cursor
+    )
 
-    return [serialize_order(o) for o in orders]
+@api_router.get("/superadmin/orders/export")
+async def export_orders_for_superadmin(
+    format: str = "ndjson",
+    admin_id: Optional[str] = None,
+    status: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    superadmin: User = Depends(get_superadmin_user)):
+    """Every matching order as gzip-compressed NDJSON or CSV, with no row cap"""
+    return export_response(export_query(admin_id, status, start_date, end_date), format, "orders")
 
-#----- superadmin order genarte erased
+@api_router.post("/superadmin/orders/generate")
+async def generate_orders_for_superadmin(
+    date: Optional[str] = None,
+    dry_run: bool = False,
+    superadmin: User = Depends(get_superadmin_user)):
+    target_date = date or now_ist().strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(target_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+    return await generate_orders_for_date(db, target_date, dry_run=dry_run)
 
 @api_router.get("/superadmin/revenue")
 async def get_revenue_for_superadmin(
     start_date: date,
     end_date: date,
+    admin_id: Optional[str] = None,
     superadmin: User = Depends(get_superadmin_user)
 ):
-    pipeline = [
-        {
-            "$match": {
-                "created_at": {
-                    "$gte": datetime.combine(start_date, datetime.min.time()),
-                    "$lte": datetime.combine(end_date, datetime.max.time())
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "total_revenue": {"$sum": "$total_amount"}
-            }
-        }
-    ]
-
-    result = await db.orders.aggregate(pipeline).to_list(1)
-    return {
-        "total_revenue": result[0]["total_revenue"] if result else 0
-    }
+    # Revenue is booked on the delivery day, same as the admin finance report
+    query = export_query(admin_id, OrderStatus.DELIVERED.value, start_date.isoformat(), end_date.isoformat())
+    return await finance_report(query)
 
 @api_router.put("/superadmin/riders/{rider_id}/assign-admins")
 async def assign_rider_admins(
@@ -1473,6 +3884,7 @@ async def assign_rider_admins(
     result = await db.users.update_one(
         {"id": rider_id, "role": "delivery_partner"},
         {"$set": {"assigned_admin_ids": body.assigned_admin_ids}})
+    await invalidate_user(rider_id)
 
     if result.matched_count == 0:
         raise HTTPException(404, "Rider not found")
@@ -1487,6 +3899,7 @@ async def assign_zone(
     result = await db.users.update_one(
         {"id": user_id},
         {"$set": {"zone": body.zone}})
+    await invalidate_user(user_id)
 
     if result.matched_count == 0:
         raise HTTPException(404, "User not found")
@@ -1538,6 +3951,7 @@ async def verify_user(
         {"id": user_id},
         {"$set": {"is_verified": body.is_verified}}
     )
+    await invalidate_user(user_id)
 
     if result.matched_count == 0:
         raise HTTPException(404, "User not found")
@@ -1558,6 +3972,8 @@ async def delete_user(
         raise HTTPException(400, "Cannot delete superadmin")
 
     await db.users.delete_one({"id": user_id})
+    await invalidate_user(user_id)
+    await remove_search_entry("customer", user_id)
 
     return {"message": "User deleted"}
 
@@ -1572,7 +3988,7 @@ async def create_rider(
 
     rider_dict = rider.dict()
     rider_dict["id"] = str(uuid.uuid4())
-    rider_dict["password"] = get_password_hash(rider.password)
+    rider_dict["password"] = await get_password_hash_async(rider.password)
     rider_dict["role"] = UserRole.DELIVERY_PARTNER.value
     rider_dict["is_active"] = True
     rider_dict["is_verified"] = False
@@ -1593,6 +4009,7 @@ async def toggle_user_verify(
         {"id": user_id},
         {"$set": {"is_verified": body.is_verified}}
     )
+    await invalidate_user(user_id)
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1604,25 +4021,43 @@ async def toggle_user_verify(
 @api_router.get("/admin/dashboard")
 async def admin_dashboard(admin: User = Depends(get_admin_user)):
     today = now_ist().strftime("%Y-%m-%d")
-    
-    # Get stats
-    total_customers = await db.users.count_documents({"role": "customer"})
-    total_partners = await db.users.count_documents({"role": "delivery_partner"})
-    active_subscriptions = await db.subscriptions.count_documents({"is_active": True})
-    today_orders = await db.orders.count_documents({"delivery_date": today})
-    delivered_today = await db.orders.count_documents({"delivery_date": today, "status": "delivered"})
-    
-    # Calculate today's revenue
-    today_orders_list = await db.orders.find({"delivery_date": today, "status": "delivered"}).to_list(1000)
-    today_revenue = sum(o.get("total_amount", 0) for o in today_orders_list)
-    
-    return {
-        "total_customers": total_customers,
+    cached = dashboard_cache.get((admin.id, today))
+    if cached is not None:
+        return cached
+
+    # Three independent reads, all scoped to this dairy, run concurrently
+    order_stats, subscription_stats, total_partners = await asyncio.gather(
+        db.orders.aggregate([
+            {"$match": {"admin_id": admin.id, "delivery_date": today}},
+            {"$facet": {
+                "today": [{"$count": "count"}],
+                "delivered": [
+                    {"$match": {"status": OrderStatus.DELIVERED.value}},
+                    {"$group": {"_id": None, "count": {"$sum": 1}, "revenue": {"$sum": "$total_amount"}}}
+                ]
+            }}
+        ]).to_list(1),
+        db.subscriptions.aggregate([
+            {"$match": {"admin_id": admin.id}},
+            {"$facet": {
+                "active": [{"$match": {"is_active": True}}, {"$count": "count"}],
+                "customers": [{"$group": {"_id": "$user_id"}}, {"$count": "count"}]
+            }}
+        ]).to_list(1),
+        db.users.count_documents({"role": UserRole.DELIVERY_PARTNER.value, "assigned_admin_ids": admin.id})
+    )
+    orders, subscriptions = order_stats[0], subscription_stats[0]
+    delivered = orders["delivered"][0] if orders["delivered"] else {"count": 0, "revenue": 0}
+
+    stats = {
+        "total_customers": subscriptions["customers"][0]["count"] if subscriptions["customers"] else 0,
         "total_delivery_partners": total_partners,
-        "active_subscriptions": active_subscriptions,
-        "today_orders": today_orders,
-        "delivered_today": delivered_today,
-        "today_revenue": today_revenue }
+        "active_subscriptions": subscriptions["active"][0]["count"] if subscriptions["active"] else 0,
+        "today_orders": orders["today"][0]["count"] if orders["today"] else 0,
+        "delivered_today": delivered["count"],
+        "today_revenue": delivered["revenue"] }
+    dashboard_cache.set((admin.id, today), stats)
+    return stats
 
 #admin procurement erased 
 
@@ -1641,21 +4076,31 @@ async def assign_zone(user_id: str, assignment: ZoneAssignment, admin: User = De
         raise HTTPException(status_code=404, detail="Delivery partner not found")
     
     await db.users.update_one({"id": user_id}, {"$set": {"zone": assignment.zone}})
+    await invalidate_user(user_id)
     return {"message": "Zone assigned successfully"}
 
 @api_router.put("/admin/products/{product_id}/stock")
 async def update_stock(product_id: str, stock: StockUpdate, admin: User = Depends(get_admin_user)):
-    result = await db.products.update_one({"id": product_id}, {"$set": {"stock": stock.quantity}})
-    if result.modified_count == 0:
+    product = await db.products.find_one_and_update(
+        {"id": product_id},
+        {"$set": {"stock": stock.quantity}},
+        projection={"admin_id": 1}
+    )
+    if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidate_catalog(product.get("admin_id"))
     return {"message": "Stock updated"}
 
-@api_router.get("/admin/orders")
+@api_router.get("/admin/orders", response_class=JSONResponse, responses=page_responses(OrderCard, Dict[str, Any]))
 async def get_all_orders(
     status: Optional[str] = None,
     date: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     admin: User = Depends(get_admin_user),
 ):
+    selected = resolve_fields(fields, OrderCard, Order)
     query = {"admin_id": admin.id}
 
     if status:
@@ -1663,28 +4108,28 @@ async def get_all_orders(
     if date:
         query["delivery_date"] = date
 
-    orders = await db.orders.find(query).sort("created_at", -1).to_list(1000)
+    orders, next_cursor = await fetch_page(
+        db.orders, query, limit, cursor,
+        fields_projection(selected, extra=ORDER_SNAPSHOT_FIELDS)
+    )
 
+    # Customer / rider details come from the order snapshots; old orders get one batched users read
+    await fill_order_snapshots(orders)
     result = []
 
     for o in orders:
-        # ✅ CUSTOMER
-        user = await db.users.find_one({"id": o.get("user_id")})
-        o["customer_name"] = user["name"] if user else "Unknown Customer"
-        o["customer_phone"] = user["phone"] if user and user.get("phone") else None
-
-        # ✅ RIDER
+        o["customer_name"] = o.get("customer_name") or "Unknown Customer"
+        o["customer_phone"] = o.get("customer_phone") or None
         if o.get("delivery_partner_id"):
-            rider = await db.users.find_one({"id": o["delivery_partner_id"]})
-            o["delivery_partner_name"] = rider["name"] if rider else None
-            o["delivery_partner_phone"] = rider["phone"] if rider and rider.get("phone") else None
+            o["delivery_partner_name"] = o.get("delivery_partner_name")
+            o["delivery_partner_phone"] = o.get("delivery_partner_phone") or None
         else:
             o["delivery_partner_name"] = None
             o["delivery_partner_phone"] = None
 
-        result.append(Order(**o))
+        result.append(render_order(o, fields, selected))
 
-    return result
+    return page_response(result, next_cursor)
 
 
 
@@ -1694,11 +4139,15 @@ async def assign_delivery_partner(order_id: str, partner_id: str, admin: User =
     if not partner:
         raise HTTPException(status_code=404, detail="Delivery partner not found")
     
-    result = await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"delivery_partner_id": partner_id, "status": OrderStatus.ASSIGNED.value}} )
-    if result.modified_count == 0:
+    before = await db.orders.find_one_and_update(
+        {"id": order_id, "status": {"$ne": OrderStatus.DELIVERED.value}},
+        {"$set": {"delivery_partner_id": partner_id, "status": OrderStatus.ASSIGNED.value, **rider_snapshot(partner)}},
+        projection={"admin_id": 1, "delivery_date": 1, "status": 1, "total_amount": 1} )
+    if before is None:
+        if await db.orders.find_one({"id": order_id}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Order is already delivered")
         raise HTTPException(status_code=404, detail="Order not found")
+    await rollup_status_change(before, before.get("status"), OrderStatus.ASSIGNED.value)
     
     return {"message": "Delivery partner assigned"}
 
@@ -1707,66 +4156,271 @@ async def get_finance_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     admin: User = Depends(get_admin_user)):
-    query = {"status": "delivered"}
-    if start_date:
-        query["delivery_date"] = {"$gte": start_date}
-    if end_date:
-        if "delivery_date" in query:
-            query["delivery_date"]["$lte"] = end_date
-        else:
-            query["delivery_date"] = {"$lte": end_date}
-    
-    orders = await db.orders.find(query).to_list(10000)
-    
-    total_revenue = sum(o.get("total_amount", 0) for o in orders)
-    total_orders = len(orders)
-    
-    # Group by date
-    by_date = {}
-    for o in orders:
-        date = o.get("delivery_date", "unknown")
-        if date not in by_date:
-            by_date[date] = {"revenue": 0, "orders": 0}
-        by_date[date]["revenue"] += o.get("total_amount", 0)
-        by_date[date]["orders"] += 1
-    
-    return {
-        "total_revenue": total_revenue,
-        "total_orders": total_orders,
-        "by_date": by_date  }
+    return await finance_report(export_query(admin.id, OrderStatus.DELIVERED.value, start_date, end_date))
+
+@api_router.get("/admin/finance/export")
+async def export_finance_orders(
+    format: str = "csv",
+    status: Optional[str] = OrderStatus.DELIVERED.value,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    admin: User = Depends(get_admin_user)):
+    """This admin's orders (delivered by default) as gzip-compressed CSV or NDJSON"""
+    return export_response(export_query(admin.id, status, start_date, end_date), format, "finance")
 
 @api_router.post("/admin/refund")
 async def process_refund(user_id: str, amount: float, reason: str, admin: User = Depends(get_admin_user)):
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    wallet = await db.wallets.find_one({"user_id": user_id})
+    wallet = await db.wallets.find_one({"user_id": user_id}, {"_id": 0, "balance": 1})
     if not wallet:
         raise HTTPException(status_code=404, detail="User wallet not found")
     
-    new_balance = wallet.get("balance", 0.0) + amount
-    
-    transaction = {
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "amount": amount,
-        "type": "credit",
-        "description": f"Refund: {reason}",
-        "balance_after": new_balance,
-        "created_at": datetime.utcnow().isoformat()
-    }
-    
-    await db.wallets.update_one(
-        {"user_id": user_id},
-          {
-            "$set": {"balance": new_balance},
-            "$push": {"transactions": transaction}})
-    
-    return {"message": "Refund processed", "new_balance": new_balance}
+    entry = await run_in_transaction(
+        lambda session: apply_wallet_change(user_id, amount, "credit", f"Refund: {reason}", session)
+    )
+    return {"message": "Refund processed", "new_balance": entry["balance_after"]}
 
 # ===================== MIDNIGHT RUN - ORDER GENERATION =====================
 
-#--- erased  admin order genarete
+ORDER_GENERATION_ENABLED = os.environ.get("ORDER_GENERATION_ENABLED", "true").lower() == "true"
+ORDER_GENERATION_TIME = os.environ.get("ORDER_GENERATION_TIME", "00:05")  # IST, HH:MM
+ORDER_GENERATION_BATCH = int(os.environ.get("ORDER_GENERATION_BATCH", "5000"))
+ORDER_WRITE_CHUNK = 1000
+# Per-run counters, summed across worker processes
+ORDER_GENERATION_COUNTERS = ("subscriptions", "due", "created", "existing", "skipped", "failed", "failed_batches")
+
+async def generate_orders_for_date(
+    database,
+    target_date: str,
+    admin_ids: Optional[List[str]] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """Create the orders every active subscription owes on target_date.
+
+    Safe to re-run: orders are upserted on (subscription_id, delivery_date), so an order
+    that already exists (including the first one made by create_subscription) is kept.
+    """
+    started = time.perf_counter()
+    stats = {"date": target_date, **{key: 0 for key in ORDER_GENERATION_COUNTERS}}
+
+    query = {
+        "is_active": True,
+        "start_date": {"$lte": target_date},
+        "$or": [{"end_date": None}, {"end_date": {"$gte": target_date}}]
+    }
+    product_query = {}
+    if admin_ids is not None:
+        query["admin_id"] = {"$in": admin_ids}
+        product_query["admin_id"] = {"$in": admin_ids}
+
+    products = {
+        p["id"]: p
+        async for p in database.products.find(
+            product_query, {"_id": 0, "id": 1, "name": 1, "price": 1, "admin_id": 1, "is_available": 1}
+        )
+    }
+    admins = {
+        a["id"]: a
+        async for a in database.users.find(
+            {"role": UserRole.ADMIN.value}, {"_id": 0, "id": 1, "name": 1, "phone": 1, "address": 1}
+        )
+    }
+
+    async def process(batch: List[dict]):
+        stats["subscriptions"] += len(batch)
+        vacations = await vacations_between(database, {s["user_id"] for s in batch}, target_date, target_date)
+        _, quantities = build_delivery_schedule(batch, target_date, target_date, vacations)
+        due = [(sub, int(q)) for sub, q in zip(batch, quantities[:, 0]) if q > 0]
+        stats["due"] += len(due)
+        if not due:
+            return
+
+        customers = {
+            u["id"]: u
+            async for u in database.users.find(
+                {"id": {"$in": list({sub["user_id"] for sub, _ in due})}},
+                {"_id": 0, "id": 1, "name": 1, "phone": 1, "address": 1}
+            )
+        }
+
+        orders = []
+        for sub, quantity in due:
+            product = products.get(sub["product_id"])
+            customer = customers.get(sub["user_id"])
+            if not product or not product.get("is_available", True) or not customer:
+                stats["skipped"] += 1
+                continue
+            orders.append(build_order(
+                sub["id"], customer, product, admins.get(product["admin_id"]), target_date, quantity
+            ))
+        if dry_run:
+            stats["created"] += len(orders)
+            return
+
+        for i in range(0, len(orders), ORDER_WRITE_CHUNK):
+            chunk = orders[i:i + ORDER_WRITE_CHUNK]
+            try:
+                result = await database.orders.bulk_write([
+                    UpdateOne(
+                        {"subscription_id": o["subscription_id"], "delivery_date": o["delivery_date"]},
+                        {"$setOnInsert": o},
+                        upsert=True
+                    )
+                    for o in chunk
+                ], ordered=False)
+                upserted = result.upserted_ids.items()
+                matched = result.matched_count
+            except BulkWriteError as e:
+                # ordered=False applied every other line, so the orders it did insert still need
+                # their rollups and search entries. A duplicate key means a concurrent run
+                # inserted that order first; anything else is counted as failed.
+                upserted = [(u["index"], u["_id"]) for u in e.details.get("upserted", [])]
+                matched = e.details.get("nMatched", 0)
+                errors = e.details.get("writeErrors", [])
+                raced = sum(1 for err in errors if err.get("code") == 11000)
+                matched += raced
+                if len(errors) > raced:
+                    stats["failed"] += len(errors) - raced
+                    logger.error(f"❌ {len(errors) - raced} order writes failed for {target_date}: {errors[0].get('errmsg')}")
+            stats["created"] += len(upserted)
+            stats["existing"] += matched
+
+            inserted = []
+            for index, _id in upserted:
+                chunk[index]["_id"] = _id
+                inserted.append(chunk[index])
+            if inserted:
+                await rollup_orders(database, inserted)
+                await database.search_index.bulk_write([
+                    ReplaceOne({"_id": entry["_id"]}, entry, upsert=True)
+                    for entry in map(order_search_entry, inserted)
+                ], ordered=False)
+
+    async def process_or_log(batch: List[dict]):
+        # One bad subscription must not cost every other dairy its orders; a re-run fills the gap
+        try:
+            await process(batch)
+        except Exception:
+            stats["failed"] += len(batch)
+            stats["failed_batches"] += 1
+            logger.exception(
+                f"❌ Order generation batch failed for {target_date} "
+                f"(subscriptions {batch[0].get('id')} .. {batch[-1].get('id')})"
+            )
+
+    batch = []
+    async for sub in database.subscriptions.find(query, SUBSCRIPTION_SCHEDULE_FIELDS).batch_size(ORDER_GENERATION_BATCH):
+        batch.append(sub)
+        if len(batch) >= ORDER_GENERATION_BATCH:
+            await process_or_log(batch)
+            batch = []
+    if batch:
+        await process_or_log(batch)
+
+    if not dry_run and admin_ids is None:
+        stats["pruned_modifications"] = await prune_expired_modifications(database, target_date)
+
+    stats["dry_run"] = dry_run
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
+
+def _generate_orders_worker(target_date: str, admin_ids: List[str], dry_run: bool) -> Dict[str, Any]:
+    """Entry point of one worker process: its own event loop and Mongo client."""
+    worker_client = AsyncIOMotorClient(mongo_url)
+    database = worker_client[os.environ.get('DB_NAME', 'milk_delivery_db')]
+    try:
+        return asyncio.run(generate_orders_for_date(database, target_date, admin_ids, dry_run))
+    finally:
+        worker_client.close()
+
+def run_order_generation(target_date: str, workers: int = 1, dry_run: bool = False) -> Dict[str, Any]:
+    """Generate orders for target_date, partitioning admins across worker processes."""
+    started = time.perf_counter()
+    if workers <= 1:
+        return _generate_orders_worker(target_date, None, dry_run)
+
+    async def on_main_client(job):
+        main_client = AsyncIOMotorClient(mongo_url)
+        try:
+            return await job(main_client[os.environ.get('DB_NAME', 'milk_delivery_db')])
+        finally:
+            main_client.close()
+
+    admin_ids = asyncio.run(on_main_client(
+        lambda database: database.subscriptions.distinct("admin_id", {"is_active": True})
+    ))
+    partitions = [admin_ids[i::workers] for i in range(workers) if admin_ids[i::workers]]
+    totals = {"date": target_date, **{key: 0 for key in ORDER_GENERATION_COUNTERS}}
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(partitions) or 1, mp_context=context) as pool:
+        for result in pool.map(_generate_orders_worker, [target_date] * len(partitions), partitions, [dry_run] * len(partitions)):
+            for key in ORDER_GENERATION_COUNTERS:
+                totals[key] += result[key]
+    if not dry_run:
+        totals["pruned_modifications"] = asyncio.run(on_main_client(
+            lambda database: prune_expired_modifications(database, target_date)
+        ))
+    totals["dry_run"] = dry_run
+    totals["workers"] = len(partitions)
+    totals["seconds"] = round(time.perf_counter() - started, 3)
+    return totals
+
+def seconds_until_ist(hhmm: str) -> float:
+    hour, minute = (int(x) for x in hhmm.split(":"))
+    now = now_ist()
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return (run_at - now).total_seconds()
+
+# Every uvicorn worker runs the scheduler; a lease document per (job, date) lets only one of them
+# generate. An expired lease (the holder died mid-run) can be taken over; re-running is safe.
+ORDER_GENERATION_LEASE_SECONDS = int(os.environ.get("ORDER_GENERATION_LEASE_SECONDS", "3600"))
+LEASE_HOLDER = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+async def acquire_job_lease(database, job: str, run_date: str, seconds: int) -> bool:
+    """Claim the lease on (job, run_date) for this process; False if another holder has it."""
+    now = datetime.utcnow()
+    try:
+        await database.job_leases.find_one_and_update(
+            {"job": job, "date": run_date, "$or": [{"expires_at": {"$lte": now}}, {"holder": LEASE_HOLDER}]},
+            {"$set": {"holder": LEASE_HOLDER, "acquired_at": now, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # the lease exists, is unexpired and held by someone else, so the upsert collided
+        return False
+    return True
+
+async def run_scheduled_order_generation(target_date: str) -> Optional[Dict[str, Any]]:
+    """The scheduler's run for one date; None when another worker holds the lease."""
+    if not await acquire_job_lease(db, "generate_orders", target_date, ORDER_GENERATION_LEASE_SECONDS):
+        logger.info(f"⏭️ Order generation for {target_date} is running elsewhere")
+        return None
+    stats = await generate_orders_for_date(db, target_date)
+    await db.job_leases.update_one(
+        {"job": "generate_orders", "date": target_date, "holder": LEASE_HOLDER},
+        {"$set": {"finished_at": datetime.utcnow(), "stats": stats}}
+    )
+    return stats
+
+async def order_generation_scheduler():
+    while True:
+        await asyncio.sleep(seconds_until_ist(ORDER_GENERATION_TIME))
+        target_date = now_ist().strftime("%Y-%m-%d")
+        try:
+            stats = await run_scheduled_order_generation(target_date)
+            if stats is not None:
+                logger.info(f"✅ Midnight run: {stats}")
+        except Exception:
+            logger.exception(f"❌ Midnight run failed for {target_date}")
+
+@app.on_event("startup")
+async def start_order_generation_scheduler():
+    if ORDER_GENERATION_ENABLED:
+        spawn_background(order_generation_scheduler(), "order generation scheduler")
 
 # ===================== SEED DATA =====================
 
@@ -1785,6 +4439,7 @@ async def seed_data():
         p["created_at"] = datetime.utcnow()
     
     await db.products.insert_many(products)
+    await invalidate_all_catalogs()
     
     # Create admin user
     admin_exists = await db.users.find_one({"email": "admin@milkapp.com"})
@@ -1793,11 +4448,12 @@ async def seed_data():
             "id": str(uuid.uuid4()),
             "email": "admin@milkapp.com",
             "name": "Admin User",
-            "password": get_password_hash("admin123"),
+            "password": await get_password_hash_async("admin123"),
             "role": "admin",
             "is_active": True,
             "created_at": datetime.utcnow() }
         await db.users.insert_one(admin)
+        await invalidate_user(admin["id"])
     
     return {"message": "Data seeded successfully", "products_count": len(products)}
 
@@ -1811,8 +4467,41 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    password_executor.shutdown(wait=False)
+    shutdown_image_executor()
+
+# ===================== CLI =====================
+# python server.py generate-orders --date 2025-01-31 --workers 4 [--dry-run]
+# python server.py rebuild-wallet-snapshots [--user-id ID]
+# python server.py rebuild-order-rollups
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Milk Delivery App maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate-orders", help="Run the midnight order generation")
+    generate.add_argument("--date", default=None, help="delivery date YYYY-MM-DD (default: today IST)")
+    generate.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    generate.add_argument("--dry-run", action="store_true", help="count orders without writing them")
+
+    snapshots = commands.add_parser("rebuild-wallet-snapshots", help="Recompute daily wallet snapshots from the ledger")
+    snapshots.add_argument("--user-id", default=None, help="only this user (default: everyone)")
+
+    commands.add_parser("rebuild-order-rollups", help="Recompute per-admin daily order rollups from orders")
+
+    args = parser.parse_args()
+    if args.command == "generate-orders":
+        result = run_order_generation(
+            args.date or now_ist().strftime("%Y-%m-%d"), workers=args.workers, dry_run=args.dry_run
+        )
+        print(json.dumps(result, indent=2))
+    elif args.command == "rebuild-wallet-snapshots":
+        print(json.dumps(asyncio.run(rebuild_wallet_snapshots(args.user_id)), indent=2))
+    elif args.command == "rebuild-order-rollups":
+        print(json.dumps(asyncio.run(rebuild_order_rollups(db)), indent=2))
@@ -0,0 +1,136 @@
+import asyncio
+import random
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+# Collection methods that each cost one round-trip to Mongo
+QUERY_METHODS = {
+    "find", "find_one", "aggregate", "count_documents", "estimated_document_count", "distinct",
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one",
+    "delete_many", "find_one_and_update", "find_one_and_replace", "find_one_and_delete", "bulk_write",
+}
+
+
+class CountingCollection:
+    def __init__(self, collection, log: list):
+        self._collection, self._log = collection, log
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in QUERY_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._log.append((self._collection.name, name))
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """Wraps a database and records (collection, method) for every query the app sends."""
+
+    def __init__(self, database):
+        self._database, self.queries = database, []
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self.queries)
+
+    def __getattr__(self, name):
+        return CountingCollection(self._database[name], self.queries)
+
+
+class InterleavingCollection:
+    """Yields to the event loop before each awaitable call, as a networked driver would.
+
+    mongomock-motor runs every call synchronously, so without this, "concurrent" requests
+    never interleave between their reads and writes.
+    """
+
+    def __init__(self, collection, rng: random.Random):
+        self._collection, self._rng = collection, rng
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in QUERY_METHODS or name in ("find", "aggregate"):
+            return attr
+
+        async def interleaved(*args, **kwargs):
+            for _ in range(self._rng.randint(0, 3)):
+                await asyncio.sleep(0)
+            return await attr(*args, **kwargs)
+        return interleaved
+
+
+class InterleavingDatabase:
+    def __init__(self, database, seed: int = 0):
+        self._database, self._rng = database, random.Random(seed)
+
+    def __getitem__(self, name):
+        return InterleavingCollection(self._database[name], self._rng)
+
+    def __getattr__(self, name):
+        return InterleavingCollection(self._database[name], self._rng)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = AsyncMongoMockClient()
+    database = client["milk_delivery_test"]
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", database)
+    # mongomock has no sessions; run_in_transaction falls back to plain writes
+    monkeypatch.setattr(server, "transactions_supported", False)
+    for cache in (server.user_cache, server.catalog_cache, server.calendar_cache, server.dashboard_cache):
+        cache.clear()
+    monkeypatch.setattr(server, "_cache_sync_since", None)
+    monkeypatch.setattr(server, "_applied_invalidations", {})
+    return database
+
+
+@pytest.fixture
+def query_log(db, monkeypatch):
+    counting = CountingDatabase(db)
+    monkeypatch.setattr(server, "db", counting)
+    return counting.queries
+
+
+@pytest.fixture
+def interleaving(db, monkeypatch):
+    monkeypatch.setattr(server, "db", InterleavingDatabase(db))
+
+
+@pytest.fixture
+async def api(db):
+    # Startup hooks (schedulers, migrations) are deliberately not run
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def make_user(db, role: str = "customer", **fields) -> dict:
+    user = {
+        "id": str(uuid.uuid4()), "email": f"{role}-{uuid.uuid4().hex[:8]}@example.com",
+        "name": role.title(), "phone": "9876543210", "role": role, "is_active": True, **fields
+    }
+    await db.users.insert_one(dict(user))
+    if role == "customer":
+        await db.wallets.insert_one({"user_id": user["id"], "balance": 0.0})
+    return user
+
+
+def auth(user: dict) -> dict:
+    return {"Authorization": "Bearer " + server.create_access_token({"sub": user["id"]})}
@@ -0,0 +1,82 @@
+import time
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_dairy(db, admin: dict, today: str, extra: int) -> None:
+    customers = [await make_user(db) for _ in range(3)]
+    await db.subscriptions.insert_many([
+        {"id": str(uuid.uuid4()), "admin_id": admin["id"], "user_id": customers[i % 3]["id"], "is_active": i % 4 != 0}
+        for i in range(5 + extra)
+    ])
+    statuses = ["delivered", "delivered", "assigned", "cancelled", "delivered"]
+    await db.orders.insert_many([
+        {
+            "id": str(uuid.uuid4()), "admin_id": admin["id"], "delivery_date": day,
+            "status": statuses[i % len(statuses)], "total_amount": 10.0 * (i + extra)
+        }
+        for i in range(7 + extra)
+        for day in (today, "2020-01-01")
+    ])
+    await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+
+
+async def computed_directly(db, admin_id: str, today: str) -> dict:
+    orders = await db.orders.find({"admin_id": admin_id, "delivery_date": today}).to_list(None)
+    subs = await db.subscriptions.find({"admin_id": admin_id}).to_list(None)
+    delivered = [o for o in orders if o["status"] == "delivered"]
+    return {
+        "total_customers": len({s["user_id"] for s in subs}),
+        "total_delivery_partners": await db.users.count_documents(
+            {"role": "delivery_partner", "assigned_admin_ids": admin_id}
+        ),
+        "active_subscriptions": sum(1 for s in subs if s["is_active"]),
+        "today_orders": len(orders),
+        "delivered_today": len(delivered),
+        "today_revenue": sum(o["total_amount"] for o in delivered),
+    }
+
+
+async def test_dashboard_matches_a_direct_computation_and_is_scoped_to_the_admin(api, db):
+    today = server.now_ist().strftime("%Y-%m-%d")
+    admin, other = await make_user(db, "admin"), await make_user(db, "admin")
+    await seed_dairy(db, admin, today, 0)
+    await seed_dairy(db, other, today, 3)
+
+    for user in (admin, other):
+        r = await api.get("/api/admin/dashboard", headers=auth(user))
+        assert r.status_code == 200
+        assert r.json() == await computed_directly(db, user["id"], today)
+
+
+async def test_empty_dairy_has_zero_stats(api, db):
+    admin = await make_user(db, "admin")
+
+    stats = (await api.get("/api/admin/dashboard", headers=auth(admin))).json()
+
+    assert set(stats.values()) == {0}
+
+
+async def test_dashboard_is_served_from_cache_until_it_expires(api, db, query_log, monkeypatch):
+    today = server.now_ist().strftime("%Y-%m-%d")
+    admin = await make_user(db, "admin")
+    await seed_dairy(db, admin, today, 0)
+    headers = auth(admin)
+    first = (await api.get("/api/admin/dashboard", headers=headers)).json()
+
+    await db.orders.insert_one({"id": "late", "admin_id": admin["id"], "delivery_date": today, "status": "assigned"})
+    query_log.clear()
+    cached = (await api.get("/api/admin/dashboard", headers=headers)).json()
+    assert cached == first
+    assert query_log == []
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + server.DASHBOARD_CACHE_TTL_SECONDS + 1)
+    refreshed = (await api.get("/api/admin/dashboard", headers=headers)).json()
+    assert refreshed["today_orders"] == first["today_orders"] + 1
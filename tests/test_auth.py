@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def published_by_another_worker(db, kind: str, key):
+    # what publish_invalidation leaves behind in a worker other than this one
+    await db.cache_invalidations.insert_one({"kind": kind, "key": key, "at": datetime.utcnow()})
+
+
+async def test_cache_hit_does_not_query_users(api, db, query_log):
+    customer = await make_user(db)
+    headers = auth(customer)
+    assert (await api.get("/api/auth/me", headers=headers)).status_code == 200
+    query_log.clear()
+
+    assert (await api.get("/api/auth/me", headers=headers)).status_code == 200
+    assert ("users", "find_one") not in query_log
+
+
+async def test_block_from_another_worker_is_enforced_after_sync(api, db):
+    customer = await make_user(db)
+    headers = auth(customer)
+    assert (await api.get("/api/auth/me", headers=headers)).status_code == 200
+
+    await db.users.update_one({"id": customer["id"]}, {"$set": {"is_active": False}})
+    await published_by_another_worker(db, "user", customer["id"])
+    assert await server.sync_caches() == 1
+
+    r = await api.get("/api/auth/me", headers=headers)
+    assert r.status_code == 403
+
+
+async def test_delete_from_another_worker_is_enforced_after_sync(api, db):
+    customer = await make_user(db)
+    headers = auth(customer)
+    assert (await api.get("/api/auth/me", headers=headers)).status_code == 200
+
+    await db.users.delete_one({"id": customer["id"]})
+    await published_by_another_worker(db, "user", customer["id"])
+    await server.sync_caches()
+
+    r = await api.get("/api/auth/me", headers=headers)
+    assert r.status_code == 401
+
+
+async def test_block_in_this_worker_is_enforced_at_once(api, db):
+    customer = await make_user(db)
+    superadmin = await make_user(db, "superadmin")
+    headers = auth(customer)
+    assert (await api.get("/api/auth/me", headers=headers)).status_code == 200
+
+    r = await api.put(f"/api/superadmin/users/{customer['id']}/status", json={"is_active": False}, headers=auth(superadmin))
+    assert r.status_code == 200
+
+    assert (await api.get("/api/auth/me", headers=headers)).status_code == 403
+    # published for the other workers, and not re-applied here on the next poll
+    assert await db.cache_invalidations.count_documents({"kind": "user", "key": customer["id"]}) == 1
+    assert await server.sync_caches() == 0
+
+
+async def test_sync_applies_each_event_once_and_skips_old_ones(db):
+    await published_by_another_worker(db, "user", "u1")
+    await db.cache_invalidations.insert_one({"kind": "user", "key": "u2", "at": datetime.utcnow() - timedelta(hours=1)})
+
+    assert await server.sync_caches() == 1
+    server.user_cache.set("u1", {"id": "u1"})
+    assert await server.sync_caches() == 0
+    assert server.user_cache.get("u1") == {"id": "u1"}
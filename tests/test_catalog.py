@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+PRODUCT = {"name": "Cow Milk", "category": "milk", "price": 30.0, "unit": "500ml"}
+
+
+async def catalog(api, admin_id, **headers):
+    return await api.get("/api/catalog/products", params={"admin_id": admin_id}, headers=headers)
+
+
+async def test_etag_round_trip_returns_304(api, db):
+    admin = await make_user(db, "admin")
+    await api.post("/api/products", json=PRODUCT, headers=auth(admin))
+
+    first = await catalog(api, admin["id"])
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    again = await catalog(api, admin["id"], **{"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+
+    stale = await catalog(api, admin["id"], **{"If-None-Match": '"something-else"'})
+    assert stale.status_code == 200
+
+
+@pytest.mark.parametrize("write", ["create", "update", "delete"])
+async def test_product_writes_invalidate_the_cached_catalog(api, db, write):
+    admin = await make_user(db, "admin")
+    created = (await api.post("/api/products", json=PRODUCT, headers=auth(admin))).json()
+    before = await catalog(api, admin["id"])
+    assert [p["name"] for p in before.json()] == ["Cow Milk"]
+
+    if write == "create":
+        await api.post("/api/products", json={**PRODUCT, "name": "Paneer"}, headers=auth(admin))
+        expected = ["Cow Milk", "Paneer"]
+    elif write == "update":
+        await api.put(f"/api/products/{created['id']}", json={"name": "A2 Milk"}, headers=auth(admin))
+        expected = ["A2 Milk"]
+    else:
+        await api.delete(f"/api/products/{created['id']}", headers=auth(admin))
+        expected = []
+
+    after = await catalog(api, admin["id"], **{"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert sorted(p["name"] for p in after.json()) == expected
+
+
+async def test_product_write_in_another_worker_applies_after_sync(api, db):
+    admin = await make_user(db, "admin")
+    await api.post("/api/products", json=PRODUCT, headers=auth(admin))
+    await catalog(api, admin["id"])
+
+    # another worker renames the product and publishes the invalidation
+    await db.products.update_one({"admin_id": admin["id"]}, {"$set": {"name": "A2 Milk"}})
+    await db.cache_invalidations.insert_one({"kind": "catalog", "key": admin["id"], "at": datetime.utcnow()})
+    assert [p["name"] for p in (await catalog(api, admin["id"])).json()] == ["Cow Milk"]
+
+    await server.sync_caches()
+    assert [p["name"] for p in (await catalog(api, admin["id"])).json()] == ["A2 Milk"]
+
+
+async def test_invalidation_keeps_other_admins_catalogs(api, db):
+    admin, other = await make_user(db, "admin"), await make_user(db, "admin")
+    await api.post("/api/products", json=PRODUCT, headers=auth(other))
+    await catalog(api, other["id"])
+
+    await api.post("/api/products", json=PRODUCT, headers=auth(admin))
+
+    hits = server.catalog_cache.hits
+    await catalog(api, other["id"])
+    assert server.catalog_cache.hits == hits + 1
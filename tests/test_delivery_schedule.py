@@ -0,0 +1,197 @@
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+
+def sub(**fields):
+    return {
+        "id": str(uuid.uuid4()), "user_id": "u1", "product_id": "p1", "quantity": 2,
+        "pattern": "daily", "start_date": "2025-01-06", **fields
+    }
+
+
+def test_patterns_over_a_week():
+    # 2025-01-06 is a Monday
+    subs = [
+        sub(),
+        sub(pattern="alternate"),
+        sub(pattern="custom", custom_days=[0, 4]),
+        sub(pattern="buy_once", quantity=5),
+        sub(end_date="2025-01-08"),
+    ]
+    days, quantities = server.build_delivery_schedule(subs, "2025-01-06", "2025-01-12")
+
+    assert days[0] == "2025-01-06" and len(days) == 7
+    assert quantities.tolist() == [
+        [2, 2, 2, 2, 2, 2, 2],
+        [2, 0, 2, 0, 2, 0, 2],
+        [2, 0, 0, 0, 2, 0, 0],
+        [5, 0, 0, 0, 0, 0, 0],
+        [2, 2, 2, 0, 0, 0, 0],
+    ]
+
+
+def test_modifications_and_vacations():
+    subs = [sub(modifications={"2025-01-07": 0, "2025-01-08": 4}), sub(user_id="u2")]
+    _, quantities = server.build_delivery_schedule(
+        subs, "2025-01-06", "2025-01-09", {"u2": [("2025-01-07", "2025-01-08")]}
+    )
+    assert quantities.tolist() == [[2, 0, 4, 2], [2, 0, 0, 2]]
+
+
+def test_malformed_rows_do_not_deliver_and_do_not_raise():
+    subs = [
+        sub(pattern="custom", custom_days=["1", "x", 9, None]),  # "1" is coerced, the rest skipped
+        sub(quantity="lots"),
+        sub(quantity=None),
+        sub(start_date="06/01/2025"),
+        sub(start_date=None),
+        sub(end_date="soon"),
+        sub(pattern=["daily"]),
+        sub(pattern="custom", custom_days="1"),
+        sub(modifications={"not-a-date": 3, "2025-01-07": "x"}),
+        sub(modifications=[{"quantity": 1}, "junk"]),
+        sub(quantity="3"),
+    ]
+    _, quantities = server.build_delivery_schedule(subs, "2025-01-06", "2025-01-08")
+
+    assert quantities.dtype == np.int32
+    assert quantities.tolist() == [
+        [0, 2, 0],
+        [0, 0, 0],
+        [0, 0, 0],
+        [0, 0, 0],
+        [0, 0, 0],
+        [0, 0, 0],
+        [0, 0, 0],
+        [0, 0, 0],
+        [2, 2, 2],
+        [2, 2, 2],
+        [3, 3, 3],
+    ]
+
+
+@pytest.mark.anyio
+async def test_preview_and_calendar_survive_a_malformed_subscription(api, db):
+    customer = await make_user(db)
+    tomorrow = (server.now_ist() + timedelta(days=1)).strftime("%Y-%m-%d")
+    await db.products.insert_one({"id": "p1", "name": "Milk", "price": 30.0, "unit": "1L", "admin_id": "a1"})
+    for fields in (
+        {"pattern": "custom", "custom_days": ["1"], "quantity": "two"},
+        {"pattern": "daily", "quantity": 1},
+    ):
+        await db.subscriptions.insert_one(sub(
+            user_id=customer["id"], admin_id="a1", is_active=True, start_date=tomorrow, **fields
+        ))
+    headers = auth(customer)
+
+    preview = await api.get("/api/orders/tomorrow/preview", headers=headers)
+    calendar = await api.get("/api/orders/calendar", headers=headers)
+
+    assert preview.status_code == 200
+    assert [i["quantity"] for i in preview.json()["items"]] == [1]
+    assert calendar.status_code == 200
+
+
+def future_day(offset: int) -> str:
+    return (server.now_ist() + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+
+async def subscribe(api, db, customer: dict, price: float = 30.0, quantity: int = 2) -> dict:
+    admin = await make_user(db, "admin")
+    product = {
+        "id": str(uuid.uuid4()), "name": "Milk", "category": "milk", "price": price, "unit": "1L", "admin_id": admin["id"]
+    }
+    await db.products.insert_one(dict(product))
+    r = await api.post("/api/subscriptions", headers=auth(customer), json={
+        "product_id": product["id"], "quantity": quantity, "pattern": "daily", "start_date": future_day(1)
+    })
+    assert r.status_code == 200
+    return {"admin": admin, "product": product, "subscription": r.json()}
+
+
+async def calendar(api, customer: dict, days: int = 5) -> dict:
+    r = await api.get(
+        "/api/orders/calendar", params={"from": future_day(1), "to": future_day(days)}, headers=auth(customer)
+    )
+    assert r.status_code == 200
+    return r.json()
+
+
+@pytest.mark.anyio
+async def test_calendar_applies_vacations_modifications_and_projects_the_wallet(api, db):
+    customer = await make_user(db)
+    await db.wallets.update_one({"user_id": customer["id"]}, {"$set": {"balance": 100.0}})
+    sub_id = (await subscribe(api, db, customer))["subscription"]["id"]
+    headers = auth(customer)
+    r = await api.post(f"/api/subscriptions/{sub_id}/modify", headers=headers, json={"date": future_day(2), "quantity": 3})
+    assert r.status_code == 200
+    r = await api.post("/api/vacations", headers=headers, json={"start_date": future_day(3), "end_date": future_day(3)})
+    assert r.status_code == 200
+
+    body = await calendar(api, customer)
+
+    days = body["days"]
+    assert [d["date"] for d in days] == [future_day(i) for i in range(1, 6)]
+    assert [d["on_vacation"] for d in days] == [False, False, True, False, False]
+    assert [[i["quantity"] for i in d["items"]] for d in days] == [[2], [3], [], [2], [2]]
+    assert [[i["modified"] for i in d["items"]] for d in days] == [[False], [True], [], [False], [False]]
+    assert [d["total"] for d in days] == [60.0, 90.0, 0.0, 60.0, 60.0]
+    assert [d["balance_after"] for d in days] == [40.0, -50.0, -50.0, -110.0, -170.0]
+    assert [d["shortfall"] for d in days] == [0.0, 50.0, 50.0, 110.0, 170.0]
+    assert body["total"] == 270.0
+    assert body["wallet_balance"] == 100.0
+    assert body["shortfall"] == 170.0
+    assert body["first_shortfall_date"] == future_day(2)
+
+
+@pytest.mark.anyio
+async def test_calendar_cache_is_invalidated_by_writes(api, db):
+    customer = await make_user(db)
+    headers = auth(customer)
+    first = await subscribe(api, db, customer)
+    sub_id = first["subscription"]["id"]
+    totals = lambda body: [d["total"] for d in body["days"]]
+    assert totals(await calendar(api, customer, days=3)) == [60.0, 60.0, 60.0]
+
+    await subscribe(api, db, customer, price=10.0, quantity=1)
+    assert totals(await calendar(api, customer, days=3)) == [70.0, 70.0, 70.0]
+
+    await api.post("/api/vacations", headers=headers, json={"start_date": future_day(1), "end_date": future_day(1)})
+    assert totals(await calendar(api, customer, days=3)) == [0.0, 70.0, 70.0]
+
+    await api.post(f"/api/subscriptions/{sub_id}/modify", headers=headers, json={"date": future_day(2), "quantity": 0})
+    assert totals(await calendar(api, customer, days=3)) == [0.0, 10.0, 70.0]
+
+    await api.put(f"/api/subscriptions/{sub_id}", headers=headers, json={"quantity": 1})
+    assert totals(await calendar(api, customer, days=3)) == [0.0, 10.0, 40.0]
+
+    r = await api.put(f"/api/products/{first['product']['id']}", headers=auth(first["admin"]), json={"price": 50.0})
+    assert r.status_code == 200
+    assert totals(await calendar(api, customer, days=3)) == [0.0, 10.0, 60.0]
+
+    await api.delete(f"/api/subscriptions/{sub_id}", headers=headers)
+    assert totals(await calendar(api, customer, days=3)) == [0.0, 10.0, 10.0]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("kind", ["calendar", "calendar_all"])
+async def test_calendar_change_in_another_worker_applies_after_sync(api, db, kind):
+    customer = await make_user(db)
+    first = await subscribe(api, db, customer)
+    totals = lambda body: [d["total"] for d in body["days"]]
+    assert totals(await calendar(api, customer, days=2)) == [60.0, 60.0]
+
+    # another worker changes the quantity and publishes the invalidation
+    await db.subscriptions.update_one({"id": first["subscription"]["id"]}, {"$set": {"quantity": 1}})
+    key = customer["id"] if kind == "calendar" else None
+    await db.cache_invalidations.insert_one({"kind": kind, "key": key, "at": datetime.utcnow()})
+    assert totals(await calendar(api, customer, days=2)) == [60.0, 60.0]
+
+    await server.sync_caches()
+    assert totals(await calendar(api, customer, days=2)) == [30.0, 30.0]
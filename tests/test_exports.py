@@ -0,0 +1,105 @@
+import csv
+import gzip
+import io
+import json
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+def order(admin: dict, day: str = "2025-01-06", status: str = "delivered", **fields) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "subscription_id": str(uuid.uuid4()), "admin_id": admin["id"],
+        "admin_name": admin["name"], "user_id": "u1", "customer_name": "Asha", "customer_phone": "9876543210",
+        "status": status, "delivery_date": day, "total_amount": 60.0,
+        "items": [{"product_name": "Milk", "quantity": 2}], **fields
+    }
+
+
+async def raw_export(api, url: str, user: dict, **params) -> tuple:
+    async with api.stream("GET", url, params=params, headers=auth(user)) as r:
+        body = b"".join([chunk async for chunk in r.aiter_raw()])
+    return r, body
+
+
+async def test_csv_export_has_the_header_and_one_row_per_order(api, db):
+    admin = await make_user(db, "admin")
+    orders = [order(admin), order(admin, day="2025-01-07")]
+    await db.orders.insert_many([dict(o) for o in orders])
+
+    r, body = await raw_export(api, "/api/admin/finance/export", admin)
+
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(gzip.decompress(body).decode())))
+    assert rows[0] == server.EXPORT_COLUMNS
+    by_id = {row[0]: dict(zip(rows[0], row)) for row in rows[1:]}
+    assert by_id.keys() == {o["id"] for o in orders}
+    first = by_id[orders[0]["id"]]
+    assert (first["delivery_date"], first["items"], first["total_amount"]) == ("2025-01-06", "Milk x 2", "60.0")
+
+
+async def test_ndjson_export_decodes_to_one_object_per_line(api, db):
+    admin, superadmin = await make_user(db, "admin"), await make_user(db, "superadmin")
+    await db.orders.insert_many([order(admin, status=s) for s in ("delivered", "cancelled")])
+
+    r, body = await raw_export(api, "/api/superadmin/orders/export", superadmin)
+
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+    assert sorted(line["status"] for line in lines) == ["cancelled", "delivered"]
+    assert all("_id" not in line for line in lines)
+
+
+async def test_admin_export_only_contains_their_own_orders(api, db):
+    admin, other = await make_user(db, "admin"), await make_user(db, "admin")
+    mine = order(admin)
+    await db.orders.insert_many([dict(mine), order(other), order(admin, status="cancelled")])
+
+    _, body = await raw_export(api, "/api/admin/finance/export", admin, format="ndjson")
+
+    lines = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+    assert [line["id"] for line in lines] == [mine["id"]]
+
+
+async def test_export_filters_by_date_range(api, db):
+    admin, superadmin = await make_user(db, "admin"), await make_user(db, "superadmin")
+    await db.orders.insert_many([order(admin, day=d) for d in ("2025-01-05", "2025-01-06", "2025-01-08")])
+
+    _, body = await raw_export(
+        api, "/api/superadmin/orders/export", superadmin, start_date="2025-01-06", end_date="2025-01-07"
+    )
+
+    days = [json.loads(line)["delivery_date"] for line in gzip.decompress(body).decode().splitlines()]
+    assert days == ["2025-01-06"]
+
+
+@pytest.mark.parametrize("params", [
+    {"start_date": "06-01-2025"}, {"end_date": "2025-13-01"}, {"start_date": "yesterday"}, {"format": "xml"}
+])
+async def test_export_rejects_bad_dates_and_formats(api, db, params):
+    superadmin = await make_user(db, "superadmin")
+
+    r = await api.get("/api/superadmin/orders/export", params=params, headers=auth(superadmin))
+
+    assert r.status_code == 400
+
+
+async def test_export_streams_in_several_chunks(db, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_CHUNK_BYTES", 512)
+    monkeypatch.setattr(server, "EXPORT_BATCH_SIZE", 10)
+    admin = await make_user(db, "admin")
+    # uuids barely compress, so the gzip output outgrows zlib's internal buffer several times
+    await db.orders.insert_many([order(admin, user_id=str(uuid.uuid4())) for _ in range(2000)])
+
+    chunks = [chunk async for chunk in server.stream_orders_export({"admin_id": admin["id"]}, "csv")]
+
+    assert len(chunks) > 3
+    rows = list(csv.reader(io.StringIO(gzip.decompress(b"".join(chunks)).decode())))
+    assert len(rows) == 2001
@@ -0,0 +1,95 @@
+import random
+import uuid
+
+import pytest
+
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+PRICES = {"p1": 30.0, "p2": 55.0, "p3": 12.5}
+
+
+def python_report(orders, admin_id, start, end):
+    """The grouping get_finance_report used to do in Python (without its 10,000 cap)."""
+    selected = [
+        o for o in orders
+        if o["status"] == "delivered" and (admin_id is None or o["admin_id"] == admin_id)
+        and start <= o["delivery_date"] <= end
+    ]
+    by_date, by_product = {}, {}
+    for o in selected:
+        day = by_date.setdefault(o["delivery_date"], {"revenue": 0, "orders": 0})
+        day["revenue"] += o["total_amount"]
+        day["orders"] += 1
+        for item in o["items"]:
+            product = by_product.setdefault(item["product_id"], {"quantity": 0, "revenue": 0, "orders": 0})
+            product["quantity"] += item["quantity"]
+            product["revenue"] += item["price"] * item["quantity"]
+        for product_id in {item["product_id"] for item in o["items"]}:
+            by_product[product_id]["orders"] += 1
+    return sum(o["total_amount"] for o in selected), len(selected), by_date, by_product
+
+
+async def seed(db, admins, count=500):
+    rng = random.Random(3)
+    orders = []
+    for _ in range(count):
+        # some orders have several lines, sometimes of the same product
+        items = []
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            product_id, quantity = rng.choice(sorted(PRICES)), rng.randint(1, 3)
+            items.append({"product_id": product_id, "product_name": product_id.upper(), "quantity": quantity, "price": PRICES[product_id]})
+        orders.append({
+            "id": str(uuid.uuid4()), "admin_id": rng.choice(admins)["id"],
+            "status": rng.choice(["delivered", "delivered", "assigned", "cancelled"]),
+            "delivery_date": f"2025-01-{rng.randint(1, 28):02d}",
+            "total_amount": sum(i["price"] * i["quantity"] for i in items),
+            "items": items,
+        })
+    await db.orders.insert_many([dict(o) for o in orders])
+    return orders
+
+
+def assert_matches(report, expected):
+    total, count, by_date, by_product = expected
+    assert report["total_revenue"] == pytest.approx(total)
+    assert report["total_orders"] == count
+    assert report["by_date"] == by_date
+    assert list(report["by_date"]) == sorted(by_date)
+    assert {p["product_id"]: {k: p[k] for k in ("quantity", "revenue", "orders")} for p in report["by_product"]} == by_product
+    assert [p["revenue"] for p in report["by_product"]] == sorted((p["revenue"] for p in report["by_product"]), reverse=True)
+
+
+async def test_admin_finance_matches_python_grouping_and_is_scoped(api, db):
+    admins = [await make_user(db, "admin"), await make_user(db, "admin")]
+    orders = await seed(db, admins)
+
+    r = await api.get("/api/admin/finance", headers=auth(admins[0]),
+                      params={"start_date": "2025-01-05", "end_date": "2025-01-20"})
+
+    assert r.status_code == 200
+    assert_matches(r.json(), python_report(orders, admins[0]["id"], "2025-01-05", "2025-01-20"))
+
+
+async def test_superadmin_revenue_matches_python_grouping(api, db):
+    admins = [await make_user(db, "admin"), await make_user(db, "admin")]
+    superadmin = await make_user(db, "superadmin")
+    orders = await seed(db, admins)
+
+    everyone = await api.get("/api/superadmin/revenue", headers=auth(superadmin),
+                             params={"start_date": "2025-01-01", "end_date": "2025-01-31"})
+    one = await api.get("/api/superadmin/revenue", headers=auth(superadmin),
+                        params={"start_date": "2025-01-10", "end_date": "2025-01-12", "admin_id": admins[1]["id"]})
+
+    assert_matches(everyone.json(), python_report(orders, None, "2025-01-01", "2025-01-31"))
+    assert_matches(one.json(), python_report(orders, admins[1]["id"], "2025-01-10", "2025-01-12"))
+
+
+async def test_finance_rejects_bad_dates_and_handles_empty_range(api, db):
+    admin = await make_user(db, "admin")
+    headers = auth(admin)
+
+    assert (await api.get("/api/admin/finance", headers=headers, params={"start_date": "05/01/2025"})).status_code == 400
+    empty = await api.get("/api/admin/finance", headers=headers)
+    assert empty.json() == {"total_revenue": 0, "total_orders": 0, "by_date": {}, "by_product": []}
@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import io
+
+import pytest
+from fastapi import HTTPException
+from gridfs.errors import FileExists
+from PIL import Image
+from pymongo.errors import DuplicateKeyError
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+class ChunkedBucket:
+    """Writes like GridFS: chunks first, then the files document, yielding in between.
+
+    A duplicate key on the files document surfaces as FileExists, as it does from GridIn.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def upload_from_stream_with_id(self, file_id, filename, data, metadata=None):
+        await self.db["images.chunks"].insert_one({"files_id": file_id, "n": 0, "data": data})
+        await asyncio.sleep(0)
+        try:
+            await self.db["images.files"].insert_one(
+                {"_id": file_id, "filename": filename, "length": len(data), "metadata": metadata}
+            )
+        except DuplicateKeyError:
+            raise FileExists(f"file with id {file_id!r} already exists")
+
+
+async def test_same_bytes_uploaded_concurrently_are_stored_once(db, monkeypatch):
+    monkeypatch.setattr(server, "image_bucket", ChunkedBucket(db))
+    await db["images.files"].create_index("filename", unique=True)
+
+    digests = await asyncio.gather(*(server.store_blob(b"same image bytes", "image/png") for _ in range(2)))
+
+    assert digests[0] == digests[1]
+    files = await db["images.files"].find({"filename": digests[0]}).to_list(None)
+    assert len(files) == 1
+    chunks = await db["images.chunks"].find().to_list(None)
+    assert [c["files_id"] for c in chunks] == [files[0]["_id"]]
+
+
+def png_bytes() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (4, 4), "white").save(out, format="PNG")
+    return out.getvalue()
+
+
+def data_url(content_type: str, data: bytes) -> str:
+    return f"data:{content_type};base64," + base64.b64encode(data).decode()
+
+
+def test_content_type_comes_from_the_bytes_not_the_data_url_header():
+    data, content_type = server.decode_base64_image(data_url("text/html", png_bytes()))
+
+    assert data == png_bytes()
+    assert content_type == "image/png"
+
+
+@pytest.mark.parametrize("payload", [b"<html><script>alert(1)</script></html>", b"GIF89a but not really"])
+def test_non_image_bytes_are_rejected(payload):
+    with pytest.raises(HTTPException) as exc:
+        server.decode_base64_image(data_url("image/png", payload))
+    assert exc.value.status_code == 400
+
+
+async def test_create_product_rejects_html_disguised_as_an_image(api, db):
+    admin = await make_user(db, "admin")
+    body = {
+        "name": "Milk", "category": "milk", "price": 30, "unit": "1L",
+        "image": data_url("text/html", b"<script>alert(document.cookie)</script>"),
+    }
+
+    r = await api.post("/api/products", json=body, headers=auth(admin))
+
+    assert r.status_code == 400
+    assert await db.products.count_documents({}) == 0
+
+
+class MemoryBucket:
+    """Enough of GridFS to store a blob and read it back."""
+
+    class Download:
+        def __init__(self, data: bytes):
+            self.data = data
+
+        async def read(self) -> bytes:
+            return self.data
+
+    def __init__(self, db):
+        self.db, self.blobs = db, {}
+
+    async def upload_from_stream_with_id(self, file_id, filename, data, metadata=None):
+        await self.db["images.files"].insert_one({"_id": file_id, "filename": filename, "metadata": metadata})
+        self.blobs[filename] = data
+
+    async def open_download_stream_by_name(self, filename):
+        return self.Download(self.blobs[filename])
+
+
+async def product_with_blob(db, monkeypatch, size=(1200, 800)) -> tuple:
+    bucket = MemoryBucket(db)
+    monkeypatch.setattr(server, "image_bucket", bucket)
+    out = io.BytesIO()
+    Image.new("RGB", size, "red").save(out, format="PNG")
+    admin = await make_user(db, "admin")
+    image_id = await server.store_blob(out.getvalue(), "image/png")
+    await db.products.insert_one({
+        "id": "p1", "name": "Milk", "category": "milk", "price": 30.0, "unit": "1L", "admin_id": admin["id"],
+        "image_type": "blob", "image_id": image_id, "image_variants": None,
+    })
+    return bucket, image_id
+
+
+async def test_variants_are_rendered_in_a_spawned_worker_and_attached(api, db, monkeypatch):
+    monkeypatch.setattr(server, "IMAGE_WORKERS", 1)
+    bucket, image_id = await product_with_blob(db, monkeypatch)
+    before = (await api.get("/api/catalog/products", params={"variant": "thumb"})).json()
+    try:
+        await server.generate_image_variants(image_id)
+        assert server.image_executor._mp_context.get_start_method() == "spawn"
+    finally:
+        server.shutdown_image_executor()
+    assert server.image_executor is None
+
+    product = await db.products.find_one({"id": "p1"})
+    assert set(product["image_variants"]) == set(server.IMAGE_VARIANTS)
+    for name, (max_side, fmt) in server.IMAGE_VARIANTS.items():
+        variant = Image.open(io.BytesIO(bucket.blobs[product["image_variants"][name]]))
+        assert (variant.format, max(variant.size)) == (fmt, max_side)
+
+    # the cached catalog still pointing at the original was dropped
+    after = (await api.get("/api/catalog/products", params={"variant": "thumb"})).json()
+    assert before[0]["image"].endswith(f"/api/images/{image_id}")
+    assert after[0]["image"].endswith(f"/api/images/{product['image_variants']['thumb']}")
+
+
+async def test_catalog_falls_back_to_the_original_until_variants_exist(api, db, monkeypatch):
+    _, image_id = await product_with_blob(db, monkeypatch)
+
+    for variant in ("card", "thumb"):
+        products = (await api.get("/api/catalog/products", params={"variant": variant})).json()
+        assert products[0]["image"].endswith(f"/api/images/{image_id}")
+    assert (await api.get("/api/catalog/products", params={"variant": "huge"})).status_code == 400
+
+
+def test_small_images_are_not_upscaled():
+    out = io.BytesIO()
+    Image.new("P", (100, 60)).save(out, format="PNG")
+
+    variants = server.render_image_variants(out.getvalue())
+
+    for data, content_type in variants.values():
+        assert Image.open(io.BytesIO(data)).size == (100, 60)
+        assert content_type == "image/webp"
@@ -0,0 +1,88 @@
+import logging
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+class IndexStats:
+    """$indexStats for a mongomock collection, which has no such stage."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def aggregate(self, pipeline):
+        assert pipeline == [{"$indexStats": {}}]
+        return self
+
+    async def to_list(self, length=None):
+        return [{"name": name, "accesses": {"ops": 0}} for name in await self._collection.index_information()]
+
+
+class ExplainingDatabase:
+    """Answers explain with an IXSCAN plan, or a COLLSCAN for the collections in `unindexed`."""
+
+    def __init__(self, database, unindexed: set):
+        self._database, self._unindexed = database, unindexed
+
+    def __getitem__(self, name):
+        return IndexStats(self._database[name])
+
+    async def command(self, name, find_cmd, verbosity=None):
+        assert name == "explain"
+        if find_cmd["find"] in self._unindexed:
+            plan = {"stage": "COLLSCAN"}
+        else:
+            plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "some_index"}}
+        if "sort" in find_cmd and find_cmd["find"] in self._unindexed:
+            plan = {"stage": "SORT", "inputStage": plan}
+        return {"queryPlanner": {"winningPlan": plan}}
+
+
+async def test_startup_builds_every_declared_index(db):
+    await server.ensure_indexes()
+
+    for collection_name, models in server.INDEXES.items():
+        existing = set(await db[collection_name].index_information())
+        assert {m.document["name"] for m in models} <= existing, collection_name
+
+
+async def test_index_bootstrap_is_idempotent_and_survives_a_bad_index(db, caplog):
+    await db.users.insert_many([{"id": "a", "email": "dup@example.com"}, {"id": "b", "email": "dup@example.com"}])
+
+    with caplog.at_level(logging.INFO, logger="server"):
+        await server.ensure_indexes()
+    assert "email_unique" not in await db.users.index_information()
+    assert any("users.email_unique" in r.message for r in caplog.records if r.levelno == logging.ERROR)
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger="server"):
+        await server.ensure_indexes()
+    assert [r.message for r in caplog.records if "Created index" in r.message] == []
+
+
+def test_plan_helpers_walk_nested_stages():
+    plan = {"stage": "SORT", "inputStage": {"stage": "OR", "inputStages": [
+        {"stage": "IXSCAN", "indexName": "a"}, {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "b"}}
+    ]}}
+    assert server._plan_stages(plan) == ["SORT", "OR", "IXSCAN", "FETCH", "IXSCAN"]
+    assert server._plan_index_names(plan) == ["a", "b"]
+
+
+async def test_index_report_flags_collection_scans(api, db, monkeypatch):
+    superadmin = await make_user(db, "superadmin")
+    headers = auth(superadmin)
+    await api.get("/api/auth/me", headers=headers)  # warm the user cache before swapping the database
+    await server.ensure_indexes()
+    monkeypatch.setattr(server, "db", ExplainingDatabase(db, unindexed={"checkins"}))
+
+    report = (await api.get("/api/superadmin/indexes/report", headers=headers)).json()
+
+    by_name = {q["query"]: q for q in report["queries"]}
+    assert by_name["rider_checkin"]["collection_scan"] and by_name["rider_checkin"]["in_memory_sort"]
+    assert report["regressions"] == ["rider_checkin"]
+    assert by_name["wallet"]["indexes"] == ["some_index"]
+    assert {i["name"] for i in report["index_usage"]["users"]} >= {"id_unique", "email_unique"}
@@ -0,0 +1,123 @@
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+DAY = "2025-01-06"
+
+
+async def seed(db, customer, admin, **fields):
+    product = {"id": str(uuid.uuid4()), "name": "Milk", "price": 30.0, "unit": "1L", "admin_id": admin["id"]}
+    sub = {
+        "id": str(uuid.uuid4()), "user_id": customer["id"], "product_id": product["id"], "admin_id": admin["id"],
+        "quantity": 1, "pattern": "daily", "start_date": DAY, "end_date": None, "is_active": True, **fields
+    }
+    await db.products.insert_one(product)
+    await db.subscriptions.insert_one(sub)
+    return sub
+
+
+async def test_generation_is_idempotent(db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    await seed(db, customer, admin)
+    await seed(db, customer, admin, pattern="alternate", start_date="2025-01-05")
+
+    first = await server.generate_orders_for_date(db, DAY)
+    again = await server.generate_orders_for_date(db, DAY)
+
+    assert (first["due"], first["created"], first["failed"]) == (1, 1, 0)
+    assert (again["created"], again["existing"]) == (0, 1)
+    assert await db.orders.count_documents({"delivery_date": DAY}) == 1
+
+
+async def test_failed_batch_does_not_stop_the_run(db, monkeypatch):
+    monkeypatch.setattr(server, "ORDER_GENERATION_BATCH", 1)
+    customer = await make_user(db)
+    admins = [await make_user(db, "admin") for _ in range(3)]
+    good = [await seed(db, customer, admins[0]), await seed(db, customer, admins[2])]
+    broken = await seed(db, customer, admins[1])
+    await db.subscriptions.update_one({"id": broken["id"]}, {"$unset": {"product_id": ""}})
+
+    stats = await server.generate_orders_for_date(db, DAY)
+
+    assert (stats["failed"], stats["failed_batches"], stats["created"]) == (1, 1, 2)
+    created = {o["subscription_id"] async for o in db.orders.find({"delivery_date": DAY})}
+    assert created == {s["id"] for s in good}
+
+
+async def test_update_subscription_rejects_malformed_schedule(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    sub = await seed(db, customer, admin)
+    headers = auth(customer)
+    url = f"/api/subscriptions/{sub['id']}"
+
+    assert (await api.put(url, headers=headers, json={"pattern": "custom", "custom_days": ["x"]})).status_code == 422
+    assert (await api.put(url, headers=headers, json={"pattern": "custom", "custom_days": [7]})).status_code == 422
+    assert (await api.put(url, headers=headers, json={"quantity": "many"})).status_code == 422
+    assert (await api.put(url, headers=headers, json={"pattern": "weekly"})).status_code == 422
+    assert (await api.put(url, headers=headers, json={"pattern": "custom"})).status_code == 400
+
+    r = await api.put(url, headers=headers, json={"pattern": "custom", "custom_days": ["4", 1, 1]})
+    assert r.status_code == 200
+    stored = await db.subscriptions.find_one({"id": sub["id"]})
+    assert (stored["pattern"], stored["custom_days"]) == ("custom", [1, 4])
+
+
+async def test_duplicate_key_race_still_rolls_up_the_orders_this_run_inserted(db, monkeypatch):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    subs = [await seed(db, customer, admin) for _ in range(3)]
+    collection_type = type(db.orders)
+    real_bulk_write = collection_type.bulk_write
+
+    async def racing_bulk_write(self, requests, **kwargs):
+        if self.name != "orders":
+            return await real_bulk_write(self, requests, **kwargs)
+        # a concurrent run inserts the last order between our match and our insert
+        result = await real_bulk_write(self, requests[:-1], **kwargs)
+        raise server.BulkWriteError({
+            "writeErrors": [{"index": len(requests) - 1, "code": 11000, "errmsg": "E11000 duplicate key"}],
+            "nMatched": result.matched_count,
+            "upserted": [{"index": i, "_id": _id} for i, _id in result.upserted_ids.items()],
+        })
+
+    monkeypatch.setattr(collection_type, "bulk_write", racing_bulk_write)
+    stats = await server.generate_orders_for_date(db, DAY)
+
+    assert (stats["created"], stats["existing"], stats["failed"]) == (2, 1, 0)
+    rollup = await db.order_rollups.find_one({"admin_id": admin["id"], "date": DAY})
+    assert rollup["orders"] == 2
+    indexed = await db.search_index.count_documents({"kind": "order"})
+    assert indexed == 2
+    assert await db.orders.count_documents({"subscription_id": {"$in": [s["id"] for s in subs]}}) == 2
+
+
+async def test_only_one_worker_runs_the_scheduled_generation(db, monkeypatch):
+    await db.job_leases.create_indexes(server.INDEXES["job_leases"])
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    await seed(db, customer, admin)
+
+    monkeypatch.setattr(server, "LEASE_HOLDER", "worker-a")
+    first = await server.run_scheduled_order_generation(DAY)
+    monkeypatch.setattr(server, "LEASE_HOLDER", "worker-b")
+    second = await server.run_scheduled_order_generation(DAY)
+
+    assert first["created"] == 1
+    assert second is None
+    lease = await db.job_leases.find_one({"job": "generate_orders", "date": DAY})
+    assert lease["holder"] == "worker-a" and lease["stats"]["created"] == 1
+
+
+async def test_expired_lease_can_be_taken_over(db, monkeypatch):
+    await db.job_leases.create_indexes(server.INDEXES["job_leases"])
+    monkeypatch.setattr(server, "LEASE_HOLDER", "worker-a")
+    assert await server.acquire_job_lease(db, "generate_orders", DAY, 3600)
+
+    monkeypatch.setattr(server, "LEASE_HOLDER", "worker-b")
+    assert not await server.acquire_job_lease(db, "generate_orders", DAY, 3600)
+    await db.job_leases.update_one({"date": DAY}, {"$set": {"expires_at": server.datetime.utcnow()}})
+    assert await server.acquire_job_lease(db, "generate_orders", DAY, 3600)
+    assert (await db.job_leases.find_one({"date": DAY}))["holder"] == "worker-b"
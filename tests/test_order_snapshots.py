@@ -0,0 +1,101 @@
+import asyncio
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+DAY = "2025-01-06"
+
+
+async def product_for(db, admin: dict) -> dict:
+    product = {"id": str(uuid.uuid4()), "name": "Milk", "category": "milk", "price": 30.0, "unit": "1L", "admin_id": admin["id"]}
+    await db.products.insert_one(dict(product))
+    return product
+
+
+def bare_order(customer: dict, admin: dict, rider: dict = None, status: str = "assigned") -> dict:
+    """An order as written before snapshots existed: ids only."""
+    return {
+        "id": str(uuid.uuid4()), "subscription_id": str(uuid.uuid4()), "user_id": customer["id"],
+        "admin_id": admin["id"], "admin_name": admin["name"], "delivery_partner_id": rider["id"] if rider else None,
+        "status": status, "delivery_date": DAY, "delivery_slot": server.DELIVERY_SLOT, "total_amount": 30.0,
+        "items": [{"product_id": "p1", "product_name": "Milk", "quantity": 1, "price": 30.0}],
+        "created_at": server.datetime.utcnow(),
+    }
+
+
+async def drain_background_tasks():
+    await asyncio.gather(*list(server._background_tasks))
+
+
+async def test_orders_are_created_with_the_customer_snapshot(api, db):
+    customer, admin = await make_user(db, name="Asha", phone="9000000001"), await make_user(db, "admin")
+    product = await product_for(db, admin)
+    r = await api.post("/api/subscriptions", headers=auth(customer), json={
+        "product_id": product["id"], "quantity": 1, "pattern": "daily", "start_date": DAY
+    })
+    assert r.status_code == 200
+    await server.generate_orders_for_date(db, "2025-01-07")
+
+    orders = await db.orders.find({"user_id": customer["id"]}).to_list(None)
+    assert len(orders) == 2
+    assert {(o["customer_name"], o["customer_phone"]) for o in orders} == {("Asha", "9000000001")}
+
+
+async def test_assignment_writes_the_rider_snapshot(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", name="Ravi", phone="9000000002", assigned_admin_ids=[admin["id"]])
+    assigned, accepted = bare_order(customer, admin, status="unassigned"), bare_order(customer, admin, status="unassigned")
+    await db.orders.insert_many([assigned, accepted])
+
+    r = await api.put(f"/api/admin/orders/{assigned['id']}/assign", params={"partner_id": rider["id"]}, headers=auth(admin))
+    assert r.status_code == 200
+    r = await api.post(f"/api/delivery/orders/{accepted['_id']}/accept", headers=auth(rider))
+    assert r.status_code == 200
+
+    for order in (assigned, accepted):
+        saved = await db.orders.find_one({"id": order["id"]})
+        assert (saved["delivery_partner_name"], saved["delivery_partner_phone"]) == ("Ravi", "9000000002")
+
+
+async def test_profile_edit_refreshes_open_orders_only(api, db):
+    customer, admin = await make_user(db, name="Asha"), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", name="Ravi")
+    open_order = {**bare_order(customer, admin, rider), "customer_name": "Asha", "delivery_partner_name": "Ravi"}
+    delivered = {**bare_order(customer, admin, rider, "delivered"), "customer_name": "Asha", "delivery_partner_name": "Ravi"}
+    await db.orders.insert_many([open_order, delivered])
+
+    assert (await api.put("/api/auth/profile", headers=auth(customer), json={"name": "Asha K", "phone": "9111111111"})).status_code == 200
+    assert (await api.put("/api/auth/profile", headers=auth(rider), json={"name": "Ravi S"})).status_code == 200
+
+    saved_open = await db.orders.find_one({"id": open_order["id"]})
+    assert (saved_open["customer_name"], saved_open["customer_phone"]) == ("Asha K", "9111111111")
+    assert saved_open["delivery_partner_name"] == "Ravi S"
+    saved_delivered = await db.orders.find_one({"id": delivered["id"]})
+    assert (saved_delivered["customer_name"], saved_delivered["delivery_partner_name"]) == ("Asha", "Ravi")
+
+
+async def test_old_orders_are_filled_from_one_users_read_and_saved_back(api, db, query_log):
+    admin = await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", name="Ravi")
+    customers = [await make_user(db, name=f"Customer {i}") for i in range(3)]
+    await db.orders.insert_many([bare_order(c, admin, rider) for c in customers for _ in range(2)])
+    headers = auth(admin)
+    await api.get("/api/auth/me", headers=headers)  # warm the user cache
+    query_log.clear()
+
+    board = (await api.get("/api/admin/orders", headers=headers)).json()
+
+    assert sorted({o["customer_name"] for o in board}) == ["Customer 0", "Customer 1", "Customer 2"]
+    assert {o["delivery_partner_name"] for o in board} == {"Ravi"}
+    assert query_log.count(("users", "find")) == 1
+    await drain_background_tasks()
+    assert await db.orders.count_documents({"customer_name": None}) == 0
+
+    query_log.clear()
+    await api.get("/api/admin/orders", headers=headers)
+    assert ("users", "find") not in query_log
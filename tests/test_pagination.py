@@ -0,0 +1,39 @@
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+PAGED_PATHS = [
+    "/api/products", "/api/catalog/products", "/api/wallet/transactions", "/api/orders",
+    "/api/delivery/available", "/api/delivery/my-orders", "/api/superadmin/users",
+    "/api/superadmin/orders", "/api/admin/orders",
+]
+
+
+@pytest.mark.parametrize("path", PAGED_PATHS)
+def test_openapi_documents_paged_array_and_cursor_header(path):
+    response = server.app.openapi()["paths"][path]["get"]["responses"]["200"]
+
+    assert response["content"]["application/json"]["schema"]["type"] == "array"
+    assert "X-Next-Cursor" in response["headers"]
+
+
+async def test_product_sparse_fields_page_through_cursor_header(api, db):
+    admin = await make_user(db, "admin")
+    for i in range(3):
+        await db.products.insert_one({
+            "id": f"p{i}", "name": f"Milk {i}", "category": "milk", "price": 30.0, "unit": "1L",
+            "admin_id": admin["id"], "created_at": server.datetime(2025, 1, 1 + i),
+        })
+
+    first = await api.get("/api/products?limit=2&fields=name", headers=auth(admin))
+    assert [p["name"] for p in first.json()] == ["Milk 2", "Milk 1"]
+    assert set(first.json()[0]) == {"name"}
+
+    second = await api.get(
+        f"/api/products?limit=2&fields=name&cursor={first.headers['x-next-cursor']}", headers=auth(admin)
+    )
+    assert [p["name"] for p in second.json()] == ["Milk 0"]
+    assert "x-next-cursor" not in second.headers
@@ -0,0 +1,155 @@
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+DAY = "2025-01-06"
+NEXT_DAY = "2025-01-07"
+
+
+def normalized(rollups: list) -> dict:
+    """{(admin_id, date): (orders, amount, {status: (count, amount)})} without emptied buckets."""
+    out = {}
+    for r in rollups:
+        statuses = {
+            status: (b["count"], round(b["amount"], 2))
+            for status, b in r.get("status", {}).items() if b["count"] or b["amount"]
+        }
+        if r["orders"] or statuses:
+            out[(r["admin_id"], r["date"])] = (r["orders"], round(r["amount"], 2), statuses)
+    return out
+
+
+def status_update(api, rider: dict, order: dict, status: str):
+    return api.post(
+        "/api/delivery/status-update", headers=auth(rider), json={"order_id": str(order["_id"]), "status": status}
+    )
+
+
+def placed_order(customer: dict, admin: dict, rider: dict, day: str = DAY) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "user_id": customer["id"], "admin_id": admin["id"],
+        "delivery_partner_id": rider["id"], "status": "assigned", "delivery_date": day, "total_amount": 30.0,
+    }
+
+
+async def all_time_totals(db) -> dict:
+    totals = await db.order_totals.find_one({"_id": server.ALL_TIME_TOTALS}, {"_id": 0})
+    return normalized([{"admin_id": None, "date": None, **totals}]) if totals else {}
+
+
+async def rollups_match_a_rebuild(db) -> dict:
+    incremental = normalized(await db.order_rollups.find({}, {"_id": 0}).to_list(None))
+    incremental_totals = await all_time_totals(db)
+    await server.rebuild_order_rollups(db)
+    rebuilt = normalized(await db.order_rollups.find({}, {"_id": 0}).to_list(None))
+    assert incremental == rebuilt
+    assert incremental_totals == await all_time_totals(db)
+    return rebuilt
+
+
+async def test_incremental_rollups_equal_a_rebuild_from_orders(api, db):
+    customer = await make_user(db)
+    admins = [await make_user(db, "admin") for _ in range(2)]
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[a["id"] for a in admins])
+    products = []
+    for i, admin in enumerate(admins * 2):
+        product = {
+            "id": str(uuid.uuid4()), "name": f"Milk {i}", "category": "milk", "price": 20.0 + i,
+            "unit": "1L", "admin_id": admin["id"]
+        }
+        await db.products.insert_one(dict(product))
+        products.append(product)
+    customer_headers, rider_headers = auth(customer), auth(rider)
+    line = lambda product, **fields: {
+        "product_id": product["id"], "quantity": 2, "pattern": "daily", "start_date": DAY, **fields
+    }
+
+    r = await api.post("/api/subscriptions/bulk", headers=customer_headers, json=[line(p) for p in products[:3]])
+    assert r.json()["created"] == 3
+    r = await api.post("/api/subscriptions", headers=customer_headers, json=line(products[3], quantity=1))
+    assert r.status_code == 200
+    cancelled_sub = r.json()["id"]
+    generated = await server.generate_orders_for_date(db, NEXT_DAY)
+    assert generated["created"] == 4
+    await rollups_match_a_rebuild(db)
+
+    orders = await db.orders.find({"delivery_date": DAY}).sort("total_amount", 1).to_list(None)
+    accepted, assigned, picked, delivered = orders
+    assert (await api.post(f"/api/delivery/orders/{accepted['_id']}/accept", headers=rider_headers)).status_code == 200
+    owner = next(a for a in admins if a["id"] == assigned["admin_id"])
+    r = await api.put(
+        f"/api/admin/orders/{assigned['id']}/assign", headers=auth(owner), params={"partner_id": rider["id"]}
+    )
+    assert r.status_code == 200
+    for order, status in ((picked, "picked_up"), (picked, "out_for_delivery"), (delivered, "picked_up")):
+        assert (await status_update(api, rider, order, status)).status_code == 200
+    assert (await status_update(api, rider, delivered, "delivered")).status_code == 200
+    await db.orders.update_one({"id": accepted["id"]}, {"$set": {"delivery_partner_id": rider["id"]}})
+    r = await api.post("/api/delivery/complete", headers=rider_headers, json={"order_id": accepted["id"]})
+    assert r.status_code == 200
+    await rollups_match_a_rebuild(db)
+
+    r = await api.delete(f"/api/subscriptions/{cancelled_sub}", headers=customer_headers)
+    assert r.status_code == 200
+    rebuilt = await rollups_match_a_rebuild(db)
+
+    assert sum(orders for orders, _, _ in rebuilt.values()) == 6
+    statuses = {}
+    for _, _, buckets in rebuilt.values():
+        for status, (count, _) in buckets.items():
+            statuses[status] = statuses.get(status, 0) + count
+    assert statuses == {"unassigned": 3, "assigned": 1, "out_for_delivery": 1, "delivered": 1}
+
+
+@pytest.mark.parametrize("status", ["status.$inc", "deli.vered", "$where", "bogus"])
+async def test_unknown_status_is_rejected_before_anything_is_written(api, db, status):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    order = placed_order(customer, admin, rider)
+    await db.orders.insert_one(order)
+    await server.rollup_orders(db, [order])
+
+    r = await status_update(api, rider, order, status)
+
+    assert r.status_code == 422
+    assert (await db.orders.find_one({"id": order["id"]}))["status"] == "assigned"
+    await rollups_match_a_rebuild(db)
+
+
+async def test_picked_up_orders_count_as_pending(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    superadmin = await make_user(db, "superadmin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    today = server.now_ist().strftime("%Y-%m-%d")
+    orders = [placed_order(customer, admin, rider, today) for _ in range(2)]
+    await db.orders.insert_many(orders)
+    await server.rollup_orders(db, orders)
+
+    assert (await status_update(api, rider, orders[0], "picked_up")).status_code == 200
+
+    dashboard = (await api.get("/api/superadmin/dashboard", headers=auth(superadmin))).json()
+    assert dashboard["pending_orders"] == 2
+    today_list = (await api.get("/api/delivery/today", headers=auth(rider))).json()
+    assert len(today_list) == 2
+
+
+async def test_dashboard_all_time_figures_come_from_the_totals_document(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    superadmin = await make_user(db, "superadmin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    old = [placed_order(customer, admin, rider, "2020-01-01") for _ in range(3)]
+    await db.orders.insert_many(old)
+    await server.rollup_orders(db, old)
+    assert (await status_update(api, rider, old[0], "delivered")).status_code == 200
+
+    dashboard = (await api.get("/api/superadmin/dashboard", headers=auth(superadmin))).json()
+
+    assert dashboard["total_orders"] == 3
+    assert dashboard["total_revenue"] == 30.0
+    assert {row["status"]: row["count"] for row in dashboard["orders_by_status"]} == {"assigned": 2, "delivered": 1}
+    await rollups_match_a_rebuild(db)
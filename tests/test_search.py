@@ -0,0 +1,69 @@
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def make_product(db, admin: dict, name: str) -> dict:
+    product = {"id": str(uuid.uuid4()), "name": name, "category": "milk", "price": 30.0, "unit": "1L", "admin_id": admin["id"]}
+    await db.products.insert_one(dict(product))
+    return product
+
+
+async def search(api, user: dict, q: str, **params) -> list:
+    r = await api.get("/api/search", params={"q": q, **params}, headers=auth(user))
+    assert r.status_code == 200
+    return r.json()
+
+
+async def test_rebuild_indexes_products_customers_and_orders_by_prefix(api, db):
+    admin = await make_user(db, "admin")
+    customer = await make_user(db, name="Ramesh Kumar", email="ramesh@example.com")
+    product = await make_product(db, admin, "Buffalo Milk")
+    await db.subscriptions.insert_one({"id": "s1", "user_id": customer["id"], "admin_id": admin["id"]})
+    order_id = str(uuid.uuid4())
+    await db.orders.insert_one({"id": order_id, "admin_id": admin["id"], "delivery_otp": "4821", "delivery_date": "2025-01-01"})
+
+    counts = await server.rebuild_search_index()
+
+    assert counts == {"product": 1, "customer": 1, "order": 1}
+    assert [h["id"] for h in await search(api, admin, "buff")] == [product["id"]]
+    assert [h["id"] for h in await search(api, admin, "ram ku")] == [customer["id"]]
+    assert [h["id"] for h in await search(api, admin, "4821")] == [order_id]
+    assert [h["id"] for h in await search(api, admin, order_id[:6])] == [order_id]
+    assert await search(api, admin, "milk", kind="customer") == []
+    assert await search(api, admin, "buffalo cow") == []
+
+
+async def test_admins_only_see_their_own_entries_and_superadmins_see_all(api, db):
+    admin_a, admin_b = await make_user(db, "admin"), await make_user(db, "admin")
+    superadmin = await make_user(db, "superadmin")
+    product_a = await make_product(db, admin_a, "Cow Milk")
+    product_b = await make_product(db, admin_b, "Cow Ghee")
+    await server.rebuild_search_index()
+
+    assert [h["id"] for h in await search(api, admin_a, "cow")] == [product_a["id"]]
+    assert [h["id"] for h in await search(api, admin_b, "cow")] == [product_b["id"]]
+    assert {h["id"] for h in await search(api, superadmin, "cow")} == {product_a["id"], product_b["id"]}
+
+
+async def test_cancelled_subscription_orders_leave_the_index(api, db):
+    admin = await make_user(db, "admin")
+    customer = await make_user(db)
+    product = await make_product(db, admin, "Cow Milk")
+    r = await api.post("/api/subscriptions", headers=auth(customer), json={
+        "product_id": product["id"], "quantity": 1, "pattern": "daily", "start_date": "2025-01-01"
+    })
+    assert r.status_code == 200
+    order = await db.orders.find_one({"subscription_id": r.json()["id"]})
+    assert [h["id"] for h in await search(api, admin, order["delivery_otp"], kind="order")] == [order["id"]]
+
+    r = await api.delete(f"/api/subscriptions/{r.json()['id']}", headers=auth(customer))
+
+    assert r.status_code == 200
+    assert await search(api, admin, order["delivery_otp"], kind="order") == []
+    assert await db.search_index.count_documents({"kind": "order"}) == 0
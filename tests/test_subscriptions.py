@@ -0,0 +1,310 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_subscriptions(db, customer: dict, count: int, orders_each: int = 3):
+    admin = await make_user(db, "admin")
+    subs = []
+    for i in range(count):
+        product = {"id": str(uuid.uuid4()), "name": f"Milk {i}", "price": 30.0, "unit": "1L", "admin_id": admin["id"]}
+        sub = {
+            "id": str(uuid.uuid4()), "user_id": customer["id"], "product_id": product["id"], "admin_id": admin["id"],
+            "quantity": 1, "pattern": "daily", "start_date": "2025-01-01", "is_active": True,
+            "created_at": datetime(2025, 1, 1) + timedelta(minutes=i),
+        }
+        await db.products.insert_one(product)
+        await db.subscriptions.insert_one(sub)
+        # inserted newest-first so insertion order never matches delivery order
+        for day in range(orders_each, 0, -1):
+            await db.orders.insert_one({
+                "id": str(uuid.uuid4()), "subscription_id": sub["id"], "user_id": customer["id"],
+                "delivery_date": f"2025-01-{day:02d}", "status": "delivered" if day < orders_each else "assigned",
+                "delivery_otp": f"{day:04d}", "created_at": datetime(2025, 1, day),
+            })
+        subs.append(sub)
+    return subs
+
+
+@pytest.mark.parametrize("count", [1, 10])
+async def test_get_subscriptions_query_count_is_constant(api, db, query_log, count):
+    customer = await make_user(db)
+    await seed_subscriptions(db, customer, count)
+    headers = auth(customer)
+    await api.get("/api/auth/me", headers=headers)  # warm the user cache
+    query_log.clear()
+
+    r = await api.get("/api/subscriptions", headers=headers)
+
+    assert r.status_code == 200
+    assert len(r.json()) == count
+    assert query_log == [("subscriptions", "find"), ("products", "find"), ("orders", "aggregate")]
+
+
+async def test_get_subscriptions_picks_latest_order_by_delivery_date(api, db):
+    customer = await make_user(db)
+    await seed_subscriptions(db, customer, 2, orders_each=3)
+
+    r = await api.get("/api/subscriptions", headers=auth(customer))
+
+    assert r.status_code == 200
+    for sub in r.json():
+        assert sub["status"] == "assigned"
+        assert sub["delivery_otp"] == "0003"
+        assert sub["product"]["price"] == 30.0
+
+
+class FailingOrdersDatabase:
+    """Wraps a database so that inserting orders fails, as a write error or lost connection would."""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __getattr__(self, name):
+        collection = self._database[name]
+        if name != "orders":
+            return collection
+
+        class Orders:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            async def insert_many(self, *args, **kwargs):
+                raise RuntimeError("orders insert failed")
+        return Orders()
+
+
+async def make_product(db, admin: dict, **fields) -> dict:
+    product = {"id": str(uuid.uuid4()), "name": "Milk", "price": 30.0, "unit": "1L", "admin_id": admin["id"], **fields}
+    await db.products.insert_one(dict(product))
+    return product
+
+
+def line(product_id: str, **fields) -> dict:
+    return {"product_id": product_id, "quantity": 1, "pattern": "daily", "start_date": "2025-01-01", **fields}
+
+
+async def test_bulk_checkout_reports_each_line(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    milk = await make_product(db, admin)
+    curd = await make_product(db, admin, name="Curd")
+    ghee = await make_product(db, admin, name="Ghee", is_available=False)
+
+    r = await api.post("/api/subscriptions/bulk", headers=auth(customer), json=[
+        line(milk["id"]),
+        line("no-such-product"),
+        line(ghee["id"]),
+        line(milk["id"], quantity=2),  # same schedule as line 0
+        line(milk["id"], pattern="alternate"),
+        line(curd["id"], start_date="01-01-2025"),
+        line(curd["id"], quantity=0),
+        line(curd["id"], quantity=3),
+    ])
+
+    assert r.status_code == 200
+    body = r.json()
+    assert (body["created"], body["failed"]) == (3, 5)
+    assert [(res["index"], res["status"], res.get("detail")) for res in body["results"]] == [
+        (0, "created", None),
+        (1, "error", "Product not found"),
+        (2, "error", "Product unavailable"),
+        (3, "error", "Duplicate of line 0"),
+        (4, "created", None),
+        (5, "error", "start_date must be YYYY-MM-DD"),
+        (6, "error", "Quantity must be at least 1"),
+        (7, "created", None),
+    ]
+    created = [res for res in body["results"] if res["status"] == "created"]
+    subs = await db.subscriptions.find({"user_id": customer["id"]}).to_list(None)
+    orders = await db.orders.find({"user_id": customer["id"]}).to_list(None)
+    assert {s["id"] for s in subs} == {res["subscription_id"] for res in created}
+    assert {o["id"] for o in orders} == {res["order_id"] for res in created}
+    assert {o["subscription_id"] for o in orders} == {s["id"] for s in subs}
+    assert [res["subscription"]["quantity"] for res in created] == [1, 1, 3]
+
+
+async def test_bulk_checkout_with_no_valid_lines_writes_nothing(api, db):
+    customer = await make_user(db)
+
+    r = await api.post("/api/subscriptions/bulk", headers=auth(customer), json=[line("missing")])
+
+    assert r.status_code == 200
+    assert (r.json()["created"], r.json()["failed"]) == (0, 1)
+    assert await db.subscriptions.count_documents({}) == 0
+    assert await db.orders.count_documents({}) == 0
+
+
+async def test_bulk_checkout_is_all_or_nothing_when_a_write_fails(api, db, monkeypatch):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    products = [await make_product(db, admin, name=f"Milk {i}") for i in range(3)]
+    monkeypatch.setattr(server, "db", FailingOrdersDatabase(db))
+
+    with pytest.raises(RuntimeError):
+        await api.post("/api/subscriptions/bulk", headers=auth(customer), json=[line(p["id"]) for p in products])
+
+    assert await db.subscriptions.count_documents({}) == 0
+    assert await db.orders.count_documents({}) == 0
+    assert await db.order_rollups.count_documents({}) == 0
+
+
+class PartialWriteDatabase:
+    """Wraps a database so that the first call of one collection method applies part of its
+    writes, then fails; later calls (the undo) go through."""
+
+    def __init__(self, database, collection_name: str, method: str, partial):
+        self._database, self._name, self._method, self._partial = database, collection_name, method, partial
+        self.failed = False
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __getattr__(self, name):
+        collection = self._database[name]
+        if name != self._name:
+            return collection
+        wrapper = self
+
+        class Wrapped:
+            def __getattr__(self, attr):
+                if attr == wrapper._method and not wrapper.failed:
+                    wrapper.failed = True
+                    return lambda *args, **kwargs: wrapper._partial(collection, *args, **kwargs)
+                return getattr(collection, attr)
+        return Wrapped()
+
+
+async def insert_first_then_fail(collection, docs, session=None):
+    await collection.insert_many(docs[:1])
+    raise server.BulkWriteError({"nInserted": 1, "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000"}]})
+
+
+async def apply_all_but_one_then_fail(collection, requests, ordered=True, session=None):
+    await collection.bulk_write(requests[1:], ordered=False)
+    raise server.BulkWriteError({"nModified": len(requests) - 1, "writeErrors": [{"index": 0, "code": 2, "errmsg": "bad $inc"}]})
+
+
+async def fail_totals(collection, *args, **kwargs):
+    raise RuntimeError("totals update failed")
+
+
+@pytest.mark.parametrize("collection_name, method, partial, error", [
+    ("subscriptions", "insert_many", insert_first_then_fail, server.BulkWriteError),
+    ("orders", "insert_many", insert_first_then_fail, server.BulkWriteError),
+    ("order_rollups", "bulk_write", apply_all_but_one_then_fail, server.BulkWriteError),
+    ("order_totals", "update_one", fail_totals, RuntimeError),
+])
+async def test_partial_bulk_checkout_is_undone_without_transactions(api, db, monkeypatch, collection_name, method, partial, error):
+    customer = await make_user(db)
+    admins = [await make_user(db, "admin") for _ in range(3)]
+    products = [await make_product(db, admin, name=f"Milk {i}") for i, admin in enumerate(admins)]
+    monkeypatch.setattr(server, "db", PartialWriteDatabase(db, collection_name, method, partial))
+
+    with pytest.raises(error):
+        await api.post("/api/subscriptions/bulk", headers=auth(customer), json=[line(p["id"]) for p in products])
+
+    assert await db.subscriptions.count_documents({}) == 0
+    assert await db.orders.count_documents({}) == 0
+    rollups = await db.order_rollups.find({}, {"_id": 0, "orders": 1, "amount": 1}).to_list(None)
+    assert all(r == {"orders": 0, "amount": 0} for r in rollups)
+    assert await db.order_totals.count_documents({"orders": {"$ne": 0}}) == 0
+
+
+def future_day(offset: int) -> str:
+    return (server.now_ist() + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+
+async def new_subscription(db, customer: dict) -> dict:
+    sub = (await seed_subscriptions(db, customer, 1, orders_each=0))[0]
+    # as build_subscription writes it
+    await db.subscriptions.update_one({"id": sub["id"]}, {"$set": {"modifications": {}}})
+    return sub
+
+
+async def test_concurrent_modifications_of_different_dates_both_survive(api, db, interleaving):
+    customer = await make_user(db)
+    sub = await new_subscription(db, customer)
+    headers = auth(customer)
+    url = f"/api/subscriptions/{sub['id']}/modify"
+
+    for _ in range(5):
+        responses = await asyncio.gather(*[
+            api.post(url, headers=headers, json={"date": future_day(day), "quantity": day}) for day in range(1, 6)
+        ])
+        assert {r.status_code for r in responses} == {200}
+
+    saved = await db.subscriptions.find_one({"id": sub["id"]})
+    assert saved["modifications"] == {future_day(day): day for day in range(1, 6)}
+
+
+async def test_modifying_a_date_again_replaces_only_that_date(api, db):
+    customer = await make_user(db)
+    sub = await new_subscription(db, customer)
+    url, headers = f"/api/subscriptions/{sub['id']}/modify", auth(customer)
+
+    await api.post(url, headers=headers, json={"date": future_day(1), "quantity": 3})
+    await api.post(url, headers=headers, json={"date": future_day(2), "quantity": 0})
+    r = await api.post(url, headers=headers, json={"date": future_day(1), "quantity": 2})
+
+    assert r.json()["modifications"] == {future_day(1): 2, future_day(2): 0}
+
+
+@pytest.mark.parametrize("body, status", [
+    ({"date": "2020-01-01", "quantity": 1}, 400),
+    ({"date": "tomorrow", "quantity": 1}, 400),
+    ({"date": "2999-01-01", "quantity": -1}, 400),
+])
+async def test_modification_rejects_past_dates_and_bad_input(api, db, body, status):
+    customer = await make_user(db)
+    sub = await new_subscription(db, customer)
+
+    r = await api.post(f"/api/subscriptions/{sub['id']}/modify", headers=auth(customer), json=body)
+
+    assert r.status_code == status
+    assert (await db.subscriptions.find_one({"id": sub["id"]}))["modifications"] == {}
+
+
+async def test_modifying_someone_elses_subscription_is_not_found(api, db):
+    owner, stranger = await make_user(db), await make_user(db)
+    sub = await new_subscription(db, owner)
+
+    r = await api.post(f"/api/subscriptions/{sub['id']}/modify", headers=auth(stranger), json={"date": future_day(1), "quantity": 2})
+
+    assert r.status_code == 404
+
+
+async def test_expired_modification_dates_are_pruned(db):
+    await db.subscriptions.insert_many([
+        {"id": "a", "modifications": {"2025-01-04": 0, "2025-01-05": 2, "2025-01-06": 3, "2025-01-09": 1}},
+        {"id": "b", "modifications": {"2025-01-01": 2}},
+        {"id": "c", "modifications": {}},
+    ])
+
+    assert await server.prune_expired_modifications(db, "2025-01-06") == 2
+
+    saved = {s["id"]: s["modifications"] async for s in db.subscriptions.find({})}
+    assert saved == {"a": {"2025-01-06": 3, "2025-01-09": 1}, "b": {}, "c": {}}
+
+
+async def test_legacy_modification_lists_are_converted_to_date_maps(db):
+    await db.subscriptions.insert_many([
+        {"id": "legacy", "modifications": [{"date": "2025-01-06", "quantity": 0}, {"date": "2025-01-07", "quantity": 4}]},
+        {"id": "current", "modifications": {"2025-01-06": 1}},
+    ])
+    legacy = await db.subscriptions.find_one({"id": "legacy"})
+    assert server.subscription_modifications(legacy) == {"2025-01-06": 0, "2025-01-07": 4}
+
+    assert await server.convert_modification_lists(db) == 1
+
+    saved = {s["id"]: s["modifications"] async for s in db.subscriptions.find({})}
+    assert saved == {"legacy": {"2025-01-06": 0, "2025-01-07": 4}, "current": {"2025-01-06": 1}}
+    assert await server.convert_modification_lists(db) == 0
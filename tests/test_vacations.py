@@ -0,0 +1,105 @@
+import asyncio
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+
+def test_overlapping_adjacent_and_separate_ranges_merge():
+    merged = server.merge_intervals([
+        ("2025-01-10", "2025-01-12"),
+        ("2025-01-01", "2025-01-05"),
+        ("2025-01-03", "2025-01-04"),  # inside the first
+        ("2025-01-06", "2025-01-07"),  # starts the day after: adjacent
+        ("2025-01-13", "2025-01-13"),  # adjacent to 10..12
+        ("2025-01-20", "2025-01-21"),
+    ])
+
+    assert merged == [
+        {"start_date": "2025-01-01", "end_date": "2025-01-07"},
+        {"start_date": "2025-01-10", "end_date": "2025-01-13"},
+        {"start_date": "2025-01-20", "end_date": "2025-01-21"},
+    ]
+
+
+def test_malformed_ranges_are_skipped():
+    merged = server.merge_intervals([
+        ("2025-01-01", "2025-01-02"),
+        (None, "2025-01-05"),
+        ("01/03/2025", "2025-01-05"),
+        ("2025-01-09", "soon"),
+        ("2025-01-09", "2025-01-08"),
+        ("2025-1-3", "2025-1-4"),  # parseable, stored unpadded: normalized
+    ])
+
+    assert merged == [{"start_date": "2025-01-01", "end_date": "2025-01-04"}]
+
+
+@pytest.mark.anyio
+async def test_users_away_on(db):
+    away, home, legacy = (str(uuid.uuid4()) for _ in range(3))
+    await db.vacations.insert_many([
+        {"id": "v1", "user_id": away, "start_date": "2025-01-01", "end_date": "2025-01-03"},
+        {"id": "v2", "user_id": away, "start_date": "2025-01-04", "end_date": "2025-01-04"},
+        {"id": "v3", "user_id": home, "start_date": "2025-02-01", "end_date": "2025-02-03"},
+        {"id": "v4", "user_id": legacy, "start_date": "2025-01-02"},
+        {"id": "v5", "user_id": legacy, "start_date": "2025-01-04", "end_date": "2025-01-04"},
+    ])
+
+    assert await server.rebuild_vacation_intervals(db) == 3
+
+    users = [away, home, legacy]
+    assert await server.users_away_on(db, users, "2025-01-04") == {away, legacy}
+    assert await server.users_away_on(db, users, "2025-01-02") == {away}
+    assert await server.users_away_on(db, users, "2025-01-05") == set()
+    assert await server.users_away_on(db, [home], "2025-01-03") == set()
+
+
+@pytest.mark.anyio
+async def test_malformed_legacy_vacation_does_not_break_create_or_delete(api, db):
+    customer = await make_user(db)
+    await db.vacations.insert_one({"id": "legacy", "user_id": customer["id"], "start_date": "yesterday", "end_date": None})
+    headers = auth(customer)
+
+    r = await api.post("/api/vacations", headers=headers, json={"start_date": "2025-03-01", "end_date": "2025-03-02"})
+    assert r.status_code == 200
+    assert await server.users_away_on(db, [customer["id"]], "2025-03-02") == {customer["id"]}
+
+    r = await api.delete(f"/api/vacations/{r.json()['id']}", headers=headers)
+    assert r.status_code == 200
+    assert await server.users_away_on(db, [customer["id"]], "2025-03-02") == set()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("seed", range(5))
+async def test_concurrent_vacation_writes_all_reach_the_intervals(api, db, interleaving, seed):
+    await db.vacation_intervals.create_indexes(server.INDEXES["vacation_intervals"])
+    server.db._rng.seed(seed)
+    customer = await make_user(db)
+    headers = auth(customer)
+    days = [f"2025-03-{d:02d}" for d in (1, 4, 7, 10, 13, 16)]
+
+    responses = await asyncio.gather(*[
+        api.post("/api/vacations", headers=headers, json={"start_date": d, "end_date": d}) for d in days
+    ])
+
+    assert {r.status_code for r in responses} == {200}
+    doc = await db.vacation_intervals.find_one({"user_id": customer["id"]})
+    assert doc["intervals"] == [{"start_date": d, "end_date": d} for d in days]
+    assert doc["version"] >= 1
+
+
+@pytest.mark.anyio
+async def test_refresh_upgrades_a_document_written_before_versions(db):
+    await db.vacation_intervals.create_indexes(server.INDEXES["vacation_intervals"])
+    await db.vacations.insert_one({"id": "v1", "user_id": "u1", "start_date": "2025-01-01", "end_date": "2025-01-02"})
+    await db.vacation_intervals.insert_one({"user_id": "u1", "intervals": []})
+
+    assert await server.refresh_vacation_intervals(db, "u1") == [{"start_date": "2025-01-01", "end_date": "2025-01-02"}]
+    await db.vacations.delete_many({})
+    assert await server.refresh_vacation_intervals(db, "u1") == []
+
+    doc = await db.vacation_intervals.find_one({"user_id": "u1"})
+    assert (doc["intervals"], doc["version"]) == ([], 2)
@@ -0,0 +1,264 @@
+import asyncio
+import random
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import auth, make_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def make_order(db, customer, admin, rider, amount: float) -> dict:
+    order = {
+        "id": str(uuid.uuid4()), "user_id": customer["id"], "admin_id": admin["id"],
+        "delivery_partner_id": rider["id"], "status": "assigned", "delivery_date": "2025-01-06",
+        "total_amount": amount, "items": [{"product_id": "p1", "product_name": "Milk", "quantity": 1, "price": amount}],
+    }
+    await db.orders.insert_one(dict(order))
+    return await db.orders.find_one({"id": order["id"]})
+
+
+async def balances(db, users) -> dict:
+    return {u["id"]: (await db.wallets.find_one({"user_id": u["id"]}) or {}).get("balance", 0.0) for u in users}
+
+
+async def test_concurrent_wallet_traffic_conserves_money(api, db, interleaving):
+    await db.settlement_batches.create_indexes(server.INDEXES["settlement_batches"])
+    rng = random.Random(42)
+    customers = [await make_user(db) for _ in range(4)]
+    admins = [await make_user(db, "admin") for _ in range(2)]
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[a["id"] for a in admins])
+    orders = [
+        await make_order(db, rng.choice(customers), rng.choice(admins), rider, float(rng.randint(20, 80)))
+        for _ in range(40)
+    ]
+
+    money_in = {c["id"]: 0.0 for c in customers}
+    calls = []
+    for order in orders:
+        # every order is delivered three times over, through both endpoints
+        calls.append(api.post("/api/delivery/complete", headers=auth(rider), json={"order_id": order["id"]}))
+        calls.append(api.post("/api/delivery/complete", headers=auth(rider), json={"order_id": order["id"]}))
+        calls.append(api.post("/api/delivery/status-update", headers=auth(rider),
+                              json={"order_id": str(order["_id"]), "status": "delivered"}))
+    for _ in range(30):
+        customer, amount = rng.choice(customers), float(rng.randint(10, 200))
+        money_in[customer["id"]] += amount
+        calls.append(api.post("/api/wallet/recharge", headers=auth(customer), json={"amount": amount}))
+    for _ in range(10):
+        customer, amount = rng.choice(customers), float(rng.randint(1, 30))
+        money_in[customer["id"]] += amount
+        calls.append(api.post("/api/admin/refund", headers=auth(rng.choice(admins)),
+                              params={"user_id": customer["id"], "amount": amount, "reason": "spilt"}))
+    rng.shuffle(calls)
+    calls += [server.settle_admin_credits() for _ in range(5)]
+
+    responses = await asyncio.gather(*calls)
+    assert all(r.status_code == 200 for r in responses if hasattr(r, "status_code"))
+    await server.settle_admin_credits()
+
+    customer_balances = await balances(db, customers)
+    admin_balances = await balances(db, admins)
+    charged = {c["id"]: 0.0 for c in customers}
+    earned = {a["id"]: 0.0 for a in admins}
+    for order in orders:
+        charged[order["user_id"]] += order["total_amount"]
+        earned[order["admin_id"]] += order["total_amount"]
+
+    # Each order is debited exactly once and every rupee ends up in exactly one wallet
+    assert await db.wallet_transactions.count_documents({"type": "debit", "order_id": {"$exists": True}}) == len(orders)
+    for c in customers:
+        assert customer_balances[c["id"]] == pytest.approx(money_in[c["id"]] - charged[c["id"]])
+    for a in admins:
+        assert admin_balances[a["id"]] == pytest.approx(earned[a["id"]])
+    assert sum(customer_balances.values()) + sum(admin_balances.values()) == pytest.approx(sum(money_in.values()))
+    assert await db.settlement_buffer.count_documents({"settled_at": None}) == 0
+    assert (await server.reconcile_settlements())["balanced"]
+
+    # Every wallet's balance is the sum of its own ledger
+    for user in customers + admins:
+        ledger = await db.wallet_transactions.find({"user_id": user["id"]}).to_list(None)
+        total = sum(e["amount"] if e["type"] == "credit" else -e["amount"] for e in ledger)
+        assert total == pytest.approx((customer_balances | admin_balances)[user["id"]])
+
+
+async def test_failed_charge_leaves_order_undelivered_so_a_retry_charges(api, db, monkeypatch):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    order = await make_order(db, customer, admin, rider, 50.0)
+    real_charge = server.charge_delivery
+
+    async def flaky_charge(order, session=None):
+        monkeypatch.setattr(server, "charge_delivery", real_charge)
+        raise RuntimeError("mongod went away")
+
+    monkeypatch.setattr(server, "charge_delivery", flaky_charge)
+    with pytest.raises(RuntimeError):
+        await api.post("/api/delivery/complete", headers=auth(rider), json={"order_id": order["id"]})
+    assert (await db.orders.find_one({"id": order["id"]}))["status"] == "assigned"
+
+    r = await api.post("/api/delivery/complete", headers=auth(rider), json={"order_id": order["id"]})
+    assert r.json() == {"message": "Delivery marked as complete"}
+    assert (await balances(db, [customer]))[customer["id"]] == -50.0
+    assert await db.settlement_buffer.count_documents({"order_id": order["id"]}) == 1
+
+
+async def test_delivered_order_cannot_move_back_or_be_charged_twice(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    order = await make_order(db, customer, admin, rider, 40.0)
+    status_update = lambda status: api.post(
+        "/api/delivery/status-update", headers=auth(rider), json={"order_id": str(order["_id"]), "status": status}
+    )
+
+    assert (await status_update("delivered")).status_code == 200
+    assert (await status_update("assigned")).status_code == 400
+    r = await api.put(f"/api/admin/orders/{order['id']}/assign", headers=auth(admin), params={"partner_id": rider["id"]})
+    assert r.status_code == 400
+    assert (await db.orders.find_one({"id": order["id"]}))["status"] == "delivered"
+
+    # Even if the status is moved back behind the API's back, the order is charged only once
+    await db.orders.update_one({"id": order["id"]}, {"$set": {"status": "assigned"}})
+    assert (await status_update("delivered")).status_code == 200
+    assert (await db.orders.find_one({"id": order["id"]}))["status"] == "delivered"
+    assert await db.wallet_transactions.count_documents({"order_id": order["id"], "type": "debit"}) == 1
+    assert await db.settlement_buffer.count_documents({"order_id": order["id"]}) == 1
+    assert (await balances(db, [customer]))[customer["id"]] == -40.0
+
+
+async def test_half_finished_charge_is_completed_not_repeated(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    order = await make_order(db, customer, admin, rider, 25.0)
+    # a standalone server that crashed between the debit and the buffer insert
+    await server.apply_wallet_change(customer["id"], -25.0, "debit", "Order delivered - Milk", None, {"order_id": order["id"]})
+
+    r = await api.post("/api/delivery/complete", headers=auth(rider), json={"order_id": order["id"]})
+
+    assert r.json() == {"message": "Delivery marked as complete"}
+    assert await db.wallet_transactions.count_documents({"order_id": order["id"], "type": "debit"}) == 1
+    assert await db.settlement_buffer.count_documents({"order_id": order["id"]}) == 1
+    assert (await balances(db, [customer]))[customer["id"]] == -25.0
+
+
+async def test_daily_opening_balance_survives_out_of_order_movements(db):
+    customer = await make_user(db)
+    # +10 (seq 1) then +20 (seq 2) on a wallet that opened the day at 100, but without a
+    # session the second movement's snapshot upsert can land first
+    await server.record_wallet_day(customer["id"], 20.0, 130.0, 2)
+    await server.record_wallet_day(customer["id"], 10.0, 110.0, 1)
+
+    day = await db.wallet_daily.find_one({"user_id": customer["id"]})
+    assert (day["opening_balance"], day["net"], day["count"]) == (100.0, 30.0, 2)
+
+
+async def deliver(api, rider, order):
+    r = await api.post("/api/delivery/complete", headers=auth(rider), json={"order_id": order["id"]})
+    assert r.status_code == 200
+
+
+async def test_replayed_settlement_batch_credits_once(api, db):
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    await deliver(api, rider, await make_order(db, customer, admin, rider, 30.0))
+    first = await server.settle_admin_credits()
+    first_batch = first["settlements"][0]["batch_id"]
+
+    # far more newer batches than the old per-wallet marker array kept
+    for i in range(105):
+        await deliver(api, rider, await make_order(db, customer, admin, rider, 1.0))
+        assert (await server.settle_admin_credits())["batches"] == 1
+
+    assert await server.apply_settlement_batch(first_batch, admin["id"]) is None
+    await db.settlement_buffer.update_many({"batch_id": first_batch}, {"$set": {"settled_at": None}})
+    assert (await server.settle_admin_credits())["batches"] == 0  # an unsettled-looking batch is not re-credited
+
+    assert (await balances(db, [admin]))[admin["id"]] == pytest.approx(30.0 + 105.0)
+    await db.settlement_buffer.update_many({"batch_id": first_batch}, {"$set": {"settled_at": server.datetime.utcnow()}})
+    report = await server.reconcile_settlements()
+    assert report["balanced"]
+    assert report["unfinished_batches"] == 0
+    assert [(a["settled"], a["credited"]) for a in report["admins"]] == [(135.0, 135.0)]
+
+
+async def test_concurrent_settlement_runs_credit_each_batch_once(api, db, interleaving):
+    await db.settlement_batches.create_indexes(server.INDEXES["settlement_batches"])
+    customer, admin = await make_user(db), await make_user(db, "admin")
+    rider = await make_user(db, "delivery_partner", assigned_admin_ids=[admin["id"]])
+    for amount in (10.0, 20.0, 30.0):
+        await deliver(api, rider, await make_order(db, customer, admin, rider, amount))
+
+    await asyncio.gather(*(server.settle_admin_credits() for _ in range(4)))
+    await server.settle_admin_credits()
+
+    assert (await balances(db, [admin]))[admin["id"]] == pytest.approx(60.0)
+    report = await server.reconcile_settlements()
+    assert report["balanced"] and report["unfinished_batches"] == 0
+
+
+async def test_legacy_wallet_markers_are_migrated(db):
+    admin = await make_user(db, "admin")
+    await db.wallets.insert_one({"user_id": admin["id"], "balance": 15.0, "settled_batches": ["b1"]})
+    await db.settlement_buffer.insert_one(
+        {"order_id": "o1", "admin_id": admin["id"], "amount": 15.0, "batch_id": "b1", "settled_at": None}
+    )
+
+    assert await server.migrate_settlement_markers() == 1
+
+    assert await server.apply_settlement_batch("b1", admin["id"]) is None
+    assert (await db.wallets.find_one({"user_id": admin["id"]}))["balance"] == 15.0
+    assert "settled_batches" not in await db.wallets.find_one({"user_id": admin["id"]})
+    assert await db.settlement_buffer.count_documents({"settled_at": None}) == 0
+
+
+async def test_legacy_ledger_arrays_move_to_wallet_transactions(db):
+    customer = await make_user(db)
+    legacy = [
+        {"id": "t1", "amount": 100.0, "type": "credit", "description": "Wallet recharge", "created_at": "2025-01-01T08:00:00"},
+        {"amount": 30.0, "type": "debit", "description": "Order delivered", "created_at": server.datetime(2025, 1, 2, 7)},
+    ]
+    await db.wallets.update_one({"user_id": customer["id"]}, {"$set": {"balance": 70.0, "transactions": legacy}})
+    # a previous run that stopped before its $unset already moved t1
+    await db.wallet_transactions.insert_one({**legacy[0], "user_id": customer["id"], "created_at": server.datetime(2025, 1, 1, 8)})
+
+    assert await server.migrate_wallet_transactions() == {"wallets": 1, "transactions": 1}
+
+    wallet = await db.wallets.find_one({"user_id": customer["id"]})
+    assert "transactions" not in wallet and wallet["balance"] == 70.0
+    moved = await db.wallet_transactions.find({"user_id": customer["id"]}, {"_id": 0}).sort("created_at", 1).to_list(None)
+    assert [(t["amount"], t["type"]) for t in moved] == [(100.0, "credit"), (30.0, "debit")]
+    assert all(isinstance(t["created_at"], server.datetime) and t["id"] for t in moved)
+    assert await server.migrate_wallet_transactions() == {"wallets": 0, "transactions": 0}
+
+
+async def test_wallet_transactions_page_back_through_history(api, db):
+    customer, other = await make_user(db), await make_user(db)
+    same_time = server.datetime(2025, 1, 5)
+    await db.wallet_transactions.insert_many([
+        {
+            "id": f"t{i:02d}", "user_id": customer["id"], "amount": float(i), "type": "credit",
+            "description": f"Recharge {i}",
+            # a run of equal timestamps in the middle checks the id tiebreak
+            "created_at": same_time if 4 <= i <= 8 else server.datetime(2025, 1, 1) + server.timedelta(hours=i),
+        }
+        for i in range(12)
+    ] + [{"id": "x", "user_id": other["id"], "amount": 1.0, "type": "credit", "created_at": same_time}])
+    headers = auth(customer)
+
+    pages, cursor = [], None
+    while True:
+        r = await api.get("/api/wallet/transactions", params={"limit": 5, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert r.status_code == 200
+        pages.append([t["id"] for t in r.json()])
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            break
+
+    assert [len(p) for p in pages] == [5, 5, 2]
+    seen = [t for page in pages for t in page]
+    assert sorted(seen) == [f"t{i:02d}" for i in range(12)]
+    newest = await db.wallet_transactions.find({"user_id": customer["id"]}).sort(server.PAGE_SORT).to_list(None)
+    # each page is oldest first, and the first page is the latest transactions
+    assert pages[0] == [t["id"] for t in newest[:5]][::-1]